@@ -344,7 +344,7 @@ class Configurator(LogObject):
             typeClass: the WH or Entity class to add
         """
         try:
-            preset = typeClass.ConfigurationPreset()
+            preset = typeClass.GetConfigurationPreset()
 
             if preset.HasQuestions():
 
@@ -373,7 +373,7 @@ class Configurator(LogObject):
 
     def EditActiveConfiguration(self, typeClass, single_config: SingleConfiguration) -> None:
         """ UI for changing settings """
-        preset = typeClass.ConfigurationPreset()
+        preset = typeClass.GetConfigurationPreset()
 
         if preset.HasQuestions():
 
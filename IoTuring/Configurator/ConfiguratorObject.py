@@ -13,7 +13,7 @@ class ConfiguratorObject:
         self.configurations = single_configuration
 
         # Add missing default values:
-        defaults = self.ConfigurationPreset().GetDefaults()
+        defaults = self.GetConfigurationPreset().GetDefaults()
 
         if defaults:
             for default_key, default_value in defaults.items():
@@ -47,6 +47,11 @@ class ConfiguratorObject:
         """ Prepare a preset to manage settings insert/edit for the warehouse or entity """
         return MenuPreset()
 
+    @classmethod
+    def GetConfigurationPreset(cls) -> MenuPreset:
+        """ The preset of this class, with the questions shared by all the classes of its kind (e.g. all entities) """
+        return cls.ConfigurationPreset()
+
     @classmethod
     def AllowMultiInstance(cls):
         """ Return True if this Entity can have multiple instances, useful for customizable entities 
@@ -66,7 +71,7 @@ class ConfiguratorObject:
         """Get the default configuration of this class"""
 
         # Get default configs as dict:
-        config_dict = cls.ConfigurationPreset().GetDefaults()
+        config_dict = cls.GetConfigurationPreset().GetDefaults()
         config_dict[CONFIG_KEY_TYPE] = cls.NAME
 
         return SingleConfiguration(cls.GetClassKey(), config_dict=config_dict)
@@ -248,6 +248,12 @@ class MenuPreset():
         self.AddEntry(name="Tag", key="tag", mandatory=True,
                       instruction="Alias, to recognize entity in configurations and warehouses")
 
+    def AddUpdateIntervalQuestion(self, default: str):
+        """ Add an Update interval question to the preset, for entities that update periodically """
+        self.AddEntry(name="Update interval", key="update_interval", mandatory=True,
+                      default=default,
+                      instruction="fast, normal, slow (set in App settings) or a number of seconds")
+
 
 class BooleanAnswers:
     TRUE_ANSWERS = ["y", "yes", "t", "true", "ok", "okay"]  # all lower !
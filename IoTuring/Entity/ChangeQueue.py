@@ -0,0 +1,66 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from IoTuring.Entity.EntityData import EntitySensor
+    from IoTuring.Entity.EntitySnapshot import SensorSnapshot
+
+import time
+from threading import Condition
+
+
+class ChangeQueue():
+    """ Queue of the snapshots of the EntitySensors changed since the last read.
+        A sensor is queued only once even if it changed many times, with its last snapshot """
+
+    def __init__(self) -> None:
+        self.condition = Condition()
+        # Last snapshot of each changed sensor, in order of first change:
+        self.changedSensors: dict[EntitySensor, SensorSnapshot] = {}
+        # Snapshots to queue later, with their time:
+        self.delayedSensors: dict[EntitySensor, tuple[float, SensorSnapshot]] = {}
+
+    def Put(self, sensorSnapshots: list[SensorSnapshot]) -> None:
+        """ Queue the snapshots of the changed sensors and wake up the reader """
+        with self.condition:
+            for sensorSnapshot in sensorSnapshots:
+                self.changedSensors[sensorSnapshot.GetEntitySensor()] = sensorSnapshot
+            self.condition.notify()
+
+    def PutLater(self, sensorSnapshot: SensorSnapshot, queueTime: float) -> None:
+        """ Queue the snapshot at queueTime (time.monotonic()), e.g. for a change held back by a publish filter.
+            If the sensor is already waiting, its snapshot is replaced and the earliest time is kept """
+        with self.condition:
+            entitySensor = sensorSnapshot.GetEntitySensor()
+            if entitySensor in self.delayedSensors:
+                queueTime = min(queueTime, self.delayedSensors[entitySensor][0])
+            self.delayedSensors[entitySensor] = (queueTime, sensorSnapshot)
+            # The reader waits until this time at most:
+            self.condition.notify()
+
+    def Get(self, timeout: float) -> list[SensorSnapshot]:
+        """ Return the snapshots of the changed sensors and empty the queue. If there are no changes, wait for them at most timeout seconds """
+        with self.condition:
+            endTime = time.monotonic() + max(0, timeout)
+            while True:
+                now = time.monotonic()
+                self.QueueDelayedSensors(now)
+                if self.changedSensors or now >= endTime:
+                    break
+
+                waitTime = endTime - now
+                if self.delayedSensors:
+                    waitTime = min(waitTime, min(
+                        queueTime for queueTime, _ in self.delayedSensors.values()) - now)
+                self.condition.wait(waitTime)
+
+            changedSensors = list(self.changedSensors.values())
+            self.changedSensors.clear()
+            return changedSensors
+
+    def QueueDelayedSensors(self, now: float) -> None:
+        """ Queue the delayed snapshots whose time has come. Called with the condition held """
+        for entitySensor, (queueTime, sensorSnapshot) in list(self.delayedSensors.items()):
+            if queueTime <= now:
+                del self.delayedSensors[entitySensor]
+                # A newer snapshot may be queued already:
+                self.changedSensors.setdefault(entitySensor, sensorSnapshot)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable
+if TYPE_CHECKING:
+    from IoTuring.Entity.EntityData import EntityCommand
+
+import time
+from collections import deque
+from threading import Thread, Condition, Timer
+
+from IoTuring.Logger.LogObject import LogObject
+from IoTuring.Logger.Logger import Singleton
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_COMMAND_WAIT, GAUGE_COMMANDS
+
+# Key in entity configurations and in entities.yaml: seconds in which only the last command received runs
+CONFIG_KEY_COMMAND_DEBOUNCE = "command_debounce"
+
+# Commands waiting to run, then new ones are rejected:
+MAX_PENDING_COMMANDS = 1000
+DEFAULT_COMMAND_WORKERS = 2
+
+
+class CommandTask():
+    """ A callback waiting to run """
+
+    __slots__ = ("entityCommand", "function", "args", "time")
+
+    def __init__(self, entityCommand: EntityCommand, function: Callable, args: tuple) -> None:
+        self.entityCommand = entityCommand
+        self.function = function
+        self.args = args
+        # When it was submitted, to measure the queue wait:
+        self.time = time.monotonic()
+
+
+class CommandExecutor(LogObject, metaclass=Singleton):
+    """ Run command callbacks on a bounded pool of threads, not on the thread that received them (e.g. the MQTT network thread).
+        Callbacks of the same entity run one at a time, in the order they were received. """
+
+    def __init__(self) -> None:
+        self.workers = DEFAULT_COMMAND_WORKERS
+        self.maxPending = MAX_PENDING_COMMANDS
+        self.startedWorkers = 0
+
+        self.condition = Condition()
+        # Tasks of each entity, and the entities with tasks and no running callback, in order:
+        self.pendingTasks: dict = {}
+        self.readyEntities = deque()
+        self.runningEntities = set()
+        self.pending = 0
+
+        # Last task of each command in its debounce window:
+        self.debouncedTasks: dict = {}
+
+        # Tasks rejected because too many were pending:
+        self.rejected = 0
+        # Tasks replaced by a newer one of the same command in its debounce window:
+        self.superseded = 0
+
+        MetricsRegistry().RegisterGauge(GAUGE_COMMANDS, self.GetStats)
+
+    def SetWorkers(self, workers: int) -> None:
+        """ Maximum number of callbacks running at the same time """
+        with self.condition:
+            self.workers = max(1, int(workers))
+
+    def Submit(self, entityCommand: EntityCommand, function: Callable, *args) -> bool:
+        """ Queue function(*args) as a callback of the command. Returns False if rejected because the queue is full """
+        entity = entityCommand.GetEntity()
+
+        with self.condition:
+            if self.pending >= self.maxPending:
+                self.rejected += 1
+                self.Log(self.LOG_WARNING,
+                         f"Too many commands waiting, {entityCommand.GetId()} rejected")
+                return False
+
+            self.pendingTasks.setdefault(entity, deque()).append(
+                CommandTask(entityCommand, function, args))
+            self.pending += 1
+
+            if entity not in self.runningEntities and entity not in self.readyEntities:
+                self.readyEntities.append(entity)
+                self.condition.notify()
+
+            # Threads are started when needed, up to the limit:
+            if self.startedWorkers < min(self.workers, len(self.pendingTasks)):
+                self.startedWorkers += 1
+                thread = Thread(target=self.WorkerThread)
+                thread.daemon = True
+                thread.start()
+
+        return True
+
+    def SubmitDebounced(self, entityCommand: EntityCommand, window: float, function: Callable, *args) -> None:
+        """ Like Submit, but the task is queued at the end of a window of this many seconds, which starts with
+            the first task of the command. Tasks of the command submitted meanwhile replace it: only the last one runs """
+        with self.condition:
+            if entityCommand in self.debouncedTasks:
+                self.debouncedTasks[entityCommand] = (function, args)
+                self.superseded += 1
+                return
+
+            self.debouncedTasks[entityCommand] = (function, args)
+
+        timer = Timer(window, self.EndDebounce, (entityCommand,))
+        timer.daemon = True
+        timer.start()
+
+    def EndDebounce(self, entityCommand: EntityCommand) -> None:
+        """ Queue the last task of the window """
+        with self.condition:
+            function, args = self.debouncedTasks.pop(entityCommand)
+        self.Submit(entityCommand, function, *args)
+
+    def WorkerThread(self) -> None:
+        """ Run the tasks of the ready entities, one entity at a time """
+        while (True):
+            with self.condition:
+                while not self.readyEntities:
+                    self.condition.wait()
+
+                entity = self.readyEntities.popleft()
+                task = self.pendingTasks[entity].popleft()
+                self.pending -= 1
+                self.runningEntities.add(entity)
+
+            MetricsRegistry().Record(MetricsRegistry.MakeName(METRIC_COMMAND_WAIT, task.entityCommand.GetId()),
+                                     time.monotonic() - task.time)
+            try:
+                task.function(*task.args)
+            except Exception as e:
+                self.Log(self.LOG_ERROR,
+                         f"Error in {task.entityCommand.GetId()} callback: {e}")
+
+            with self.condition:
+                self.runningEntities.discard(entity)
+                if self.pendingTasks[entity]:
+                    self.readyEntities.append(entity)
+                    self.condition.notify()
+                else:
+                    del self.pendingTasks[entity]
+
+    def GetStats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "running": len(self.runningEntities),
+            "rejected": self.rejected,
+            "superseded": self.superseded
+        }
@@ -1,5 +1,6 @@
 import requests
 from IoTuring.Entity.Entity import Entity
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import UPDATE_TIER_SLOW
 from IoTuring.Entity.EntityData import EntitySensor
 from IoTuring.MyApp.App import App
 
@@ -15,6 +16,7 @@ EXTRA_ATTRIBUTE_UPDATE_ERROR = 'Check error'
 
 class AppInfo(Entity):
     NAME = "AppInfo"
+    DEFAULT_UPDATE_TIER = UPDATE_TIER_SLOW
 
     def Initialize(self):
         self.RegisterEntitySensor(EntitySensor(self, KEY_NAME))
@@ -23,7 +25,6 @@ class AppInfo(Entity):
 
         self.SetEntitySensorValue(KEY_NAME, App.getName())
         self.SetEntitySensorValue(KEY_VERSION, App.getVersion())
-        self.SetUpdateTimeout(600)
 
     def Update(self):
         # VERSION UPDATE CHECK
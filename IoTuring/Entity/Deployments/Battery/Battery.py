@@ -9,6 +9,7 @@ KEY_CHARGING_STATUS = 'charging'
 
 class Battery(Entity):
     NAME = "Battery"
+    NUMERIC_SENSORS = True
     supports_charge = False
 
     def Initialize(self):
@@ -41,6 +41,7 @@ VALUEFORMATOPTIONS_CPU_FREQUENCY_MHZ = ValueFormatterOptions(
 
 class Cpu(Entity):
     NAME = "Cpu"
+    NUMERIC_SENSORS = True
 
     def Initialize(self):
         self.RegisterEntitySensor(
@@ -1,5 +1,6 @@
 import psutil
 from IoTuring.Entity.Entity import Entity
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import UPDATE_TIER_SLOW
 from IoTuring.Entity.EntityData import EntitySensor
 from IoTuring.Configurator.MenuPreset import MenuPreset
 from IoTuring.Entity.ValueFormat import ValueFormatterOptions
@@ -34,7 +35,9 @@ DISK_CHOICE_STRING = {
 
 class Disk(Entity):
     NAME = "Disk"
+    DEFAULT_UPDATE_TIER = UPDATE_TIER_SLOW
     ALLOW_MULTI_INSTANCE = True
+    NUMERIC_SENSORS = True
 
     def Initialize(self) -> None:
         """Initialise the DiskUsage Entity and Register it
@@ -14,6 +14,7 @@ KEY_MODE = "mode"
 
 class DisplayMode(Entity):
     NAME = "DisplayMode"
+    HAS_COMMANDS = True
 
     def Initialize(self):
 
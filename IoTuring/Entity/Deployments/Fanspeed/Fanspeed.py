@@ -16,6 +16,7 @@ FALLBACK_FAN_LABEL = "fan"
 class Fanspeed(Entity):
     """Entity to read fanspeed"""
     NAME = "Fanspeed"
+    NUMERIC_SENSORS = True
 
     def Initialize(self) -> None:
         """Initialize the Class, setup Formatter, determin specificInitialize and specificUpdate depending on OS"""
@@ -13,6 +13,7 @@ CONFIG_KEY_PATH = 'path'
 class FileSwitch(Entity):
     NAME = "FileSwitch"
     ALLOW_MULTI_INSTANCE = True
+    HAS_COMMANDS = True
 
     def Initialize(self):
 
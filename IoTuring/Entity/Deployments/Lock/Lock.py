@@ -29,6 +29,7 @@ commands = {
 
 class Lock(Entity):
     NAME = "Lock"
+    HAS_COMMANDS = True
 
     def Initialize(self):
 
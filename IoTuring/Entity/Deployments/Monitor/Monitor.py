@@ -14,6 +14,7 @@ KEY_CMD = 'monitor'
 
 class Monitor(Entity):
     NAME = "Monitor"
+    HAS_COMMANDS = True
 
     def Initialize(self):
 
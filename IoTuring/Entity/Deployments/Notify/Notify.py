@@ -40,6 +40,7 @@ MODE_DATA_VIA_PAYLOAD = "data_via_payload"
 class Notify(Entity):
     NAME = "Notify"
     ALLOW_MULTI_INSTANCE = True
+    HAS_COMMANDS = True
 
     # Data is set from configurations if configurations contain both title and message
     # Otherwise, data is set from payload (even if only one of title or message is set)
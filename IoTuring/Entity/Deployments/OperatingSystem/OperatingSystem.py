@@ -1,5 +1,6 @@
 import platform
 from IoTuring.Entity.Entity import Entity
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import UPDATE_TIER_SLOW
 from IoTuring.Entity.EntityData import EntitySensor
 from IoTuring.MyApp.SystemConsts import OperatingSystemDetection as OsD
 
@@ -12,6 +13,7 @@ EXTRA_KEY_DISTRO = 'distro'
 
 class OperatingSystem(Entity):
     NAME = "OperatingSystem"
+    DEFAULT_UPDATE_TIER = UPDATE_TIER_SLOW
 
     def Initialize(self):
         self.RegisterEntitySensor(EntitySensor(
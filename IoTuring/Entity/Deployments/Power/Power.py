@@ -46,6 +46,7 @@ linux_commands = {
 
 class Power(Entity):
     NAME = "Power"
+    HAS_COMMANDS = True
 
     def Initialize(self):
         self.commands = {}
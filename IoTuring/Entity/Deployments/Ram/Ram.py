@@ -23,6 +23,7 @@ VALUEFORMATOPTIONS_MEMORY_MB = ValueFormatterOptions(ValueFormatterOptions.TYPE_
 
 class Ram(Entity):
     NAME = "Ram"
+    NUMERIC_SENSORS = True
 
     def Initialize(self):
         self.RegisterEntitySensor(EntitySensor(self, KEY_MEMORY_PERCENTAGE, valueFormatterOptions=VALUEFORMATOPTIONS_MEMORY_PERCENTAGE, supportsExtraAttributes=True))
@@ -0,0 +1,116 @@
+from IoTuring.Entity.Entity import Entity
+from IoTuring.Entity.EntityData import EntitySensor
+from IoTuring.Entity.EntityManager import EntityManager
+from IoTuring.Entity.ValueFormat import ValueFormatterOptions
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_UPDATE, METRIC_CALLBACK, METRIC_LOOP, METRIC_LOOP_CHANGES, \
+    METRIC_PUBLISH_LATENCY, METRIC_COMMAND_WAIT, GAUGE_MQTT_QUEUE, GAUGE_MQTT_SPOOL, GAUGE_MQTT_V5, GAUGE_COMMANDS
+
+# Before every sensor key, as these values are about IoTuring itself:
+KEY_PREFIX = 'IoTuring.'
+# Sensor: last update duration of an entity, followed by the entity id without "Entity."
+KEY_UPDATE_MS = KEY_PREFIX + 'update_ms'
+# Sensor: slowest command callback and warehouse loop, with all of them as extra attributes
+KEY_CALLBACK_MS = KEY_PREFIX + 'callback_ms'
+KEY_LOOP_MS = KEY_PREFIX + 'loop_ms'
+KEY_PUBLISH_LATENCY_MS = KEY_PREFIX + 'publish_latency_ms'
+# Sensor: delay of the commands waiting for the previous one of their entity or a free thread, with the executor stats
+KEY_COMMAND_WAIT_MS = KEY_PREFIX + 'command_wait_ms'
+# Sensor: delay of the updates waiting for a free worker
+KEY_QUEUE_LAG_MS = KEY_PREFIX + 'queue_lag_ms'
+# Sensor: messages waiting in the MQTT clients queues, with their coalesced and dropped counts, their spools stats
+# and the bytes saved by MQTT v5 topic aliases
+KEY_MQTT_QUEUE = KEY_PREFIX + 'mqtt_queue'
+
+# Extra data keys
+EXTRA_KEY_COUNT = 'Count'
+EXTRA_KEY_ERRORS = 'Errors'
+EXTRA_KEY_P50 = 'Median'
+EXTRA_KEY_P95 = '95th percentile'
+EXTRA_KEY_MAX = 'Maximum'
+EXTRA_KEY_WAITING = 'Entities waiting'
+
+ENTITY_ID_PREFIX = "Entity."
+
+VALUEFORMATOPTIONS_MS = ValueFormatterOptions(
+    ValueFormatterOptions.TYPE_MILLISECONDS, 1)
+
+
+class SelfDiagnostics(Entity):
+    """ Durations of the updates, the command callbacks and the warehouse loops of IoTuring itself """
+    NAME = "SelfDiagnostics"
+    NUMERIC_SENSORS = True
+
+    def Initialize(self):
+        # Entities are known before initialization, commands and warehouses are not:
+        self.updateSensorKeys = {}
+        for entity in EntityManager().GetEntities():
+            if entity.HasUpdate():
+                entity_id = entity.GetEntityId()
+                self.updateSensorKeys[MetricsRegistry.MakeName(METRIC_UPDATE, entity_id)] = \
+                    KEY_UPDATE_MS + "." + entity_id[len(ENTITY_ID_PREFIX):]
+
+        for key in [*self.updateSensorKeys.values(), KEY_CALLBACK_MS, KEY_LOOP_MS, KEY_PUBLISH_LATENCY_MS, KEY_COMMAND_WAIT_MS, KEY_QUEUE_LAG_MS]:
+            self.RegisterEntitySensor(EntitySensor(
+                self, key, valueFormatterOptions=VALUEFORMATOPTIONS_MS, supportsExtraAttributes=True))
+
+        self.RegisterEntitySensor(EntitySensor(
+            self, KEY_MQTT_QUEUE, supportsExtraAttributes=True))
+
+    def Update(self):
+        registry = MetricsRegistry()
+
+        for name, metric in registry.GetMetrics(METRIC_UPDATE + ".").items():
+            if name in self.updateSensorKeys and metric.count:
+                key = self.updateSensorKeys[name]
+                stats = metric.ToDict()
+                self.SetEntitySensorValue(key, stats["last"])
+                for extra_key, stat in [(EXTRA_KEY_COUNT, "count"), (EXTRA_KEY_ERRORS, "errors"),
+                                        (EXTRA_KEY_P50, "p50"), (EXTRA_KEY_P95, "p95"), (EXTRA_KEY_MAX, "max")]:
+                    self.SetEntitySensorExtraAttribute(key, extra_key, stats[stat],
+                                                       None if stat in ["count", "errors"] else VALUEFORMATOPTIONS_MS)
+
+        self.SetSlowestMetric(KEY_CALLBACK_MS, registry.GetMetrics(METRIC_CALLBACK + "."))
+        self.SetSlowestMetric(KEY_LOOP_MS, {
+            **registry.GetMetrics(METRIC_LOOP + "."),
+            **registry.GetMetrics(METRIC_LOOP_CHANGES + ".")})
+        self.SetSlowestMetric(KEY_PUBLISH_LATENCY_MS, registry.GetMetrics(METRIC_PUBLISH_LATENCY + "."))
+        self.SetSlowestMetric(KEY_COMMAND_WAIT_MS, registry.GetMetrics(METRIC_COMMAND_WAIT + "."))
+        for name, stats in registry.GetGauges(GAUGE_COMMANDS).items():
+            for stat, value in stats.items():
+                self.SetEntitySensorExtraAttribute(
+                    KEY_COMMAND_WAIT_MS, f"{name} {stat}", value)
+
+        queues = registry.GetGauges(GAUGE_MQTT_QUEUE + ".")
+        if queues:
+            self.SetEntitySensorValue(KEY_MQTT_QUEUE, sum(
+                queue["depth"] for queue in queues.values()))
+            for name, queue in queues.items():
+                for stat, value in queue.items():
+                    self.SetEntitySensorExtraAttribute(
+                        KEY_MQTT_QUEUE, f"{name} {stat}", value)
+            for name, stats in {**registry.GetGauges(GAUGE_MQTT_SPOOL + "."),
+                                **registry.GetGauges(GAUGE_MQTT_V5 + ".")}.items():
+                for stat, value in stats.items():
+                    self.SetEntitySensorExtraAttribute(
+                        KEY_MQTT_QUEUE, f"{name} {stat}", value)
+
+        scheduler = getattr(EntityManager(), "scheduler", None)
+        if scheduler:
+            lag = scheduler.GetQueueLag()
+            self.SetEntitySensorValue(KEY_QUEUE_LAG_MS, lag["last"] * 1000)
+            self.SetEntitySensorExtraAttribute(
+                KEY_QUEUE_LAG_MS, EXTRA_KEY_MAX, lag["max"] * 1000, VALUEFORMATOPTIONS_MS)
+            self.SetEntitySensorExtraAttribute(
+                KEY_QUEUE_LAG_MS, EXTRA_KEY_WAITING, lag["waiting"])
+
+    def SetSlowestMetric(self, key, metrics) -> None:
+        """ Set the 95th percentile of the slowest metric as value, and the 95th percentile of each metric as extra attributes """
+        metrics = {name: metric.GetPercentile(95)
+                   for name, metric in metrics.items() if metric.count}
+        if not metrics:
+            return
+
+        self.SetEntitySensorValue(key, max(metrics.values()))
+        for name, p95 in metrics.items():
+            self.SetEntitySensorExtraAttribute(
+                key, name, p95, VALUEFORMATOPTIONS_MS)
@@ -35,6 +35,7 @@ MACOS_SMC_TEMPERATURE_KEYS = {
 
 class Temperature(Entity):
     NAME = "Temperature"
+    NUMERIC_SENSORS = True
 
     def Initialize(self):
         self.temperatureFormatOptions = ValueFormatterOptions(value_type=ValueFormatterOptions.TYPE_TEMPERATURE, decimals=TEMPERATURE_DECIMALS)
@@ -58,6 +58,8 @@ COVER_STATES = {
 class Terminal(Entity):
     NAME = "Terminal"
     ALLOW_MULTI_INSTANCE = True
+    NUMERIC_SENSORS = True
+    HAS_COMMANDS = True
 
     def Initialize(self):
 
@@ -9,6 +9,7 @@ KEY = 'uptime'
 
 class UpTime(Entity):
     NAME = "UpTime"
+    NUMERIC_SENSORS = True
 
     def Initialize(self):
         self.RegisterEntitySensor(EntitySensor(self, KEY, valueFormatterOptions=ValueFormatterOptions(ValueFormatterOptions.TYPE_TIME, 0, "m")))
@@ -25,6 +25,8 @@ UNMUTE_PREFIX_LINUX = 'pactl set-sink-mute @DEFAULT_SINK@ 0'
 
 class Volume(Entity):
     NAME = "Volume"
+    NUMERIC_SENSORS = True
+    HAS_COMMANDS = True
 
     def Initialize(self):
 
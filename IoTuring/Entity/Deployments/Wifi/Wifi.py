@@ -56,6 +56,7 @@ EXTRA_KEY_CHANNEL = "Channel"
 class Wifi(Entity):
     NAME = "Wifi"
     ALLOW_MULTI_INSTANCE = True
+    NUMERIC_SENSORS = True
 
     def Initialize(self):
         self.platform = OsD.GetOs()
@@ -1,41 +1,86 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
 if TYPE_CHECKING:
     from IoTuring.Configurator.Configuration import SingleConfiguration
     from IoTuring.Entity.EntityData import EntityData, EntitySensor, EntityCommand, ExtraAttribute
 
 
-import time
 import subprocess
+import time
+from threading import Lock
 
 from IoTuring.Configurator.ConfiguratorObject import ConfiguratorObject
+from IoTuring.Entity.EntityManager import EntityManager
 from IoTuring.Logger.LogObject import LogObject
-from IoTuring.Exceptions.Exceptions import UnknownEntityKeyException
+from IoTuring.Exceptions.Exceptions import UnknownEntityKeyException, UnknownConfigKeyException, DeadlineExceededException
+from IoTuring.Entity.UpdateWatchdog import Deadline, UpdateStats, GetRemainingTime
+from IoTuring.Entity.EntitySnapshot import EntitySnapshot, SensorSnapshot
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_UPDATE
 
 from IoTuring.MyApp.SystemConsts import OperatingSystemDetection as OsD
 
-from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings, CONFIG_KEY_UPDATE_INTERVAL
+from IoTuring.Configurator.MenuPreset import MenuPreset
+from IoTuring.Entity.PublishPolicy import PublishPolicy, CONFIG_KEY_PUBLISH_DEADBAND, CONFIG_KEY_PUBLISH_RELATIVE_DEADBAND, \
+    CONFIG_KEY_PUBLISH_MIN_INTERVAL, CONFIG_KEY_PUBLISH_MAX_SILENCE
+from IoTuring.Entity.CommandExecutor import CONFIG_KEY_COMMAND_DEBOUNCE
+
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings, UPDATE_TIER_NORMAL, \
+    CONFIG_KEY_UPDATE_DEADLINE, CONFIG_KEY_COMMAND_DEADLINE
+
+CONFIG_KEY_UPDATE_INTERVAL = "update_interval"
+CONFIG_KEY_CUSTOM_PUBLISH_POLICY = "custom_publish_policy"
 
 
 class Entity(ConfiguratorObject, LogObject):
 
-    entitySensors: list[EntitySensor]
-    entityCommands: list[EntityCommand]
+    # Default update interval of the entity: a tier name or a number of seconds
+    DEFAULT_UPDATE_TIER = UPDATE_TIER_NORMAL
+
+    # True if the entity has sensors with numeric ValueFormatterOptions, to ask for a deadband:
+    NUMERIC_SENSORS = False
+
+    # True if the entity registers commands, to ask for the command debounce:
+    HAS_COMMANDS = False
+
+    # Entity sensors and commands by key:
+    entitySensors: dict[str, EntitySensor]
+    entityCommands: dict[str, EntityCommand]
 
     def __init__(self, single_configuration: SingleConfiguration) -> None:
         super().__init__(single_configuration)
 
         # Prepare the entity
-        self.entitySensors = []
-        self.entityCommands = []
+        self.entitySensors = {}
+        self.entityCommands = {}
 
         self.tag = self.GetConfigurations().GetTag()
 
-        # When I update the values this number changes (randomly) so each warehouse knows I have updated
+        # When I update the values this number increases so each warehouse knows I have updated
         self.valuesID = 0
 
-        self.updateTimeout = int(
-            AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_UPDATE_INTERVAL))
+        self.updateTimeout = self.GetConfiguredUpdateTimeout()
+
+        self.publishPolicy = self.GetConfiguredPublishPolicy()
+
+        # Only the last command received in this many seconds runs, 0 to run all:
+        self.commandDebounce = self.GetConfiguredCommandDebounce()
+
+        # Seconds before the commands of an update or a callback are killed:
+        self.updateDeadline = float(
+            AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_UPDATE_DEADLINE))
+        self.commandDeadline = float(
+            AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_COMMAND_DEADLINE))
+
+        self.updateStats = UpdateStats()
+        self.updateMetric = MetricsRegistry().GetMetric(
+            MetricsRegistry.MakeName(METRIC_UPDATE, self.GetEntityId()))
+
+        # Warehouses read the last committed snapshot, never the live sensors:
+        self.snapshot = EntitySnapshot(self, {}, 0, time.time())
+        # Sensors changed since the last commit, as an ordered set:
+        self.dirtySensors: dict[EntitySensor, None] = {}
+        # Held while changing the live sensors and while committing:
+        self.stateLock = Lock()
 
     def Initialize(self):
         """ Must be implemented in sub-classes, may be useful here to use the configuration """
@@ -46,6 +91,7 @@ class Entity(ConfiguratorObject, LogObject):
         try:
             self.CheckSystemSupport()
             self.Initialize()
+            self.CommitSnapshot()
             self.Log(self.LOG_INFO, "Initialization successfully completed")
         except Exception as e:
             self.Log(self.LOG_ERROR,
@@ -55,13 +101,25 @@ class Entity(ConfiguratorObject, LogObject):
         return True
 
     def CallUpdate(self):  # Call the Update method safely
-        """ Safe method to run the Update function """
+        """ Safe method to run the Update function, under the update deadline """
+        start_time = time.monotonic()
+        error = True
         try:
-            self.Update()
+            with Deadline(self.updateDeadline):
+                self.Update()
+            error = False
+        except DeadlineExceededException as exc:
+            self.updateStats.timeouts += 1
+            self.Log(self.LOG_WARNING,
+                     f"Update timed out: {exc} ({self.updateStats})")
         except Exception as exc:
             # TODO I need an exception manager
             self.Log(self.LOG_ERROR, 'Error occured during update: ' + str(exc))
             #  self.entityManager.UnloadEntity(self) # TODO Think how to improve this
+        finally:
+            self.updateStats.lastDuration = time.monotonic() - start_time
+            self.updateMetric.Record(self.updateStats.lastDuration, error)
+            self.CommitSnapshot()
 
     def Update(self):
         """ Must be implemented in sub-classes """
@@ -83,7 +141,7 @@ class Entity(ConfiguratorObject, LogObject):
         """ Check if EntitySensor has an extra attributes dict """
         return self.GetEntitySensorByKey(key).HasExtraAttributes()
 
-    def GetEntitySensorExtraAttributes(self, key) -> list[ExtraAttribute]:
+    def GetEntitySensorExtraAttributes(self, key) -> Iterable[ExtraAttribute]:
         """ Get attributes using its entity sensor key if the extra attributes are present (else raise an exception) """
         if not self.GetEntitySensorByKey(key).HasExtraAttributes():
             raise Exception(
@@ -95,57 +153,140 @@ class Entity(ConfiguratorObject, LogObject):
         self.GetEntitySensorByKey(sensorDataKey).SetExtraAttribute(
             attributeKey, attributeValue, valueFormatterOptions)
 
+    def NotifySensorChange(self, entitySensor: EntitySensor) -> None:
+        """ Called by the EntitySensors of this entity when their value or extra attributes change, with stateLock held.
+            The change is visible to warehouses at the next commit """
+        self.valuesID += 1
+        self.dirtySensors[entitySensor] = None
+
+    def CommitSnapshot(self) -> None:
+        """ Publish the changes of the live sensors in a new snapshot, and send the changed sensors to the change feed.
+            Called after Initialize, Update and command callbacks, so warehouses never see an update half done """
+        with self.stateLock:
+            if not self.dirtySensors and len(self.snapshot.sensors) == len(self.entitySensors):
+                return
+
+            version = self.snapshot.GetVersion() + 1
+            timestamp = time.time()
+
+            changedSensors = [SensorSnapshot(entitySensor, version, timestamp)
+                              for entitySensor in self.dirtySensors]
+            self.dirtySensors.clear()
+
+            # Copy on write: unchanged sensors keep their previous snapshot
+            sensors = dict(self.snapshot.sensors)
+            for sensorSnapshot in changedSensors:
+                sensors[sensorSnapshot.GetKey()] = sensorSnapshot
+
+            # Registration order, also sensors without a value:
+            sensors = {key: sensors.get(key) or SensorSnapshot(entitySensor, version, timestamp)
+                       for key, entitySensor in self.entitySensors.items()}
+
+            # Swapped atomically, readers keep the old one if they already have it:
+            self.snapshot = EntitySnapshot(self, sensors, version, timestamp)
+
+        EntityManager().PushChanges(changedSensors)
+
+    def GetSnapshot(self) -> EntitySnapshot:
+        """ Return the last committed state of all the sensors. Immutable, safe to read from any thread """
+        return self.snapshot
+
     def SetUpdateTimeout(self, timeout) -> None:
         """ Set how much time to wait between 2 updates """
         self.updateTimeout = timeout
 
+    def GetUpdateTimeout(self) -> int:
+        """ Return how much time to wait between 2 updates """
+        return self.updateTimeout
+
+    def GetConfiguredUpdateTimeout(self) -> int:
+        """ Return the update interval in seconds from the configuration of this entity, or the normal interval """
+        try:
+            if self.GetConfigurations().HasConfigKey(CONFIG_KEY_UPDATE_INTERVAL):
+                return AppSettings.GetUpdateInterval(
+                    self.GetFromConfigurations(CONFIG_KEY_UPDATE_INTERVAL))
+        except ValueError as e:
+            self.Log(self.LOG_ERROR, f"{e}, using {UPDATE_TIER_NORMAL} interval")
+        return AppSettings.GetUpdateInterval(UPDATE_TIER_NORMAL)
+
+    def GetUpdateDeadline(self) -> float:
+        """ Return the seconds an update can last before its commands are killed, 0 if no deadline """
+        return self.updateDeadline
+
+    def GetCommandDeadline(self) -> float:
+        """ Return the seconds a command callback can last before its commands are killed, 0 if no deadline """
+        return self.commandDeadline
+
+    def GetUpdateStats(self) -> UpdateStats:
+        """ Return the counters of durations, overruns and timeouts of this entity """
+        return self.updateStats
+
+    def GetPublishPolicy(self) -> PublishPolicy:
+        """ Return the policy warehouses use to decide when to publish the sensors of this entity """
+        return self.publishPolicy
+
+    def GetConfiguredPublishPolicy(self) -> PublishPolicy:
+        """ Return the publish policy from the configuration of this entity, or the default policy """
+        if not self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_CUSTOM_PUBLISH_POLICY):
+            return PublishPolicy()
+        try:
+            return PublishPolicy.FromDict(self.GetConfigurations().ToDict(include_type=False))
+        except ValueError as e:
+            self.Log(self.LOG_ERROR, f"Invalid publish policy: {e}, using default policy")
+            return PublishPolicy()
+
+    def GetCommandDebounce(self) -> float:
+        """ Return the debounce window of the commands of this entity in seconds, 0 if commands are not debounced """
+        return self.commandDebounce
+
+    def GetConfiguredCommandDebounce(self) -> float:
+        """ Return the command debounce window from the configuration of this entity, 0 if not set """
+        try:
+            return float(self.GetConfigurations().GetConfigValue(CONFIG_KEY_COMMAND_DEBOUNCE) or 0)
+        except UnknownConfigKeyException:
+            return 0
+        except ValueError:
+            self.Log(self.LOG_ERROR, "Invalid command debounce, commands are not debounced")
+            return 0
+
     def ShouldUpdate(self) -> bool:
-        """ Wait the correct timeout time and then the update will run """
-        time.sleep(self.updateTimeout)
+        """ Called by the EntityScheduler when the timeout passed: if it returns False this update is skipped """
         return True
 
-    def LoopThread(self) -> None:
-        """ Entry point of Entity thread, will run the Update function periodically """
-        self.CallUpdate()  # first call
-        while (True):
-            if self.ShouldUpdate():
-                self.CallUpdate()
-
     def RegisterEntitySensor(self, entitySensor: EntitySensor):
         """ Add EntitySensor to the Entity. This action must be in Initialize """
-        self.entitySensors.append(entitySensor)
+        self.entitySensors[entitySensor.GetKey()] = entitySensor
 
     def RegisterEntityCommand(self, entityCommand: EntityCommand):
         """ Add EntityCommand to the Entity. This action must be in Initialize, so the Warehouses can subscribe to them at initializing time"""
-        self.entityCommands.append(entityCommand)
+        self.entityCommands[entityCommand.GetKey()] = entityCommand
 
-    def GetEntitySensors(self) -> list[EntitySensor]:
-        """ safe - Return list of registered entity sensors """
-        return self.entitySensors.copy()  # Safe return: nobody outside can change the value !
+    def GetEntitySensors(self) -> Iterable[EntitySensor]:
+        """ safe - Return registered entity sensors, as a read-only view """
+        return self.entitySensors.values()  # Safe return: nobody outside can change the sensors !
 
-    def GetEntityCommands(self) -> list[EntityCommand]:
-        """ safe - Return list of registered entity commands """
-        return self.entityCommands.copy()  # Safe return: nobody outside can change the callback !
+    def GetEntityCommands(self) -> Iterable[EntityCommand]:
+        """ safe - Return registered entity commands, as a read-only view """
+        return self.entityCommands.values()  # Safe return: nobody outside can change the callback !
 
     def GetAllEntityData(self) -> list:
         """ safe - Return list of entity sensors and commands """
-        return self.entityCommands.copy() + self.entitySensors.copy()  # Safe return: nobody outside can change the callback !
+        return [*self.entityCommands.values(), *self.entitySensors.values()]
 
     def GetAllUnconnectedEntityData(self) -> list[EntityCommand|EntitySensor]:
         """ safe - Return All EntityCommands and EntitySensors without connected sensors """
-        connected_sensors = []
-        for command in self.entityCommands:
-            connected_sensors.extend(command.GetConnectedEntitySensors())
-        
-        unconnected_sensors = [sensor for sensor in self.entitySensors
+        connected_sensors = set()
+        for command in self.entityCommands.values():
+            connected_sensors.update(command.GetConnectedEntitySensors())
+
+        unconnected_sensors = [sensor for sensor in self.entitySensors.values()
                                if sensor not in connected_sensors]
-        return self.entityCommands.copy() + unconnected_sensors.copy()
+        return [*self.entityCommands.values(), *unconnected_sensors]
 
     def GetEntitySensorByKey(self, key) -> EntitySensor:
         try:
-            sensor = next((s for s in self.entitySensors if s.GetKey() == key))
-            return sensor
-        except StopIteration:
+            return self.entitySensors[key]
+        except KeyError:
             raise UnknownEntityKeyException(key)
 
     def GetEntityName(self) -> str:
@@ -178,7 +319,8 @@ class Entity(ConfiguratorObject, LogObject):
                    log_errors: bool = True,
                    shell: bool = False,
                    **kwargs) -> subprocess.CompletedProcess:
-        """Safely call a subprocess. Kwargs are other Subprocess options
+        """Safely call a subprocess. Kwargs are other Subprocess options.
+           In an update or a callback, the subprocess is killed when their deadline expires.
 
         Args:
             command (str | list): The command to call
@@ -198,6 +340,9 @@ class Entity(ConfiguratorObject, LogObject):
             else:
                 command_name = self.NAME
 
+            if "timeout" not in kwargs:
+                kwargs["timeout"] = GetRemainingTime()
+
             p = OsD.RunCommand(command, shell=shell, **kwargs)
 
             self.Log(self.LOG_DEBUG, f"Called {command_name} command: {p}")
@@ -210,10 +355,48 @@ class Entity(ConfiguratorObject, LogObject):
             
             return p
 
+        except subprocess.TimeoutExpired as e:
+            raise DeadlineExceededException(command_name, e.timeout)
         except Exception as e:
             raise Exception(f"Error during {command_name} command: {str(e)}")
 
 
+    @classmethod
+    def HasUpdate(cls) -> bool:
+        """ True if this entity implements the Update method, so it has to be updated periodically """
+        return not cls.Update.__qualname__ == "Entity.Update"
+
+    @classmethod
+    def GetConfigurationPreset(cls) -> MenuPreset:
+        preset = cls.ConfigurationPreset()
+        if cls.HasUpdate():
+            preset.AddUpdateIntervalQuestion(default=cls.DEFAULT_UPDATE_TIER)
+
+        preset.AddEntry(name="Customize publish policy",
+                        key=CONFIG_KEY_CUSTOM_PUBLISH_POLICY, question_type="yesno", default="N",
+                        instruction="By default a sensor is published when its value changes")
+        if cls.NUMERIC_SENSORS:
+            preset.AddEntry(name="Deadband",
+                            key=CONFIG_KEY_PUBLISH_DEADBAND,
+                            instruction="Publish numbers only if they changed more than this",
+                            display_if_key_value={CONFIG_KEY_CUSTOM_PUBLISH_POLICY: "Y"})
+            preset.AddEntry(name="Relative deadband",
+                            key=CONFIG_KEY_PUBLISH_RELATIVE_DEADBAND,
+                            instruction="Publish numbers only if they changed more than this fraction, e.g. 0.05 for 5%",
+                            display_if_key_value={CONFIG_KEY_CUSTOM_PUBLISH_POLICY: "Y"})
+        preset.AddEntry(name="Minimum seconds between 2 publishes",
+                        key=CONFIG_KEY_PUBLISH_MIN_INTERVAL,
+                        display_if_key_value={CONFIG_KEY_CUSTOM_PUBLISH_POLICY: "Y"})
+        preset.AddEntry(name="Maximum seconds without publishing",
+                        key=CONFIG_KEY_PUBLISH_MAX_SILENCE,
+                        instruction="Publish unchanged values after this time, leave empty to disable",
+                        display_if_key_value={CONFIG_KEY_CUSTOM_PUBLISH_POLICY: "Y"})
+        if cls.HAS_COMMANDS:
+            preset.AddEntry(name="Command debounce in seconds",
+                            key=CONFIG_KEY_COMMAND_DEBOUNCE,
+                            instruction="Of the commands received in this time only the last one runs, leave empty to run all")
+        return preset
+
     @classmethod
     def CheckSystemSupport(cls):
         """Must be implemented in subclasses. Raise an exception if system not supported."""
@@ -1,16 +1,24 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Callable, Iterable
 if TYPE_CHECKING:
     from IoTuring.Entity.Entity import Entity
 
 from IoTuring.Logger.LogObject import LogObject
 from IoTuring.Entity.ValueFormat import ValueFormatter
+from IoTuring.Entity.UpdateWatchdog import Deadline
+from IoTuring.Exceptions.Exceptions import DeadlineExceededException
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_CALLBACK
+from IoTuring.Entity.CommandExecutor import CommandExecutor
+
+import time
 
 # EntitySensor extra attribute aren't read from all the warehouses
 
 
 class EntityData(LogObject):
 
+    __slots__ = ("entityId", "id", "key", "entity", "customPayload")
+
     def __init__(self, entity: Entity, key, customPayload={}) -> None:
         self.entityId = entity.GetEntityId()
         self.id = self.entityId + "." + key
@@ -36,8 +44,12 @@ class EntityData(LogObject):
 
 class EntitySensor(EntityData):
 
+    __slots__ = ("supportsExtraAttributes", "valueFormatterOptions",
+                 "value", "extraAttributes")
+
     value: str | int | float
-    extraAttributes: list[ExtraAttribute]
+    # Extra attributes by name:
+    extraAttributes: dict[str, ExtraAttribute]
 
     def __init__(self, entity, key,
                  valueFormatterOptions=None,
@@ -66,14 +78,16 @@ class EntitySensor(EntityData):
 
     def SetValue(self, value) -> None:
         self.Log(self.LOG_DEBUG, "Set to " + str(value))
-        self.value = value
+        with self.entity.stateLock:
+            self.value = value
+            self.entity.NotifySensorChange(self)
 
     def HasValue(self) -> bool:
         """ True if self.value isn't empty """
         return hasattr(self, "value")
 
-    def GetExtraAttributes(self) -> list[ExtraAttribute]:
-        """ Get extra attribute objects as a list """
+    def GetExtraAttributes(self) -> Iterable[ExtraAttribute]:
+        """ Get extra attribute objects, as a read-only view """
         if not self.supportsExtraAttributes:
             raise Exception(
                 "This entity sensor does not support extra attributes. Please specify it when initializing the sensor.")
@@ -81,7 +95,7 @@ class EntitySensor(EntityData):
             raise Exception(
                 "No extra attribute set yet!"
             )
-        return self.extraAttributes
+        return self.extraAttributes.values()
 
     def GetFormattedExtraAtributes(self, includeUnit: bool) -> dict[str, str]:
         """ Get extra attributes names and formatted values as a dict """
@@ -102,21 +116,25 @@ class EntitySensor(EntityData):
         if not self.supportsExtraAttributes:
             raise Exception(
                 "This entity sensor does not support extra attributes. Please specify it when initializing the sensor.")
-        if not self.HasExtraAttributes():
-            self.extraAttributes = []
-
-        # If the Attribute does not already exists, create it, otherwise update it
-        extraAttributeObj = next(
-            (attr for attr in self.extraAttributes if attr.GetName() == attribute_name), None)
-        if not extraAttributeObj:
-            self.extraAttributes.append(ExtraAttribute(
-                attribute_name, attribute_value, valueFormatterOptions))
-        else:
-            extraAttributeObj.SetValue(attribute_value)
+        with self.entity.stateLock:
+            if not self.HasExtraAttributes():
+                self.extraAttributes = {}
+
+            # If the Attribute does not already exists, create it, otherwise update it
+            extraAttributeObj = self.extraAttributes.get(attribute_name)
+            if extraAttributeObj is None:
+                self.extraAttributes[attribute_name] = ExtraAttribute(
+                    attribute_name, attribute_value, valueFormatterOptions)
+            else:
+                extraAttributeObj.SetValue(attribute_value)
+
+            self.entity.NotifySensorChange(self)
 
 
 class EntityCommand(EntityData):
 
+    __slots__ = ("callbackFunction", "connectedEntitySensorKeys")
+
     def __init__(self, entity: Entity, key: str, callbackFunction: Callable,
                  connectedEntitySensorKeys: str | list = [],
                  customPayload={}):
@@ -151,12 +169,43 @@ class EntityCommand(EntityData):
         """ Safely run callback for this command, passing the message (a paho.mqtt.client.MQTTMessage).
             Reutrns True if callback was run correctly, False if an error occurred."""
         self.Log(self.LOG_DEBUG, "Callback")
+        start_time = time.monotonic()
+        error = True
         try:
-            self.RunCallback(message)
+            with Deadline(self.GetEntity().GetCommandDeadline()):
+                self.RunCallback(message)
+            error = False
             return True
+        except DeadlineExceededException as e:
+            stats = self.GetEntity().GetUpdateStats()
+            stats.commandTimeouts += 1
+            self.Log(self.LOG_WARNING,
+                     f"Callback timed out: {e} ({stats})")
+            return False
         except Exception as e:
             self.Log(self.LOG_ERROR, "Error while running callback: " + str(e))
             return False
+        finally:
+            MetricsRegistry().Record(MetricsRegistry.MakeName(METRIC_CALLBACK, self.GetId()),
+                                     time.monotonic() - start_time, error)
+            # Publish the values set by the callback:
+            self.GetEntity().CommitSnapshot()
+
+    def SubmitCallback(self, message, function: Callable | None = None, debounce: float | None = None) -> None:
+        """Run CallCallback, or function if passed, with the message on the command executor, not on the calling thread.
+
+        Args:
+            message: The paho.mqtt.client.MQTTMessage
+            function (Callable | None, optional): Runs instead of CallCallback. Defaults to None.
+            debounce (float | None, optional): Debounce window in seconds, the one of the entity if None. Defaults to None.
+        """
+        if debounce is None:
+            debounce = self.GetEntity().GetCommandDebounce()
+
+        if debounce > 0:
+            CommandExecutor().SubmitDebounced(self, debounce, function or self.CallCallback, message)
+        else:
+            CommandExecutor().Submit(self, function or self.CallCallback, message)
 
     def RunCallback(self, message):
         """ Called only by CallCallback. 
@@ -165,6 +214,9 @@ class EntityCommand(EntityData):
 
 
 class ExtraAttribute():
+
+    __slots__ = ("name", "value", "valueFormatterOptions")
+
     def __init__(self, name, value, valueFormatterOptions=None):
         self.name = name
         self.value = value
@@ -0,0 +1,79 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from IoTuring.Entity.Entity import Entity
+
+import queue
+import time
+from threading import Thread, Event
+
+from IoTuring.Logger.LogObject import LogObject
+
+
+class InitializationResult():
+    """ Result of the initialization of a single entity """
+
+    def __init__(self) -> None:
+        self.started = Event()
+        self.done = Event()
+        self.startTime = 0.0
+        self.success = False
+
+
+class EntityInitializer(LogObject):
+    """ Run CallInitialize of the entities in parallel on a bounded pool of threads.
+        Results are collected in the order of the entities, so the loaded entities keep the configured order. """
+
+    def __init__(self, entities: list[Entity], workers: int) -> None:
+        self.entities = entities
+        self.results = {entity: InitializationResult() for entity in entities}
+
+        self.pendingQueue = queue.Queue()
+        for entity in entities:
+            self.pendingQueue.put(entity)
+
+        for _ in range(min(max(1, int(workers)), len(entities))):
+            self.AddWorker()
+
+    def AddWorker(self) -> None:
+        """ Start a new worker thread. Daemon, so an entity stuck in Initialize doesn't block the exit """
+        thread = Thread(target=self.WorkerThread)
+        thread.daemon = True
+        thread.start()
+
+    def WorkerThread(self) -> None:
+        """ Initialize the pending entities until there are none """
+        while (True):
+            try:
+                entity = self.pendingQueue.get_nowait()
+            except queue.Empty:
+                return
+
+            result = self.results[entity]
+            result.startTime = time.monotonic()
+            result.started.set()
+
+            result.success = entity.CallInitialize()
+            result.done.set()
+
+    def WaitEntity(self, entity: Entity, timeout: float) -> bool | None:
+        """Wait for the initialization of an entity
+
+        Args:
+            entity (Entity): The entity to wait
+            timeout (float): Maximum seconds of initialization, counted from its start
+
+        Returns:
+            bool | None: The result of CallInitialize, None if it didn't finish in time
+        """
+        result = self.results[entity]
+
+        # Always starts: a worker stuck on a timed out entity is replaced
+        result.started.wait()
+
+        if not result.done.wait(max(0, result.startTime + timeout - time.monotonic())):
+            # The thread can't be stopped: leave it running and replace it in the pool
+            self.AddWorker()
+            return None
+
+        return result.success
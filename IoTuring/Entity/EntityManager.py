@@ -2,10 +2,16 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from IoTuring.Entity.Entity import Entity
+    from IoTuring.Entity.EntitySnapshot import SensorSnapshot
+    from IoTuring.Entity.ChangeQueue import ChangeQueue
 
-from threading import Thread
 from IoTuring.Logger.LogObject import LogObject
 from IoTuring.Logger.Logger import Singleton
+from IoTuring.Entity.EntityScheduler import EntityScheduler
+from IoTuring.Entity.EntityInitializer import EntityInitializer
+from IoTuring.Entity.CommandExecutor import CommandExecutor
+
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings, CONFIG_KEY_UPDATE_WORKERS, CONFIG_KEY_UPDATE_PHASE, UPDATE_PHASE_STAGGERED, CONFIG_KEY_INIT_TIMEOUT, CONFIG_KEY_COMMAND_WORKERS
 
 
 class EntityManager(LogObject, metaclass=Singleton):
@@ -14,6 +20,11 @@ class EntityManager(LogObject, metaclass=Singleton):
 
         # Where I store the entities that update periodically that have an active behaviour: can send and receive data
         self.activeEntities = []
+        # Increased when an entity is added or unloaded, for who prepares something for each entity:
+        self.entitiesVersion = 0
+
+        # Queues of the warehouses that want to know which sensors changed:
+        self.changeQueues = []
 
     @staticmethod
     def EntityNameToClass(name):  # TODO Implement
@@ -23,10 +34,24 @@ class EntityManager(LogObject, metaclass=Singleton):
     def AddActiveEntity(self, entity):
         """ Pass an entity instance, add to list of active entities """
         self.activeEntities.append(entity)
+        self.entitiesVersion += 1
+
+    def AddChangeQueue(self, changeQueue: ChangeQueue) -> None:
+        """ Add a queue that will receive the snapshots of the sensors of all entities when they change """
+        self.changeQueues.append(changeQueue)
+
+    def PushChanges(self, sensorSnapshots: list[SensorSnapshot]) -> None:
+        """ Add the snapshots of the changed sensors to all the change queues """
+        if not sensorSnapshots:
+            return
+        for changeQueue in self.changeQueues:
+            changeQueue.Put(sensorSnapshots)
 
     def Start(self):
         self.InitializeEntities()
         self.ManageUpdates()
+        CommandExecutor().SetWorkers(
+            int(AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_COMMAND_WORKERS)))
 
     def GetEntities(self) -> list[Entity]:
         """ 
@@ -34,26 +59,52 @@ class EntityManager(LogObject, metaclass=Singleton):
         """
         return self.activeEntities
 
+    def GetEntitiesVersion(self) -> int:
+        """ Changes every time the list of entities changes """
+        return self.entitiesVersion
+
     def UnloadEntity(self, entity):
         """ Unloads the passed entity """
         if entity in self.activeEntities:
             self.activeEntities.remove(entity)
+            self.entitiesVersion += 1
         else:
             raise Exception("Can't unload the requested entity: not found among loaded entities.")
         self.Log(self.LOG_INFO, entity.GetEntityId() + " unloaded")
 
     def InitializeEntities(self):
-        for entity in self.GetEntities().copy():
-            if not entity.CallInitialize():
-                self.UnloadEntity(entity) # if errors, unload
+        """ Initialize all the entities in parallel, unload the ones that fail or time out """
+        entities = self.GetEntities().copy()
+        timeout = float(AppSettings.GetFromSettingsConfigurations(
+            CONFIG_KEY_INIT_TIMEOUT))
+
+        initializer = EntityInitializer(entities,
+                                        int(AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_UPDATE_WORKERS)))
+
+        # Wait in configuration order, the other entities keep initializing meanwhile:
+        for entity in entities:
+            success = initializer.WaitEntity(entity, timeout)
+            if success is None:
+                self.Log(self.LOG_ERROR,
+                         f"{entity.GetEntityId()} initialization timed out after {timeout:g}s")
+            if not success:
+                self.UnloadEntity(entity)  # if errors, unload
 
     def ManageUpdates(self):
-        """ Start a thread for each entity in which it will update periodically """
-        for entity in self.GetEntities():
-            
-            # Only start threads for entities with Update() method:
-            if not entity.Update.__qualname__ == "Entity.Update":
-                thread = Thread(target=entity.LoopThread)
-                thread.daemon = True
-                thread.start()
+        """ Add the entities to the scheduler, which will update them periodically """
+        self.scheduler = EntityScheduler(
+            int(AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_UPDATE_WORKERS)))
+
+        # Only schedule entities with Update() method:
+        updatingEntities = [entity for entity in self.GetEntities()
+                            if entity.HasUpdate()]
+
+        staggered = AppSettings.GetFromSettingsConfigurations(
+            CONFIG_KEY_UPDATE_PHASE) == UPDATE_PHASE_STAGGERED
+
+        for index, entity in enumerate(updatingEntities):
+            # Staggered: shift each entity by a different fraction of its interval
+            phase = index / len(updatingEntities) if staggered else 0
+            self.scheduler.Schedule(entity, phase)
 
+        self.scheduler.Start()
@@ -0,0 +1,189 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from IoTuring.Entity.Entity import Entity
+
+import heapq
+import itertools
+import math
+import queue
+import time
+from threading import Thread, Condition
+
+from IoTuring.Logger.LogObject import LogObject
+
+# Warn if an entity starts its update later than this (in seconds) after it was due:
+QUEUE_LAG_WARNING_SECONDS = 1
+
+# How often to check for updates running past their deadline:
+WATCHDOG_INTERVAL_SECONDS = 1
+
+
+def GetNextDueTime(anchor: float, interval: float, now: float) -> float:
+    """ Return the first time after now on the fixed-rate grid that starts at anchor and has the given interval.
+        Ticks that have already passed (because of a long update) are skipped, so the rate never drifts. """
+    if interval <= 0:
+        return now
+    ticks = math.floor((now - anchor) / interval) + 1
+    return anchor + ticks * interval
+
+
+class EntityScheduler(LogObject):
+    """ Run the Update of every entity from a single timer thread and a bounded pool of workers,
+        instead of a sleeping thread for each entity.
+        Updates are fixed-rate: the duration of an update doesn't delay the next one.
+        An entity is never updated twice at the same time: ticks due while its update is running are skipped
+        and counted as overruns. A watchdog replaces the workers stuck in an update past its deadline. """
+
+    def __init__(self, workers: int) -> None:
+        self.workersNumber = max(1, int(workers))
+
+        # Every update runs on a fixed-rate grid, which starts here and is shifted by the phase of the entity:
+        self.startTime = time.monotonic()
+        self.phases = {}
+
+        # Heap of (due time, sequence number, entity), the sequence number keeps the order stable for entities due at the same time
+        self.dueEntities = []
+        self.sequence = itertools.count()
+        self.condition = Condition()
+
+        # Entities that are due, waiting for a free worker:
+        self.readyQueue = queue.Queue()
+
+        # Seconds between the due time and the actual start of the last update, and the worst seen:
+        self.lastLag = 0.0
+        self.maxLag = 0.0
+
+        # Start time of the running updates, and the entities whose worker has been replaced by the watchdog:
+        self.runningEntities = {}
+        self.stuckEntities = set()
+
+    def Start(self) -> None:
+        """ Start the timer thread and the worker threads """
+        for target in [self.TimerThread, self.WatchdogThread]:
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+        for _ in range(self.workersNumber):
+            self.AddWorker()
+
+        self.Log(self.LOG_DEBUG,
+                 f"Started with {self.workersNumber} workers")
+
+    def Schedule(self, entity: Entity, phase: float = 0) -> None:
+        """ Add the entity to the scheduler: its first update runs after the phase shift, the next ones every entity.updateTimeout seconds.
+
+        Args:
+            entity (Entity): The entity to update
+            phase (float, optional): Fraction of the interval (from 0 to 1) to shift the updates of this entity. Defaults to 0.
+        """
+        self.phases[entity] = phase
+        self.AddDueEntity(entity, self.startTime + phase * entity.updateTimeout)
+
+    def AddWorker(self) -> None:
+        """ Start a new worker thread """
+        thread = Thread(target=self.WorkerThread)
+        thread.daemon = True
+        thread.start()
+
+    def Reschedule(self, entity: Entity, due_time: float) -> None:
+        """ Schedule the next update of the entity on its grid. Timeout read here, so SetUpdateTimeout works also from Update """
+        timeout = entity.updateTimeout
+        anchor = self.startTime + self.phases[entity] * timeout
+        next_due_time = GetNextDueTime(anchor, timeout, time.monotonic())
+
+        if timeout > 0:
+            # Ticks between the last due time and the next one were skipped by a long update:
+            skipped = math.ceil((next_due_time - due_time) / timeout - 1e-6) - 1
+            if skipped > 0:
+                stats = entity.GetUpdateStats()
+                stats.overruns += skipped
+                self.Log(self.LOG_WARNING,
+                         f"{entity.GetEntityId()} update overran its {timeout}s interval, {skipped} updates skipped ({stats})")
+
+        self.AddDueEntity(entity, next_due_time)
+
+    def AddDueEntity(self, entity: Entity, due_time: float) -> None:
+        """ Add the entity to the heap of due entities """
+        with self.condition:
+            heapq.heappush(self.dueEntities,
+                           (due_time, next(self.sequence), entity))
+            # Wake up the timer, the new entity may be the first due:
+            self.condition.notify()
+
+    def TimerThread(self) -> None:
+        """ Wait for the first due entity and pass it to the workers """
+        while (True):
+            with self.condition:
+                while not self.dueEntities:
+                    self.condition.wait()
+
+                due_time = self.dueEntities[0][0]
+                wait_time = due_time - time.monotonic()
+
+                if wait_time > 0:
+                    # Woken up earlier if a new entity is scheduled:
+                    self.condition.wait(wait_time)
+                    continue
+
+                due_time, _, entity = heapq.heappop(self.dueEntities)
+
+            self.readyQueue.put((due_time, entity))
+
+    def WorkerThread(self) -> None:
+        """ Run the updates of the due entities, then schedule their next update """
+        while (True):
+            due_time, entity = self.readyQueue.get()
+
+            self.UpdateLag(entity, time.monotonic() - due_time)
+
+            if entity.ShouldUpdate():
+                self.runningEntities[entity] = time.monotonic()
+                entity.CallUpdate()
+                del self.runningEntities[entity]
+
+            self.Reschedule(entity, due_time)
+
+            if entity in self.stuckEntities:
+                # The watchdog already started a worker to replace this one
+                self.stuckEntities.discard(entity)
+                return
+
+    def WatchdogThread(self) -> None:
+        """ Check for updates running past their deadline. Python code can't be stopped,
+            so the stuck worker is left running and another worker takes its place """
+        while (True):
+            time.sleep(WATCHDOG_INTERVAL_SECONDS)
+            now = time.monotonic()
+
+            for entity, start_time in list(self.runningEntities.items()):
+                deadline = entity.GetUpdateDeadline()
+                # Leave time to the subprocess kill, that ends the update by itself:
+                if not deadline or entity in self.stuckEntities or \
+                        now - start_time < deadline + WATCHDOG_INTERVAL_SECONDS:
+                    continue
+
+                self.stuckEntities.add(entity)
+                stats = entity.GetUpdateStats()
+                stats.timeouts += 1
+                self.Log(self.LOG_ERROR,
+                         f"{entity.GetEntityId()} update still running after {now - start_time:.0f}s, its deadline is {deadline:g}s. Starting a new worker. ({stats})")
+                self.AddWorker()
+
+    def UpdateLag(self, entity: Entity, lag: float) -> None:
+        """ Save the queue lag and warn if an entity started too late """
+        self.lastLag = lag
+        self.maxLag = max(self.maxLag, lag)
+
+        if lag > QUEUE_LAG_WARNING_SECONDS:
+            self.Log(self.LOG_WARNING,
+                     f"{entity.GetEntityId()} update started {lag:.2f}s late, {self.readyQueue.qsize()} entities waiting. Consider increasing the number of update workers.")
+
+    def GetQueueLag(self) -> dict:
+        """ Return the last and the maximum lag in seconds, and the number of entities waiting for a worker """
+        return {
+            "last": self.lastLag,
+            "max": self.maxLag,
+            "waiting": self.readyQueue.qsize()
+        }
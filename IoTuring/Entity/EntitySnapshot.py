@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterable
+if TYPE_CHECKING:
+    from IoTuring.Entity.Entity import Entity
+    from IoTuring.Entity.EntityData import EntitySensor
+
+from types import MappingProxyType
+
+from IoTuring.Entity.EntityData import ExtraAttribute
+from IoTuring.Entity.ValueFormat import ValueFormatter
+from IoTuring.Exceptions.Exceptions import UnknownEntityKeyException
+
+
+class Immutable():
+    """ Attributes can be set only with object.__setattr__, in __init__ """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class SensorSnapshot(Immutable):
+    """ Immutable copy of the value and the extra attributes of an EntitySensor, taken at a commit.
+        Formatted values are kept, so each one is formatted once for all the warehouses """
+
+    __slots__ = ("entitySensor", "hasValue", "value",
+                 "extraAttributes", "version", "timestamp", "formatted")
+
+    def __init__(self, entitySensor: EntitySensor, version: int, timestamp: float) -> None:
+        """ Copy the live state of the sensor. Called by the entity with its state lock held """
+        object.__setattr__(self, "entitySensor", entitySensor)
+        object.__setattr__(self, "hasValue", entitySensor.HasValue())
+        object.__setattr__(self, "value",
+                           entitySensor.value if self.hasValue else None)
+
+        extraAttributes = None
+        if entitySensor.HasExtraAttributes():
+            extraAttributes = tuple(ExtraAttribute(a.GetName(), a.GetValue(), a.GetValueFormatterOptions())
+                                    for a in entitySensor.extraAttributes.values())
+        object.__setattr__(self, "extraAttributes", extraAttributes)
+
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "timestamp", timestamp)
+        # Formatted value and extra attributes, by includeUnit:
+        object.__setattr__(self, "formatted", {})
+
+    def GetEntitySensor(self) -> EntitySensor:
+        """ The live sensor, for its static data: id, key, formatter options, custom payload """
+        return self.entitySensor
+
+    def GetEntity(self) -> Entity:
+        return self.entitySensor.GetEntity()
+
+    def GetId(self) -> str:
+        return self.entitySensor.GetId()
+
+    def GetKey(self) -> str:
+        return self.entitySensor.GetKey()
+
+    def GetVersion(self) -> int:
+        """ Version of the entity snapshot in which this sensor last changed """
+        return self.version
+
+    def GetTimestamp(self) -> float:
+        """ Time of the commit in which this sensor last changed """
+        return self.timestamp
+
+    def GetValueFormatterOptions(self):
+        return self.entitySensor.GetValueFormatterOptions()
+
+    def HasValue(self) -> bool:
+        return self.hasValue
+
+    def GetValue(self) -> str | int | float:
+        if self.hasValue:
+            return self.value
+        else:
+            raise Exception("No value for this sensor!")
+
+    def GetFormattedValue(self, includeUnit: bool) -> str:
+        """ Value formatted with the options of the sensor, computed at the first call """
+        key = bool(includeUnit)
+        if key not in self.formatted:
+            self.formatted[key] = ValueFormatter.FormatValue(
+                self.GetValue(), self.GetValueFormatterOptions(), key)
+        return self.formatted[key]
+
+    def HasExtraAttributes(self) -> bool:
+        return self.extraAttributes is not None
+
+    def GetExtraAttributes(self) -> Iterable[ExtraAttribute]:
+        if not self.HasExtraAttributes():
+            raise Exception("No extra attribute set yet!")
+        return self.extraAttributes
+
+    def GetFormattedExtraAtributes(self, includeUnit: bool) -> dict[str, str]:
+        """ Get extra attributes names and formatted values as a dict """
+        key = ("extraAttributes", bool(includeUnit))
+        if key not in self.formatted:
+            self.formatted[key] = {extraAttr.GetName(): ValueFormatter.FormatValue(
+                extraAttr.GetValue(),
+                extraAttr.GetValueFormatterOptions(),
+                includeUnit)
+                for extraAttr in self.GetExtraAttributes()}
+        # A copy, so the caller can change it:
+        return dict(self.formatted[key])
+
+
+class EntitySnapshot(Immutable):
+    """ Immutable state of all the sensors of an entity, swapped by the entity after every commit.
+        Sensors that didn't change keep the SensorSnapshot of the previous version. """
+
+    __slots__ = ("entity", "sensors", "version", "timestamp")
+
+    def __init__(self, entity: Entity, sensors: dict[str, SensorSnapshot], version: int, timestamp: float) -> None:
+        object.__setattr__(self, "entity", entity)
+        object.__setattr__(self, "sensors", MappingProxyType(sensors))
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "timestamp", timestamp)
+
+    def GetEntity(self) -> Entity:
+        return self.entity
+
+    def GetVersion(self) -> int:
+        """ Increased at every commit with changes """
+        return self.version
+
+    def GetTimestamp(self) -> float:
+        """ Time of the commit """
+        return self.timestamp
+
+    def GetSensors(self) -> Iterable[SensorSnapshot]:
+        """ Snapshots of all the sensors, in registration order """
+        return self.sensors.values()
+
+    def GetSensorByKey(self, key: str) -> SensorSnapshot:
+        try:
+            return self.sensors[key]
+        except KeyError:
+            raise UnknownEntityKeyException(key)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import time
+
+# Keys in entity configurations and in entities.yaml:
+CONFIG_KEY_PUBLISH_DEADBAND = "publish_deadband"
+CONFIG_KEY_PUBLISH_RELATIVE_DEADBAND = "publish_relative_deadband"
+CONFIG_KEY_PUBLISH_MIN_INTERVAL = "publish_min_interval"
+CONFIG_KEY_PUBLISH_MAX_SILENCE = "publish_max_silence"
+
+# Config keys and PublishPolicy arguments:
+PUBLISH_POLICY_KEYS = {
+    CONFIG_KEY_PUBLISH_DEADBAND: "deadband",
+    CONFIG_KEY_PUBLISH_RELATIVE_DEADBAND: "relative_deadband",
+    CONFIG_KEY_PUBLISH_MIN_INTERVAL: "min_interval",
+    CONFIG_KEY_PUBLISH_MAX_SILENCE: "max_silence"
+}
+
+
+class PublishPolicy():
+    """ Rules to decide when a value has to be published:
+        - deadband: numeric values are published only if they moved more than this from the last published value
+        - relative_deadband: same as deadband, as a fraction of the last published value (0.05 is 5%)
+        - min_interval: seconds that must pass between 2 publishes
+        - max_silence: seconds after which the value is published even if unchanged (heartbeat), 0 to disable
+
+        Values are compared with the last published value and not with the last sample, so a value
+        jittering around the deadband edge is not published at every update (hysteresis).
+        With the default policy a value is published only if its payload changed.
+    """
+
+    def __init__(self, deadband: float = 0, relative_deadband: float = 0,
+                 min_interval: float = 0, max_silence: float = 0) -> None:
+        self.deadband = float(deadband)
+        self.relative_deadband = float(relative_deadband)
+        self.min_interval = float(min_interval)
+        self.max_silence = float(max_silence)
+
+    @classmethod
+    def FromDict(cls, config: dict, base: PublishPolicy | None = None) -> PublishPolicy:
+        """Create a policy from a dict with the CONFIG_KEY_PUBLISH_ keys
+
+        Args:
+            config (dict): The configuration, other keys are ignored. Empty values are ignored.
+            base (PublishPolicy | None, optional): Policy to use for missing keys. Defaults to None.
+
+        Raises:
+            ValueError: If a value is not a number
+
+        Returns:
+            PublishPolicy: The new policy
+        """
+        base = base or cls()
+        values = {
+            "deadband": base.deadband,
+            "relative_deadband": base.relative_deadband,
+            "min_interval": base.min_interval,
+            "max_silence": base.max_silence
+        }
+
+        for key, argument in PUBLISH_POLICY_KEYS.items():
+            if config.get(key) not in [None, ""]:
+                values[argument] = float(config[key])
+
+        return cls(**values)
+
+    def WithoutDeadband(self) -> PublishPolicy:
+        """ The same policy with publish on every change, for values that can't be compared as numbers """
+        return PublishPolicy(min_interval=self.min_interval,
+                             max_silence=self.max_silence)
+
+    def IsChanged(self, last_value, value) -> bool:
+        """ True if value is far enough from last_value to be published """
+        if IsNumber(value) and IsNumber(last_value):
+            if self.deadband or self.relative_deadband:
+                change = abs(value - last_value)
+                return change > self.deadband and \
+                    change > self.relative_deadband * abs(last_value)
+        return value != last_value
+
+
+class PublishFilter():
+    """ Applies a PublishPolicy to a single topic, remembering what was published last """
+
+    def __init__(self, policy: PublishPolicy) -> None:
+        self.policy = policy
+        self.published = False
+        self.lastValue = None
+        self.lastPayload = None
+        self.lastPublishTime = 0.0
+        # When the change held back by min_interval can be published, None if there isn't one:
+        self.pendingTime = None
+
+    def ShouldPublish(self, value, payload: str, force: bool = False) -> bool:
+        """Check if the value has to be published. If True is returned, it's considered published.
+        A change held back by min_interval is pending: check it again at GetPendingTime(), or it's lost.
+
+        Args:
+            value: The raw value, used for the deadband
+            payload (str): The formatted value that would be published
+            force (bool, optional): Publish anyway, e.g. for a full refresh. Defaults to False.
+
+        Returns:
+            bool: If the value has to be published
+        """
+        now = time.monotonic()
+        elapsed = now - self.lastPublishTime
+        self.pendingTime = None
+
+        if force or not self.published:
+            should_publish = True
+        elif self.policy.max_silence and elapsed >= self.policy.max_silence:
+            should_publish = True
+        elif elapsed < self.policy.min_interval:
+            should_publish = False
+            if payload != self.lastPayload:
+                self.pendingTime = self.lastPublishTime + self.policy.min_interval
+        elif payload == self.lastPayload:
+            should_publish = False
+        else:
+            should_publish = self.policy.IsChanged(self.lastValue, value)
+
+        if should_publish:
+            self.published = True
+            self.lastValue = value
+            self.lastPayload = payload
+            self.lastPublishTime = now
+
+        return should_publish
+
+    def GetPendingTime(self) -> float | None:
+        """ Time (time.monotonic()) when the change held back by min_interval can be published, None if there isn't one """
+        return self.pendingTime
+
+
+def IsNumber(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
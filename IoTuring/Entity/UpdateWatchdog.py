@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import threading
+import time
+
+# Deadline of the update or callback running in the current thread:
+_current = threading.local()
+
+
+class Deadline():
+    """ Context manager that sets a deadline for the code running in the current thread.
+        Python code can't be interrupted, but subprocesses started with Entity.RunCommand
+        are killed when the deadline expires. A deadline of 0 means no deadline. """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = float(seconds)
+        self.previous = None
+
+    def __enter__(self) -> Deadline:
+        self.previous = getattr(_current, "deadline", None)
+        if self.seconds > 0:
+            _current.deadline = time.monotonic() + self.seconds
+        return self
+
+    def __exit__(self, *args) -> None:
+        _current.deadline = self.previous
+
+
+def GetRemainingTime() -> float | None:
+    """ Seconds left before the deadline of the current thread, None if there is no deadline """
+    deadline = getattr(_current, "deadline", None)
+    if deadline is None:
+        return None
+    return max(0, deadline - time.monotonic())
+
+
+class UpdateStats():
+    """ Counters of the updates and the callbacks of an entity """
+
+    __slots__ = ("lastDuration", "overruns", "timeouts", "commandTimeouts")
+
+    def __init__(self) -> None:
+        # Seconds of the last update:
+        self.lastDuration = 0.0
+        # Ticks skipped because the update was still running:
+        self.overruns = 0
+        # Updates that exceeded the deadline:
+        self.timeouts = 0
+        # Command callbacks that exceeded the deadline:
+        self.commandTimeouts = 0
+
+    def ToDict(self) -> dict:
+        return {
+            "last_duration": round(self.lastDuration, 3),
+            "overruns": self.overruns,
+            "timeouts": self.timeouts,
+            "command_timeouts": self.commandTimeouts
+        }
+
+    def __str__(self) -> str:
+        return ", ".join(f"{key}: {value}" for key, value in self.ToDict().items())
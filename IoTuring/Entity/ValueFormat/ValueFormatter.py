@@ -1,4 +1,5 @@
 from __future__ import annotations
+from typing import Callable
 import math
 from IoTuring.Entity.ValueFormat import ValueFormatterOptions
 
@@ -33,45 +34,35 @@ class ValueFormatter():
         Format the value according to the options. Returns value as string.
         IncludeUnit: True if the unit has to be included in the value
         """
-        return str(ValueFormatter._ParseValue(value, options, includeUnit))
-    
+        return ValueFormatter.GetFormatter(options, includeUnit)(value)
+
     @staticmethod
-    def _ParseValue(value, options: ValueFormatterOptions | None, includeUnit: bool):
+    def GetFormatter(options: ValueFormatterOptions | None, includeUnit: bool) -> Callable[[object], str]:
+        """
+        Return a function that formats a value like FormatValue with these options and includeUnit.
+        Compiled once for each options object: nothing about the options is checked again at every value
+        """
         if options is None:
-            return value
-        valueType = options.get_value_type()
-        
-        # specific type formatting
-        if valueType == ValueFormatterOptions.TYPE_NONE:  # edit needed only if decimals
-            return ValueFormatter.roundValue(value, options)
-        elif valueType == ValueFormatterOptions.TYPE_BYTE:
-            return ValueFormatter.ByteFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_MILLISECONDS:
-            return ValueFormatter.MillisecondsFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_TIME:
-            return ValueFormatter.TimeFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_FREQUENCY:
-            return ValueFormatter.FrequencyFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_TEMPERATURE:
-            return ValueFormatter.TemperatureCelsiusFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_ROTATION:
-            return ValueFormatter.RoundsPerMinuteFormatter(value, options, includeUnit)
-        elif valueType ==ValueFormatterOptions.TYPE_RADIOPOWER:
-            return ValueFormatter.RadioPowerFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_PERCENTAGE:
-            if includeUnit:
-                return str(value) + SPACE_BEFORE_UNIT + '%'
-            else:
-                return str(value)
-        elif valueType == ValueFormatterOptions.TYPE_BIT_PER_SECOND:
-            return ValueFormatter.BitPerSecondFormatter(value, options, includeUnit)
-        elif valueType == ValueFormatterOptions.TYPE_BYTE_PER_SECOND:
-            return ValueFormatter.BytePerSecondFormatter(value, options, includeUnit)
-        else:
-            return str(value)
+            return str
+        return options.Compile(includeUnit)
+
+    @staticmethod
+    def CompileFormatter(options: ValueFormatterOptions, includeUnit: bool) -> Callable[[object], str]:
+        """ Build the formatter of the options, with unit, divider and decimals already chosen """
+        return TYPE_COMPILERS.get(options.get_value_type(), CompileDefaultFormatter)(options, includeUnit)
+
+    @staticmethod
+    def CompileNoneFormatter(options: ValueFormatterOptions, includeUnit: bool):
+        # edit needed only if decimals
+        return MakeFormatter(options.get_decimals())
+
+    @staticmethod
+    def CompilePercentageFormatter(options: ValueFormatterOptions, includeUnit: bool):
+        # decimals not implemented
+        return MakeFormatter(ValueFormatterOptions.DO_NOT_TOUCH_DECIMALS, '%' if includeUnit else None)
 
     @staticmethod
-    def TimeFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
+    def CompileTimeFormatter(options: ValueFormatterOptions, includeUnit: bool):
         # Get value in seconds, and adjustable
         asked_size = options.get_adjust_size()
 
@@ -80,151 +71,120 @@ class ValueFormatter():
             divider = 1
             for i in range(0, index+1):
                 divider = divider*TIME_SIZES_DIVIDERS[i]
-
-            value = value/divider
         else:
             index = 0
+            divider = None
 
-        value = ValueFormatter.roundValue(value, options)
-        result = str(value)
-
-        if includeUnit:
-            result = result + SPACE_BEFORE_UNIT + TIME_SIZES[index]
-
-        return result
+        return MakeFormatter(options.get_decimals(), TIME_SIZES[index] if includeUnit else None, divider)
 
     @staticmethod
-    def MillisecondsFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
+    def CompileMillisecondsFormatter(options: ValueFormatterOptions, includeUnit: bool):
         # Get value in milliseconds: adjust not implemented
-        
-        value = ValueFormatter.roundValue(value, options)
-        
-        if includeUnit:
-            return str(value) + SPACE_BEFORE_UNIT + 'ms'
-        else:
-            return str(value)
+        return MakeFormatter(options.get_decimals(), 'ms' if includeUnit else None)
 
     # Get from number of bytes the correct byte size: 1045B is 1KB. If size_wanted passed and is SIZE_MEGABYTE, if I have 10^9B, I won't diplay 1GB but c.a. 1000MB
     @staticmethod
-    def ByteFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
+    def CompileByteFormatter(options: ValueFormatterOptions, includeUnit: bool):
         # Get value in bytes
         asked_size = options.get_adjust_size()
         decimals = options.get_decimals()
 
         if asked_size and asked_size in BYTE_SIZES:
             powOf1024 = BYTE_SIZES.index(asked_size)
-        # If value == 0 math.log failes, so simply send 0:
-        elif float(value) == 0:
-            powOf1024 = 0
-        else:
-            powOf1024 = math.floor(math.log(value, 1024))
-
-        value = value/(math.pow(1024, powOf1024))
+            return MakeFormatter(decimals, BYTE_SIZES[powOf1024] if includeUnit else None,
+                                 math.pow(1024, powOf1024))
 
-        value = ValueFormatter.roundValue(value, options)
+        # Size chosen by the value:
+        units = [SPACE_BEFORE_UNIT + size if includeUnit else '' for size in BYTE_SIZES]
+        roundValue = decimals != ValueFormatterOptions.DO_NOT_TOUCH_DECIMALS
 
-        result = str(value)
+        def ByteFormatter(value):
+            # If value == 0 math.log failes, so simply send 0:
+            if float(value) == 0:
+                powOf1024 = 0
+            else:
+                powOf1024 = math.floor(math.log(value, 1024))
 
-        if includeUnit:
-            result = result + SPACE_BEFORE_UNIT + BYTE_SIZES[powOf1024]
+            value = value/(math.pow(1024, powOf1024))
+            if roundValue:
+                value = round(value, decimals)
+            return str(value) + units[powOf1024]
 
-        return result
+        return ByteFormatter
 
     @staticmethod
-    def FrequencyFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
+    def CompileFrequencyFormatter(options: ValueFormatterOptions, includeUnit: bool):
         # Get value in hertz, and adjustable
-        asked_size = options.get_adjust_size()
-
-        if asked_size and asked_size in FREQUENCY_SIZES:
-            index = FREQUENCY_SIZES.index(asked_size)
-            value = value/pow(1000,index)
-        else:
-            index = 0
-
-        # decimals
-        value = ValueFormatter.roundValue(value, options)
-
-        result = str(value)
-        
-        if includeUnit:
-            result = result + SPACE_BEFORE_UNIT + FREQUENCY_SIZES[index]
-        return result
-
+        return CompileThousandsFormatter(options, includeUnit, FREQUENCY_SIZES)
 
     @staticmethod
-    def TemperatureCelsiusFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
+    def CompileTemperatureCelsiusFormatter(options: ValueFormatterOptions, includeUnit: bool):
         # asked_size not implemented
-        
-        # decimals
-        value = ValueFormatter.roundValue(value, options)
-
-        result = str(value)
-        
-        if includeUnit:
-            result = result + SPACE_BEFORE_UNIT + CELSIUS_UNIT 
-        return result
+        return MakeFormatter(options.get_decimals(), CELSIUS_UNIT if includeUnit else None)
 
     @staticmethod
-    def RoundsPerMinuteFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
+    def CompileRoundsPerMinuteFormatter(options: ValueFormatterOptions, includeUnit: bool):
         # asked_size not implemented
-        
-        # decimals
-        value = ValueFormatter.roundValue(value, options)
+        return MakeFormatter(options.get_decimals(), ROTATION[0] if includeUnit else None)
 
-        result = str(value)
-        
-        if includeUnit:
-            result = result + SPACE_BEFORE_UNIT + ROTATION[0]
-        return result
-
-    @staticmethod
-    def RadioPowerFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
-        
-        value = ValueFormatter.roundValue(value, options)
-        
-        if includeUnit:
-            return str(value) + SPACE_BEFORE_UNIT + 'dBm'
-        else:
-            return str(value)
-        
     @staticmethod
-    def BytePerSecondFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
-        # Get value in hertz, and adjustable
-        asked_size = options.get_adjust_size()
-
-        if asked_size and asked_size in BYTE_PER_SECOND_SIZES:
-            index = BYTE_PER_SECOND_SIZES.index(asked_size)
-            value = value/pow(1000,index)
-        else:
-            index = 0
-
-        value = ValueFormatter.roundValue(value, options)
+    def CompileRadioPowerFormatter(options: ValueFormatterOptions, includeUnit: bool):
+        return MakeFormatter(options.get_decimals(), RADIOPOWER[0] if includeUnit else None)
 
-        if includeUnit:
-            return str(value) + SPACE_BEFORE_UNIT + BYTE_PER_SECOND_SIZES[index]
-        else:
-            return str(value)
-
-    def BitPerSecondFormatter(value, options: ValueFormatterOptions, includeUnit: bool):
-        # Get value in hertz, and adjustable
-        asked_size = options.get_adjust_size()
-
-        if asked_size and asked_size in BYTE_PER_SECOND_SIZES:
-            index = BIT_PER_SECOND_SIZES.index(asked_size)
-            value = value/pow(1000,index)
-        else:
-            index = 0
-
-        value = ValueFormatter.roundValue(value, options)
-
-        if includeUnit:
-            return str(value) + SPACE_BEFORE_UNIT + BIT_PER_SECOND_SIZES[index]
-        else:
-            return str(value)
+    @staticmethod
+    def CompileBytePerSecondFormatter(options: ValueFormatterOptions, includeUnit: bool):
+        return CompileThousandsFormatter(options, includeUnit, BYTE_PER_SECOND_SIZES)
 
     @staticmethod
-    def roundValue(value, options: ValueFormatterOptions):
-        if options.get_decimals() != ValueFormatterOptions.DO_NOT_TOUCH_DECIMALS:
-            return round(value, options.get_decimals())
-        return value
-    
+    def CompileBitPerSecondFormatter(options: ValueFormatterOptions, includeUnit: bool):
+        return CompileThousandsFormatter(options, includeUnit, BIT_PER_SECOND_SIZES)
+
+
+def MakeFormatter(decimals: int, unit: str | None = None, divider: float | None = None) -> Callable[[object], str]:
+    """ Formatter that divides the value (if divider is not None), rounds it (unless decimals are untouched) and adds the unit (if any) """
+    unit = SPACE_BEFORE_UNIT + unit if unit is not None else ''
+    roundValue = decimals != ValueFormatterOptions.DO_NOT_TOUCH_DECIMALS
+
+    if divider is None:
+        if roundValue:
+            return lambda value: str(round(value, decimals)) + unit
+        if unit:
+            return lambda value: str(value) + unit
+        return str
+    if roundValue:
+        return lambda value: str(round(value/divider, decimals)) + unit
+    return lambda value: str(value/divider) + unit
+
+
+def CompileThousandsFormatter(options: ValueFormatterOptions, includeUnit: bool, sizes: list[str]):
+    """ Formatter of a value whose sizes are powers of 1000, divided only if a size is asked """
+    asked_size = options.get_adjust_size()
+
+    if asked_size and asked_size in sizes:
+        index = sizes.index(asked_size)
+        divider = pow(1000, index)
+    else:
+        index = 0
+        divider = None
+
+    return MakeFormatter(options.get_decimals(), sizes[index] if includeUnit else None, divider)
+
+
+def CompileDefaultFormatter(options: ValueFormatterOptions, includeUnit: bool):
+    return str
+
+
+# Formatter compiler of each value type:
+TYPE_COMPILERS = {
+    ValueFormatterOptions.TYPE_NONE: ValueFormatter.CompileNoneFormatter,
+    ValueFormatterOptions.TYPE_BYTE: ValueFormatter.CompileByteFormatter,
+    ValueFormatterOptions.TYPE_MILLISECONDS: ValueFormatter.CompileMillisecondsFormatter,
+    ValueFormatterOptions.TYPE_TIME: ValueFormatter.CompileTimeFormatter,
+    ValueFormatterOptions.TYPE_FREQUENCY: ValueFormatter.CompileFrequencyFormatter,
+    ValueFormatterOptions.TYPE_TEMPERATURE: ValueFormatter.CompileTemperatureCelsiusFormatter,
+    ValueFormatterOptions.TYPE_ROTATION: ValueFormatter.CompileRoundsPerMinuteFormatter,
+    ValueFormatterOptions.TYPE_RADIOPOWER: ValueFormatter.CompileRadioPowerFormatter,
+    ValueFormatterOptions.TYPE_PERCENTAGE: ValueFormatter.CompilePercentageFormatter,
+    ValueFormatterOptions.TYPE_BIT_PER_SECOND: ValueFormatter.CompileBitPerSecondFormatter,
+    ValueFormatterOptions.TYPE_BYTE_PER_SECOND: ValueFormatter.CompileBytePerSecondFormatter
+}
@@ -17,15 +17,28 @@ class ValueFormatterOptions():
         self.value_type = value_type
         self.decimals = decimals
         self.adjust_size = adjust_size
+        # Formatter compiled from these options, for each includeUnit:
+        self.formatters = {}
         
     def set_value_type(self, value_type):
         self.value_type = value_type
+        self.formatters = {}
         
     def set_decimals(self, decimals):
         self.decimals = decimals
+        self.formatters = {}
         
     def set_adjust_size(self, adjust_size):
         self.adjust_size = adjust_size
+        self.formatters = {}
+
+    def Compile(self, includeUnit: bool):
+        """ Function that formats a value with these options, built at the first call """
+        includeUnit = bool(includeUnit)
+        if includeUnit not in self.formatters:
+            from IoTuring.Entity.ValueFormat.ValueFormatter import ValueFormatter
+            self.formatters[includeUnit] = ValueFormatter.CompileFormatter(self, includeUnit)
+        return self.formatters[includeUnit]
         
     def get_value_type(self):
         return self.value_type
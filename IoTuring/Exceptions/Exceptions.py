@@ -18,3 +18,9 @@ class UnknownLoglevelException(Exception):
     def __init__(self, loglevel: str) -> None:
         super().__init__(f"Unknown log level: {loglevel}")
         self.loglevel = loglevel
+
+
+class DeadlineExceededException(Exception):
+    def __init__(self, name: str, timeout: float) -> None:
+        super().__init__(f"{name} killed after {timeout:g}s deadline")
+        self.timeout = timeout
@@ -37,6 +37,8 @@ class LogLevel:
 class LogLevelObject:
     """ Base class for loglevel properties """
 
+    __slots__ = ()
+
     LOG_DEBUG = LogLevel("DEBUG")
     LOG_INFO = LogLevel("INFO")
     LOG_WARNING = LogLevel("WARNING")
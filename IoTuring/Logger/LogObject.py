@@ -3,6 +3,8 @@ from IoTuring.Logger.LogLevel import LogLevelObject, LogLevel
 
 class LogObject(LogLevelObject):
 
+    __slots__ = ()
+
     def Log(self, loglevel: LogLevel, message, **kwargs):
         logger = Logger()
         logger.Log(
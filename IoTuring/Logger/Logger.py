@@ -336,6 +336,10 @@ class Logger(LogLevelObject, metaclass=Singleton):
             style="{"
         )
 
+    def IsLoglevelEnabled(self, loglevel: LogLevel) -> bool:
+        """ True if at least one handler logs messages of this loglevel """
+        return any(int(loglevel) >= handler.level for handler in self.logger.handlers)
+
     def Log(self, loglevel: LogLevel, source: str, message, color: str = "", logtarget: str = "") -> None:
         """Log a message
 
@@ -347,6 +351,10 @@ class Logger(LogLevelObject, metaclass=Singleton):
             logtarget (str, optional): self.LOGTARGET_CONSOLE or self.LOGTARGET_FILE. Defaults to "".
         """
 
+        # Formatting the message is expensive, skip it if no handler would log it:
+        if not self.IsLoglevelEnabled(loglevel):
+            return
+
         log_message = LogMessage(
             source=source, message=message, color=color or loglevel.color, logtarget=logtarget)
 
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from typing import Callable
+
+from threading import Lock
+
+from IoTuring.Logger.Logger import Singleton
+
+# Percentiles are computed on the last samples only:
+SAMPLES_NUMBER = 256
+
+# Metric name prefixes, followed by the id of the entity, command or warehouse:
+METRIC_UPDATE = "update"
+METRIC_CALLBACK = "callback"
+METRIC_LOOP = "loop"
+METRIC_LOOP_CHANGES = "loop_changes"
+METRIC_PUBLISH_LATENCY = "publish_latency"
+METRIC_COMMAND_WAIT = "command_wait"
+
+# Gauge name prefixes:
+GAUGE_MQTT_QUEUE = "mqtt_queue"
+GAUGE_MQTT_SPOOL = "mqtt_spool"
+GAUGE_MQTT_V5 = "mqtt_v5"
+GAUGE_COMMANDS = "commands"
+
+
+class DurationMetric():
+    """ Count, errors and durations of a timed operation """
+
+    __slots__ = ("count", "errors", "last", "max", "samples", "lock")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        # Durations in milliseconds:
+        self.last = 0.0
+        self.max = 0.0
+        # Ring buffer of the last durations:
+        self.samples = []
+        self.lock = Lock()
+
+    def Record(self, seconds: float, error: bool = False) -> None:
+        """ Add a duration in seconds, cheap enough to be called at every update """
+        ms = seconds * 1000
+        with self.lock:
+            if len(self.samples) < SAMPLES_NUMBER:
+                self.samples.append(ms)
+            else:
+                self.samples[self.count % SAMPLES_NUMBER] = ms
+            self.count += 1
+            self.last = ms
+            if ms > self.max:
+                self.max = ms
+            if error:
+                self.errors += 1
+
+    def GetPercentile(self, percentile: float) -> float:
+        """ Duration in milliseconds under which are the given percentile (from 0 to 100) of the last samples """
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        index = round(percentile / 100 * (len(samples) - 1))
+        return samples[index]
+
+    def ToDict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "last": round(self.last, 2),
+            "p50": round(self.GetPercentile(50), 2),
+            "p95": round(self.GetPercentile(95), 2),
+            "max": round(self.max, 2)
+        }
+
+
+class MetricsRegistry(metaclass=Singleton):
+    """ In-process registry of the durations of updates, command callbacks and warehouse loops,
+        and of gauges, functions that return the current state of something, like a queue depth """
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, DurationMetric] = {}
+        self.gauges: dict[str, Callable[[], dict]] = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def MakeName(prefix: str, id: str) -> str:
+        """ Name of the metric of an entity, command or warehouse id """
+        return prefix + "." + id
+
+    def GetMetric(self, name: str) -> DurationMetric:
+        """ Return the metric with this name, created if missing """
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, DurationMetric())
+        return metric
+
+    def Record(self, name: str, seconds: float, error: bool = False) -> None:
+        """ Add a duration in seconds to the metric """
+        self.GetMetric(name).Record(seconds, error)
+
+    def GetMetrics(self, prefix: str = "") -> dict[str, DurationMetric]:
+        """ Return the metrics by name, only the ones that start with prefix if passed """
+        with self.lock:
+            return {name: metric for name, metric in self.metrics.items()
+                    if name.startswith(prefix)}
+
+    def RegisterGauge(self, name: str, function: Callable[[], dict]) -> None:
+        """ Register a function that returns a dict of current values, called only when the gauges are read """
+        with self.lock:
+            self.gauges[name] = function
+
+    def GetGauges(self, prefix: str = "") -> dict[str, dict]:
+        """ Return the current values of the gauges by name, only the ones that start with prefix if passed """
+        with self.lock:
+            gauges = {name: function for name, function in self.gauges.items()
+                      if name.startswith(prefix)}
+        return {name: function() for name, function in gauges.items()}
@@ -4,6 +4,7 @@ import platform
 import os
 import psutil
 import shutil
+import signal
 import subprocess
 
 class OperatingSystemDetection():
@@ -60,8 +61,8 @@ class OperatingSystemDetection():
                 env_value = ""
         return env_value
             
-    @staticmethod
-    def RunCommand(command: str | list,
+    @classmethod
+    def RunCommand(cls, command: str | list,
                    shell: bool = False,
                    **kwargs) -> subprocess.CompletedProcess:
         """Safely call a subprocess. Kwargs are other Subprocess options
@@ -69,7 +70,10 @@ class OperatingSystemDetection():
         Args:
             command (str | list): The command to call
             shell (bool, optional): Run in shell. Defaults to False.
-            **kwargs: subprocess args
+            **kwargs: subprocess args. With timeout, the process and its children are killed when it expires.
+
+        Raises:
+            subprocess.TimeoutExpired: If the timeout expired
 
         Returns:
             subprocess.CompletedProcess: See subprocess docs
@@ -90,11 +94,44 @@ class OperatingSystemDetection():
         else:
             runcommand = command
 
-        p = subprocess.run(
-            runcommand, shell=shell, **kwargs)
+        if kwargs.get("timeout") is None:
+            p = subprocess.run(
+                runcommand, shell=shell, **kwargs)
+        else:
+            p = cls.RunCommandWithTimeout(runcommand, shell=shell, **kwargs)
 
         return p
 
+    @classmethod
+    def RunCommandWithTimeout(cls, command: str | list,
+                              timeout: float,
+                              input: str | bytes | None = None,
+                              capture_output: bool = False,
+                              **kwargs) -> subprocess.CompletedProcess:
+        """ Like subprocess.run, but on timeout kills the whole process group, not only the first process.
+            Otherwise the children of a shell survive and keep the output pipes open. """
+
+        if capture_output:
+            kwargs["stdout"] = subprocess.PIPE
+            kwargs["stderr"] = subprocess.PIPE
+        if input is not None:
+            kwargs["stdin"] = subprocess.PIPE
+        if not cls.IsWindows():
+            kwargs["start_new_session"] = True
+
+        with subprocess.Popen(command, **kwargs) as process:
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                if cls.IsWindows():
+                    process.kill()
+                else:
+                    os.killpg(process.pid, signal.SIGKILL)
+                process.communicate()
+                raise
+
+        return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
 
     @staticmethod
     def CommandExists(command) -> bool:
@@ -1,8 +1,15 @@
+from __future__ import annotations
 import sys
+import time
+from threading import Thread, Event, Lock
 
 from IoTuring.Logger.LogObject import LogObject
 from IoTuring.MyApp.App import App
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_PUBLISH_LATENCY, GAUGE_MQTT_QUEUE, GAUGE_MQTT_SPOOL, GAUGE_MQTT_V5
+from IoTuring.Configurator.ConfiguratorIO import ConfiguratorIO
 import paho.mqtt.client as MqttClient
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 
 try:
     import paho.mqtt.enums as mqttEnums
@@ -11,6 +18,11 @@ except ModuleNotFoundError:
 
 
 from IoTuring.Protocols.MQTTClient.TopicCallback import TopicCallback
+from IoTuring.Protocols.MQTTClient.TopicTrie import TopicTrie, TopicMatches
+from IoTuring.Protocols.MQTTClient.OutboundQueue import OutboundQueue, OutboundMessage
+from IoTuring.Protocols.MQTTClient.Spool import Spool
+from IoTuring.Protocols.MQTTClient.TopicAliases import TopicAliases
+from IoTuring.Protocols.MQTTClient.ReconnectBackoff import ReconnectBackoff
 
 """
 
@@ -19,37 +31,196 @@ MQTTClient Operations:
 - AsyncConnect
 - SendTopicData
 - AddNewTopicToSubscribeTo
+- AddWildcardSubscription
+- AddConnectCallback
+- SetReconnectBackoff
 
 """
 
+# Maximum number of topics waiting to be published, then the oldest are dropped:
+OUTBOUND_QUEUE_SIZE = 10000
+# Wait before publishing again if the client refused a message while connected:
+PUBLISH_RETRY_SECONDS = 1
+
+# Spooled messages sent per second after a reconnection, not to flood the broker:
+SPOOL_REPLAY_RATE = 100
+SPOOL_FILENAME = "spool_{}.bin"
+
+# MQTT v5: seconds the broker keeps the session (and so the subscriptions) after a disconnection
+SESSION_EXPIRY_SECONDS = 3600
+
+# Seconds to wait for the will message to be sent when the client is released
+RELEASE_TIMEOUT = 2
+
+# Default delays between reconnection attempts: the first up to this, doubling up to the maximum
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 120
+
 
 class MQTTClient(LogObject):
     client = None
     connected = False
 
+    # Clients shared by the warehouses, by broker address, port and credentials:
+    sharedClients: dict[tuple, list[MQTTClient]] = {}
+    sharedClientsLock = Lock()
+
     # After the init, you have to connect with AsyncConnect !
-    def __init__(self, address, port=1883, name=None, username="", password=""):
+    def __init__(self, address, port=1883, name=None, username="", password="", mqtt_v5: bool = False):
         self.address = address
         self.port = int(port)
         self.name = name
         self.username = username
         self.password = password
+        self.mqttV5 = mqtt_v5
 
         if self.name == None:
             self.name = App.getName()
 
+        # Warehouses using this client, if shared:
+        self.users = 0
+        # Connections established, to know if something was sent in the current one:
+        self.connectionCount = 0
+        self.started = False
+        # Topic and payload of the will message, only one per connection:
+        self.lwt: tuple[str, str] | None = None
+
         # List of TopicCallback objects, which I use to call callbacks, compare topics, keep subscribed state
         self.topicCallbacks = []
+        # The same TopicCallbacks by topic, to find the ones of a received message:
+        self.topicRouter = TopicTrie()
+        # Wildcard topics subscribed once for all the callbacks they match, with their subscribed state:
+        self.wildcardSubscriptions: dict[str, bool] = {}
+        self.subscriptionsLock = Lock()
+
+        # Functions called at every connection, to resend what the broker may have lost:
+        self.connectCallbacks = []
+
+        # Messages are published from a queue by the sender thread, only while connected:
+        self.outboundQueue = OutboundQueue(OUTBOUND_QUEUE_SIZE)
+        self.connectedEvent = Event()
+
+        # Optional durable buffer for the messages sent while disconnected:
+        self.spool: Spool | None = None
+        self.spoolLock = Lock()
+
+        # MQTT v5 only: aliases of the recurring topics and seconds after which the broker drops
+        # the messages not delivered yet, 0 to keep them:
+        self.topicAliases = TopicAliases()
+        self.messageExpiry = 0
+
+        self.reconnectBackoff = ReconnectBackoff(
+            RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY)
+
+        registry = MetricsRegistry()
+        self.publishLatencyMetric = registry.GetMetric(
+            registry.MakeName(METRIC_PUBLISH_LATENCY, self.name))
+        registry.RegisterGauge(registry.MakeName(GAUGE_MQTT_QUEUE, self.name),
+                               self.outboundQueue.GetStats)
+        if self.mqttV5:
+            registry.RegisterGauge(registry.MakeName(GAUGE_MQTT_V5, self.name),
+                                   self.topicAliases.GetStats)
 
         self.Log(self.LOG_INFO, 'Preparing MQTT client')
         self.SetupClient()
 
+    @classmethod
+    def GetSharedClient(cls, address, port=1883, name=None, username="", password="", mqtt_v5: bool = False,
+                        will: tuple[str, str] | None = None) -> MQTTClient:
+        """ Return a client connected to the same broker with the same credentials and protocol, creating it if needed.
+            A connection has only one will message (topic, payload): warehouses with different ones get different clients.
+            The client keeps the name of the first warehouse. Call Release when not used anymore """
+        key = (address, int(port), username, password, mqtt_v5)
+        with cls.sharedClientsLock:
+            clients = cls.sharedClients.setdefault(key, [])
+            client = next((client for client in clients
+                           if will is None or client.lwt in [None, will]), None)
+            if client is None:
+                client = cls(address, port, name, username, password, mqtt_v5)
+                clients.append(client)
+            else:
+                client.Log(client.LOG_INFO,
+                           f"Sharing the connection to {address}:{port} of client {client.name}")
+            if will is not None:
+                client.LwtSet(*will)
+            client.users += 1
+        return client
+
+    def Release(self) -> None:
+        """ A warehouse doesn't use this shared client anymore: disconnect when no warehouse uses it.
+            A clean disconnection doesn't make the broker send the will message, so it's sent before """
+        with self.sharedClientsLock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            key = (self.address, self.port, self.username,
+                   self.password, self.mqttV5)
+            clients = self.sharedClients.get(key, [])
+            if self in clients:
+                clients.remove(self)
+            if not clients:
+                self.sharedClients.pop(key, None)
+
+        if self.lwt and self.connected:
+            try:
+                self.client.publish(self.lwt[0], self.lwt[1]).wait_for_publish(RELEASE_TIMEOUT)
+            except (ValueError, RuntimeError) as e:
+                self.Log(self.LOG_WARNING, f"Can't send the will message: {e}")
+        self.client.disconnect()
+        self.client.loop_stop()
+
+        # Readings not sent stay in the file, for the next start:
+        with self.spoolLock:
+            if self.spool:
+                self.spool.Close()
+                self.spool = None
+
+    def EnableSpool(self, max_size: int, max_age: float) -> None:
+        """Store the messages sent while disconnected in a file, to send them all in order once connected.
+        With a shared client, the first warehouse that enables it sets its size.
+
+        Args:
+            max_size (int): Size of the spool file in bytes
+            max_age (float): Messages older than this in seconds are not sent, 0 to send them all
+        """
+        if self.spool:
+            return
+
+        configuratorIO = ConfiguratorIO()
+        configuratorIO.createFolderPathIfDoesNotExist()
+        path = configuratorIO.getFolderPath().joinpath(SPOOL_FILENAME.format(self.name))
+
+        self.spool = Spool(path, max_size, max_age)
+        registry = MetricsRegistry()
+        registry.RegisterGauge(registry.MakeName(GAUGE_MQTT_SPOOL, self.name),
+                               self.spool.GetStats)
+
+    def SetMessageExpiry(self, seconds: float) -> None:
+        """ MQTT v5 only: the broker drops the non retained messages not delivered within this many seconds,
+            so stale values don't pile up for slow subscribers. With a shared client, the first one set is kept """
+        if self.mqttV5 and not self.messageExpiry:
+            self.messageExpiry = int(seconds)
+
+    def SetReconnectBackoff(self, base: float, cap: float) -> None:
+        """ Wait a random time between 0 and base * 2 ^ attempt seconds, up to cap, before each reconnection attempt """
+        self.reconnectBackoff = ReconnectBackoff(base, cap)
+
+    def GetConnectionCount(self) -> int:
+        """ Number of connections established, increased at every reconnection """
+        return self.connectionCount
+
     def IsConnected(self):
         """ Return True if client is currently connected """
         return self.connected
 
     def SetupClient(self) -> None:
-        self.client = MqttClient.Client(callback_api_version=mqttEnums.CallbackAPIVersion.VERSION2, client_id=self.name)
+        if self.mqttV5:
+            self.client = MqttClient.Client(callback_api_version=mqttEnums.CallbackAPIVersion.VERSION2, client_id=self.name,
+                                            protocol=MqttClient.MQTTv5)
+        else:
+            # Persistent session: the broker keeps the subscriptions while disconnected
+            self.client = MqttClient.Client(callback_api_version=mqttEnums.CallbackAPIVersion.VERSION2, client_id=self.name,
+                                            protocol=MqttClient.MQTTv311, clean_session=False)
 
         if self.username != "" and self.password != "":
             self.client.username_pw_set(self.username, self.password)
@@ -58,12 +229,33 @@ class MQTTClient(LogObject):
         self.client.on_connect = self.Event_OnClientConnect
         self.client.on_disconnect = self.Event_OnClientDisconnect
         self.client.on_message = self.Event_OnMessageReceive
+        self.client.on_connect_fail = self.Event_OnConnectFail
 
     def AsyncConnect(self) -> None:
-        """ Connect async to the broker """
+        """ Connect async to the broker. A shared client connects only the first time """
+        if self.started:
+            return
+        self.started = True
+
         self.Log(self.LOG_INFO, 'MQTT Client ready to connect to the broker')
         # If broker is not reachable wait till he's reachable
-        self.client.connect_async(self.address, port=self.port)
+        self.Connect()
+
+        thread = Thread(target=self.SenderThread)
+        thread.daemon = True
+        thread.start()
+
+    def Connect(self) -> None:
+        """ Start the network loop, which connects and reconnects to the broker """
+        if self.mqttV5:
+            # The first connection starts a clean session, the reconnections resume it:
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = SESSION_EXPIRY_SECONDS
+            self.client.connect_async(self.address, port=self.port,
+                                      clean_start=MqttClient.MQTT_CLEAN_START_FIRST_ONLY,
+                                      properties=properties)
+        else:
+            self.client.connect_async(self.address, port=self.port)
         self.client.loop_start()
 
     # EVENTS
@@ -71,55 +263,240 @@ class MQTTClient(LogObject):
     def Event_OnClientConnect(self, client, userdata, flags, reason_code, properties)-> None:
         if reason_code==0:  # Connections is OK
             self.Log(self.LOG_INFO, "Connection established")
+            self.reconnectBackoff.Reset()
+            if self.mqttV5:
+                self.topicAliases.Reset(
+                    getattr(properties, "TopicAliasMaximum", 0))
+
+            if not flags.session_present:
+                # The broker doesn't remember the subscriptions, all must be done again:
+                self.SetAllAsNotSubscribed()
+            else:
+                self.Log(self.LOG_DEBUG, "Session resumed, subscriptions kept")
+
             self.connected = True
+            self.connectionCount += 1
             self.SubscribeToAllTopics()
+            # Flush the messages queued while disconnected:
+            self.connectedEvent.set()
+            self.outboundQueue.Wake()
+
+            for callback in self.connectCallbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    self.Log(self.LOG_ERROR, "Error in connection callback: " + str(e))
         else:
             self.Log(self.LOG_ERROR, "Connection error: code " + str(reason_code))
 
     def Event_OnClientDisconnect(self, client, userdata, flags, reason_code, properties)-> None:
         self.Log(self.LOG_ERROR, "Connection lost")
         self.connected = False
+        self.connectedEvent.clear()
+        # Aliases of this connection can't be used anymore:
+        self.topicAliases.Reset()
+        self.SetNextReconnectDelay()
+
+    def Event_OnConnectFail(self, client, userdata) -> None:
+        self.SetNextReconnectDelay()
 
-        for topicCallback in self.topicCallbacks:
-            topicCallback.SetAsNotSubscribed()
+    def SetNextReconnectDelay(self) -> None:
+        """ Called before every reconnection attempt: the network loop waits the delay set here """
+        delay = self.reconnectBackoff.NextDelay()
+        self.client.reconnect_delay_set(min_delay=delay, max_delay=delay)
+        self.Log(self.LOG_DEBUG, f"Reconnecting in {delay:.1f} seconds")
 
     def Event_OnMessageReceive(self, client, userdata, message) -> None:
         # TODO QoS also here
         try:
-            topicCallback = self.GetTopicCallback(message.topic)
-            topicCallback.Call_Callback(message)
+            topicCallbacks = self.topicRouter.Match(message.topic)
+            if not topicCallbacks:
+                # Wildcard subscriptions and sessions resumed by the broker receive also messages nobody is waiting for
+                # (e.g. commands of entities removed since the session started):
+                if not self.IsCoveredByWildcard(message.topic):
+                    self.Log(self.LOG_DEBUG,
+                             "Can't find any matching TopicCallback for " + message.topic)
+                return
+            for topicCallback in topicCallbacks:
+                topicCallback.Call_Callback(message)
         except Exception as e:
             self.Log(self.LOG_WARNING, "Error in message receive: " + str(e))
 
     # OUTCOMING MESSAGES PART
 
-    def SendTopicData(self, topic, data) -> None:
-        self.client.publish(topic, data)
+    def SendTopicData(self, topic, data, retain: bool = False) -> None:
+        """ Queue the data to publish. If data for the topic is already waiting, it's replaced.
+            With the spool, data sent while disconnected is spooled instead, and so is the data sent
+            before the spool is emptied, to keep the order """
+        if self.spool:
+            with self.spoolLock:
+                if not self.connected or not self.spool.IsEmpty():
+                    self.spool.Append(topic, data, retain)
+                    return
+        self.outboundQueue.Put(OutboundMessage(topic, data, retain))
+
+    def SenderThread(self) -> None:
+        """ Publish the queued messages while connected. On disconnection, the messages not sent are queued again """
+        while (True):
+            self.connectedEvent.wait()
+
+            if self.spool and not self.spool.IsEmpty():
+                # Messages queued before the disconnection are older than the spooled ones:
+                self.PublishMessages(self.outboundQueue.GetAll(timeout=0))
+                self.ReplaySpool()
+
+            self.PublishMessages(self.outboundQueue.GetAll())
+
+    def Publish(self, topic, payload, retain: bool) -> bool:
+        """ Publish a message now, returns False if the client refused it. With MQTT v5, the recurring topics are
+            replaced by their alias and the non retained messages expire """
+        if not self.mqttV5:
+            return self.client.publish(topic, payload, retain=retain).rc == MqttClient.MQTT_ERR_SUCCESS
+
+        properties = Properties(PacketTypes.PUBLISH)
+        if not retain:
+            # Retained messages (e.g. discovery) are sent once: no alias, no expiry
+            topic, alias = self.topicAliases.Get(topic)
+            if alias:
+                properties.TopicAlias = alias
+            if self.messageExpiry:
+                properties.MessageExpiryInterval = self.messageExpiry
+        return self.client.publish(topic, payload, retain=retain, properties=properties).rc == MqttClient.MQTT_ERR_SUCCESS
+
+    def PublishMessages(self, messages: list[OutboundMessage]) -> None:
+        """ Publish the messages in order, queueing again the ones not sent """
+        for index, message in enumerate(messages):
+            if not self.connected or not self.Publish(message.topic, message.payload, message.retain):
+                self.outboundQueue.PutBack(messages[index:])
+                time.sleep(PUBLISH_RETRY_SECONDS)
+                return
+            self.publishLatencyMetric.Record(
+                time.monotonic() - message.time)
+
+    def ReplaySpool(self) -> None:
+        """ Publish the spooled messages in order, at most SPOOL_REPLAY_RATE per second, until the spool
+            is empty or the client is disconnected. A message is removed from the spool only once published """
+        self.Log(self.LOG_INFO, f"Sending spooled readings: {self.spool.GetStats()}")
+
+        while True:
+            with self.spoolLock:
+                # Closed when the client is released:
+                if self.spool is None:
+                    return
+                record = self.spool.Peek()
+                if record is None:
+                    # Empty: new messages go to the queue again
+                    break
+
+            if not self.connected or not self.Publish(record.topic, record.payload, record.retain):
+                time.sleep(PUBLISH_RETRY_SECONDS)
+                return
+
+            with self.spoolLock:
+                if self.spool is None:
+                    return
+                self.spool.Pop(record)
+            time.sleep(1 / SPOOL_REPLAY_RATE)
+
+        self.Log(self.LOG_INFO, "Spooled readings sent")
+
+    def GetOutboundQueueStats(self) -> dict:
+        """ Return depth, coalesced and dropped messages of the outbound queue """
+        return self.outboundQueue.GetStats()
+
+    def AddConnectCallback(self, callback) -> None:
+        """ Call the callback, without arguments, every time the connection is established """
+        self.connectCallbacks.append(callback)
 
     def LwtSet(self, topic, payload) -> None:
-        # Sets Lwt message data
+        """ Set the will message. A connection has only one, the first one set is kept:
+            GetSharedClient doesn't share a client between different wills.
+            If the client is already connected, it reconnects to use it """
+        if self.lwt is not None:
+            if (topic, payload) != self.lwt:
+                self.Log(self.LOG_WARNING,
+                         f"Only one will message per connection, {topic} ignored: {self.lwt[0]} is used")
+            return
+
+        self.lwt = (topic, payload)
         self.client.will_set(topic, payload=payload, retain=False)
 
+        if self.started:
+            self.Log(self.LOG_INFO, "Reconnecting to set the will message")
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.Connect()
+
     # INCOMING MESSAGES PART / SUBSCRIBE
 
     def AddNewTopicToSubscribeTo(self, topic, callbackFunction) -> TopicCallback:
+        """ Call the callback for the messages of the topic. The topic is subscribed unless a wildcard subscription covers it """
         topicCallback = TopicCallback(topic, callbackFunction)
-        self.topicCallbacks.append(topicCallback)
+        with self.subscriptionsLock:
+            self.topicCallbacks.append(topicCallback)
+            self.topicRouter.Add(topic, topicCallback)
+            if self.IsCoveredByWildcard(topic):
+                topicCallback.SetAsSubscribed()
         if self.connected:
-            topicCallback.SubscribeTopic(self.client)
-        return TopicCallback
+            self.SubscribeToAllTopics()
+        return topicCallback
+
+    def AddWildcardSubscription(self, topic) -> None:
+        """ Subscribe once to a wildcard topic (e.g. "IoTuring/client/#") instead of to each callback topic it covers.
+            The client receives every message of the wildcard and dispatches them to the callbacks """
+        with self.subscriptionsLock:
+            self.wildcardSubscriptions[topic] = False
+            # Topics already subscribed on their own, to unsubscribe once the wildcard is:
+            covered = [topicCallback.topic for topicCallback in self.topicCallbacks
+                       if TopicMatches(topic, topicCallback.topic) and topicCallback.GetSubscriptionState()]
+
+        self.SubscribeToAllTopics()
+        for coveredTopic in dict.fromkeys(covered):
+            self.client.unsubscribe(coveredTopic)
+
+    def SetAllAsNotSubscribed(self) -> None:
+        with self.subscriptionsLock:
+            for topicCallback in self.topicCallbacks:
+                topicCallback.SetAsNotSubscribed()
+            for wildcard in self.wildcardSubscriptions:
+                self.wildcardSubscriptions[wildcard] = False
+
+    def IsCoveredByWildcard(self, topic) -> bool:
+        return any(TopicMatches(wildcard, topic) for wildcard in self.wildcardSubscriptions)
 
     def SubscribeToAllTopics(self) -> None:
-        """ Subscribe all TopicCallback using the MQTT client, if client is connected """
-        if self.connected:
+        """ Subscribe the wildcard topics and the TopicCallbacks not subscribed yet, in a single request, if client is connected """
+        if not self.connected:
+            return
+
+        with self.subscriptionsLock:
+            topics = [wildcard for wildcard, subscribed in self.wildcardSubscriptions.items()
+                      if not subscribed]
+            for wildcard in topics:
+                self.wildcardSubscriptions[wildcard] = True
+
             for topicCallback in self.topicCallbacks:
-                topicCallback.SubscribeTopic(self.client)
+                if self.IsCoveredByWildcard(topicCallback.topic):
+                    topicCallback.SetAsSubscribed()
+                elif not topicCallback.GetSubscriptionState():
+                    topics.append(topicCallback.topic)
+                    topicCallback.SetAsSubscribed()
+
+            # Each topic once, in order:
+            topics = list(dict.fromkeys(topics))
+            if topics:
+                self.client.subscribe([(topic, 0) for topic in topics])  # TODO QoS settings
 
     def UnsubscribeFromTopic(self, topic) -> None:
         try:
-            topicCallback = self.GetTopicCallback(topic)
-            topicCallback.UnsubscribeTopic(self.client)
-            self.topicCallbacks.remove(topicCallback)
+            with self.subscriptionsLock:
+                topicCallbacks = self.topicRouter.Remove(topic)
+                if not topicCallbacks:
+                    raise Exception("Can't find any TopicCallback for " + topic)
+                for topicCallback in topicCallbacks:
+                    self.topicCallbacks.remove(topicCallback)
+                if not self.IsCoveredByWildcard(topic):
+                    self.client.unsubscribe(topic)
         except Exception as e:
             self.Log(self.LOG_ERROR, "Error in topic unsubscription: " + str(e))
 
@@ -128,9 +505,10 @@ class MQTTClient(LogObject):
         return self.topicCallbacks.copy()
 
     def GetTopicCallback(self, topic) -> TopicCallback:
-        for topicCallback in self.topicCallbacks:
-            if topicCallback.CompareTopic(topic):
-                return topicCallback
+        """ The first TopicCallback matching the topic """
+        topicCallbacks = self.topicRouter.Match(topic)
+        if topicCallbacks:
+            return topicCallbacks[0]
         raise Exception("Can't find any matching TopicCallback for " + topic)
 
     # LOG
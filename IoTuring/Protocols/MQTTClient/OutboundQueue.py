@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import time
+from threading import Condition
+
+
+class OutboundMessage():
+    """ A message waiting to be published """
+
+    __slots__ = ("topic", "payload", "retain", "time")
+
+    def __init__(self, topic: str, payload, retain: bool) -> None:
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+        # When it was queued, to measure the publish latency:
+        self.time = time.monotonic()
+
+
+class OutboundQueue():
+    """ Bounded queue of messages to publish, with one message per topic: a new message replaces
+        the queued one of the same topic (last value wins) and keeps its position.
+        If the queue is full, the oldest message is dropped. """
+
+    def __init__(self, max_size: int) -> None:
+        self.maxSize = max(1, int(max_size))
+        self.condition = Condition()
+        self.messages: dict[str, OutboundMessage] = {}
+
+        # Messages replaced by a newer one of the same topic:
+        self.coalesced = 0
+        # Messages dropped because the queue was full:
+        self.dropped = 0
+
+    def Put(self, message: OutboundMessage) -> None:
+        """ Queue the message, replacing the one with the same topic """
+        with self.condition:
+            if message.topic in self.messages:
+                self.coalesced += 1
+            elif len(self.messages) >= self.maxSize:
+                del self.messages[next(iter(self.messages))]
+                self.dropped += 1
+
+            self.messages[message.topic] = message
+            self.condition.notify()
+
+    def PutBack(self, messages: list[OutboundMessage]) -> None:
+        """ Queue again messages that couldn't be sent, before the others. Topics with a newer message are skipped """
+        with self.condition:
+            pending = self.messages
+            self.messages = {m.topic: m for m in messages
+                             if m.topic not in pending}
+            self.messages.update(pending)
+
+            while len(self.messages) > self.maxSize:
+                del self.messages[next(iter(self.messages))]
+                self.dropped += 1
+
+    def GetAll(self, timeout: float | None = None) -> list[OutboundMessage]:
+        """ Return all the queued messages in order and empty the queue. If empty, wait for messages at most timeout seconds """
+        with self.condition:
+            if not self.messages:
+                self.condition.wait(timeout)
+
+            messages = list(self.messages.values())
+            self.messages.clear()
+            return messages
+
+    def Wake(self) -> None:
+        """ Make a waiting GetAll return, even if the queue is empty """
+        with self.condition:
+            self.condition.notify_all()
+
+    def GetDepth(self) -> int:
+        """ Number of queued messages """
+        return len(self.messages)
+
+    def GetStats(self) -> dict:
+        return {
+            "depth": self.GetDepth(),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import random
+
+
+class ReconnectBackoff():
+    """ Delays between reconnection attempts: exponential with full jitter, a random time between 0 and
+        base * 2 ^ attempt, up to cap. Clients disconnected together (e.g. by a broker restart) don't reconnect together """
+
+    def __init__(self, base: float, cap: float) -> None:
+        self.base = max(0, base)
+        self.cap = max(self.base, cap)
+        self.attempt = 0
+
+    def NextDelay(self) -> float:
+        """ Delay before the next attempt """
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        # Stop growing once the cap is reached:
+        if self.base * 2 ** self.attempt < self.cap:
+            self.attempt += 1
+        return delay
+
+    def Reset(self) -> None:
+        """ Connected: the next disconnection starts from the base delay """
+        self.attempt = 0
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from threading import Lock
+
+from IoTuring.Logger.LogObject import LogObject
+
+# Header: magic, version, read offset, write offset
+HEADER_FORMAT = "<4sIQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SPOOL_MAGIC = b"IOTS"
+SPOOL_VERSION = 1
+
+# Record: total length, timestamp, retain, topic length. Followed by topic and payload
+RECORD_FORMAT = "<IdBH"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Appended records are written to disk after this many records, or this many seconds since the last write:
+FLUSH_RECORDS = 100
+FLUSH_INTERVAL = 10
+
+
+class SpoolRecord():
+    """ A message read from the spool """
+
+    __slots__ = ("timestamp", "topic", "payload", "retain", "length")
+
+    def __init__(self, timestamp: float, topic: str, payload: bytes, retain: bool, length: int) -> None:
+        self.timestamp = timestamp
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+        # Size in the spool, to skip it once sent even if the spool was compacted meanwhile:
+        self.length = length
+
+
+class Spool(LogObject):
+    """ Durable store-and-forward buffer: an append-only segment file, memory-mapped, with a size and an age cap.
+        Records are read in order. When all are read, the segment is reset; when it's full, the read records
+        are compacted away and if there is still no space new records are dropped.
+        Data is in the page cache as soon as appended, so it survives a crash of the process, and it's written
+        to disk every FLUSH_RECORDS records or FLUSH_INTERVAL seconds, so a crash of the host loses only the last ones. """
+
+    def __init__(self, path: Path, max_size: int, max_age: float) -> None:
+        """
+        Args:
+            path (Path): The segment file, created if missing
+            max_size (int): Size of the file in bytes
+            max_age (float): Records older than this in seconds are skipped when read, 0 to keep them all
+        """
+        self.path = path
+        self.maxAge = max_age
+        self.lock = Lock()
+
+        # Records not stored because the spool was full, or skipped because too old:
+        self.dropped = 0
+        self.expired = 0
+
+        # Records appended since the spool was last written to disk:
+        self.unflushed = 0
+        self.lastFlush = time.monotonic()
+
+        self.Open(max(HEADER_SIZE + RECORD_HEADER_SIZE, int(max_size)))
+
+    def Open(self, size: int) -> None:
+        """ Map the file, keeping its records if it's a valid spool """
+        self.file = open(self.path, "a+b")
+        # Smaller files are extended; bigger ones keep their size, not to lose records:
+        self.file.truncate(max(size, os.path.getsize(self.path)))
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+
+        magic, version, self.readOffset, self.writeOffset = struct.unpack_from(
+            HEADER_FORMAT, self.mmap)
+
+        if magic != SPOOL_MAGIC or version != SPOOL_VERSION or \
+                not HEADER_SIZE <= self.readOffset <= self.writeOffset <= len(self.mmap):
+            self.readOffset = self.writeOffset = HEADER_SIZE
+            self.WriteHeader()
+        elif not self.IsEmpty():
+            self.Log(self.LOG_INFO,
+                     f"{self.writeOffset - self.readOffset} bytes of readings to send from {self.path}")
+
+    def WriteHeader(self) -> None:
+        struct.pack_into(HEADER_FORMAT, self.mmap, 0, SPOOL_MAGIC,
+                         SPOOL_VERSION, self.readOffset, self.writeOffset)
+
+    def Append(self, topic: str, payload, retain: bool = False, timestamp: float | None = None) -> bool:
+        """ Add a message at the end of the spool. Returns False if it was dropped because the spool is full """
+        topic_bytes = topic.encode()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif not isinstance(payload, (bytes, bytearray)):
+            payload = str(payload).encode()
+
+        length = RECORD_HEADER_SIZE + len(topic_bytes) + len(payload)
+
+        with self.lock:
+            if self.writeOffset + length > len(self.mmap):
+                self.Compact()
+                if self.writeOffset + length > len(self.mmap):
+                    if not self.dropped:
+                        self.Log(self.LOG_WARNING,
+                                 "Spool full, readings are dropped until the broker is back")
+                    self.dropped += 1
+                    return False
+
+            offset = self.writeOffset
+            struct.pack_into(RECORD_FORMAT, self.mmap, offset, length,
+                             timestamp or time.time(), bool(retain), len(topic_bytes))
+            offset += RECORD_HEADER_SIZE
+            self.mmap[offset:offset + len(topic_bytes)] = topic_bytes
+            offset += len(topic_bytes)
+            self.mmap[offset:offset + len(payload)] = payload
+
+            self.writeOffset += length
+            self.WriteHeader()
+
+            self.unflushed += 1
+            if self.unflushed >= FLUSH_RECORDS or time.monotonic() - self.lastFlush >= FLUSH_INTERVAL:
+                self.Flush()
+            return True
+
+    def Flush(self) -> None:
+        """ Write the changed pages to disk. Called with the lock held """
+        self.mmap.flush()
+        self.unflushed = 0
+        self.lastFlush = time.monotonic()
+
+    def Compact(self) -> None:
+        """ Move the records not read yet to the start of the segment. Called with the lock held """
+        if self.readOffset == HEADER_SIZE:
+            return
+        unread = self.writeOffset - self.readOffset
+        self.mmap.move(HEADER_SIZE, self.readOffset, unread)
+        self.readOffset = HEADER_SIZE
+        self.writeOffset = HEADER_SIZE + unread
+        self.WriteHeader()
+
+    def Peek(self) -> SpoolRecord | None:
+        """ Return the oldest record not too old, without removing it. None if the spool is empty """
+        with self.lock:
+            while self.readOffset < self.writeOffset:
+                offset = self.readOffset
+                length, timestamp, retain, topic_length = struct.unpack_from(
+                    RECORD_FORMAT, self.mmap, offset)
+                offset += RECORD_HEADER_SIZE
+                nextOffset = self.readOffset + length
+
+                if self.maxAge and time.time() - timestamp > self.maxAge:
+                    self.expired += 1
+                    self.Advance(nextOffset)
+                    continue
+
+                topic = self.mmap[offset:offset + topic_length].decode()
+                payload = self.mmap[offset + topic_length:nextOffset]
+                return SpoolRecord(timestamp, topic, payload, bool(retain), length)
+            return None
+
+    def Pop(self, record: SpoolRecord) -> None:
+        """ Remove a record returned by Peek, after it has been sent """
+        with self.lock:
+            self.Advance(self.readOffset + record.length)
+
+    def Advance(self, offset: int) -> None:
+        """ Move the read offset, and reset the segment when everything is read. Called with the lock held """
+        self.readOffset = offset
+        if self.readOffset >= self.writeOffset:
+            self.readOffset = self.writeOffset = HEADER_SIZE
+        self.WriteHeader()
+
+    def IsEmpty(self) -> bool:
+        return self.readOffset >= self.writeOffset
+
+    def GetStats(self) -> dict:
+        return {
+            "bytes": self.writeOffset - self.readOffset,
+            "dropped": self.dropped,
+            "expired": self.expired
+        }
+
+    def Close(self) -> None:
+        """ Write the spool to disk and close the file """
+        with self.lock:
+            self.Flush()
+            self.mmap.close()
+            self.file.close()
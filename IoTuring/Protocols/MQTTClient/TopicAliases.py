@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from threading import Lock
+
+# Bytes of the topic alias property in a publish: identifier and 2 bytes value
+ALIAS_PROPERTY_SIZE = 3
+
+
+class TopicAliases():
+    """ MQTT v5 topic aliases of a connection: a topic published again gets a number, and from then on
+        it's published with the number only. Aliases are valid until the connection is closed """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        # Maximum set by the broker for this connection, 0 if aliases can't be used:
+        self.maximum = 0
+        self.aliases: dict[str, int] = {}
+        # Topics published once in this connection, aliased when published again:
+        self.seenTopics: set[str] = set()
+
+        # Publishes with the alias only, and the bytes not sent thanks to them:
+        self.aliased = 0
+        self.bytesSaved = 0
+
+    def Reset(self, maximum: int = 0) -> None:
+        """ Forget the aliases, for a new connection that accepts this many of them """
+        with self.lock:
+            self.maximum = maximum
+            self.aliases.clear()
+            self.seenTopics.clear()
+
+    def Get(self, topic: str) -> tuple[str, int | None]:
+        """ Return the topic to publish and its alias, if any. The topic is empty if the broker already knows the alias """
+        with self.lock:
+            if topic in self.aliases:
+                self.aliased += 1
+                self.bytesSaved += len(topic.encode()) - ALIAS_PROPERTY_SIZE
+                return "", self.aliases[topic]
+
+            if topic in self.seenTopics and len(self.aliases) < self.maximum:
+                # Sent with both topic and alias, to tell the broker the alias:
+                self.aliases[topic] = len(self.aliases) + 1
+                self.seenTopics.discard(topic)
+                self.bytesSaved -= ALIAS_PROPERTY_SIZE
+                return topic, self.aliases[topic]
+
+            if self.maximum:
+                self.seenTopics.add(topic)
+            return topic, None
+
+    def GetStats(self) -> dict:
+        return {
+            "aliases": len(self.aliases),
+            "aliased": self.aliased,
+            "bytes_saved": self.bytesSaved
+        }
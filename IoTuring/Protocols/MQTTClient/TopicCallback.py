@@ -1,4 +1,5 @@
 from IoTuring.Logger.LogObject import LogObject
+from IoTuring.Protocols.MQTTClient.TopicTrie import TopicMatches
 
 import paho.mqtt.client as mqtt
 
@@ -16,8 +17,8 @@ class TopicCallback(LogObject):
         self.imSubscribed = False
 
     def CompareTopic(self, wantedTopic):
-        """ Return true if the passed topic equals to my topic """
-        return self.topic == wantedTopic  # TODO Wildcard check maybe
+        """ Return true if the passed topic matches my topic, which can contain wildcards """
+        return TopicMatches(self.topic, wantedTopic)
 
     def Call_Callback(self, message):
         """ Call callback, need also the topic because may be used a wildcard in self.topic, so I want the complete topic ALWAYS """
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+TOPIC_SEPARATOR = "/"
+WILDCARD_SINGLE_LEVEL = "+"
+WILDCARD_MULTI_LEVEL = "#"
+# Topics starting with this are not matched by wildcards in the first level:
+SYSTEM_TOPIC_PREFIX = "$"
+
+
+class TopicTrieNode():
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        self.children: dict[str, TopicTrieNode] = {}
+        self.values: list = []
+
+
+class TopicTrie():
+    """ Values stored by MQTT topic filter, with the filters matching a topic found level by level:
+        the cost of a match depends on the depth of the topic and not on the number of filters """
+
+    def __init__(self) -> None:
+        self.root = TopicTrieNode()
+        self.size = 0
+
+    def Add(self, topic_filter: str, value) -> None:
+        """ Store a value for the topic filter, which can contain + and # wildcards """
+        node = self.root
+        for level in topic_filter.split(TOPIC_SEPARATOR):
+            node = node.children.setdefault(level, TopicTrieNode())
+        node.values.append(value)
+        self.size += 1
+
+    def Remove(self, topic_filter: str, value=None) -> list:
+        """ Remove a value of the topic filter, or all its values if value is None. Returns the removed values """
+        path = [self.root]
+        levels = topic_filter.split(TOPIC_SEPARATOR)
+        for level in levels:
+            if level not in path[-1].children:
+                return []
+            path.append(path[-1].children[level])
+
+        node = path[-1]
+        removed = [v for v in node.values if value is None or v is value]
+        node.values = [v for v in node.values if value is not None and v is not value]
+        self.size -= len(removed)
+
+        # Prune the empty branch:
+        for level, parent in zip(reversed(levels), reversed(path[:-1])):
+            child = parent.children[level]
+            if child.values or child.children:
+                break
+            del parent.children[level]
+
+        return removed
+
+    def Match(self, topic: str) -> list:
+        """ Values of all the filters matching the topic """
+        levels = topic.split(TOPIC_SEPARATOR)
+        matches = []
+        self.MatchLevel(self.root, levels, 0, matches,
+                        topic.startswith(SYSTEM_TOPIC_PREFIX))
+        return matches
+
+    def MatchLevel(self, node: TopicTrieNode, levels: list[str], index: int, matches: list, system: bool = False) -> None:
+        # "a/#" matches "a" too:
+        if not system and WILDCARD_MULTI_LEVEL in node.children:
+            matches.extend(node.children[WILDCARD_MULTI_LEVEL].values)
+
+        if index == len(levels):
+            matches.extend(node.values)
+            return
+
+        if levels[index] in node.children:
+            self.MatchLevel(node.children[levels[index]], levels, index + 1, matches)
+        if not system and WILDCARD_SINGLE_LEVEL in node.children:
+            self.MatchLevel(node.children[WILDCARD_SINGLE_LEVEL], levels, index + 1, matches)
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def TopicMatches(topic_filter: str, topic: str) -> bool:
+    """ True if the topic matches the filter, which can contain + and # wildcards. Compared level by level, without a trie """
+    # Wildcards in the first level don't match system topics:
+    if topic.startswith(SYSTEM_TOPIC_PREFIX) and topic_filter[:1] in [WILDCARD_SINGLE_LEVEL, WILDCARD_MULTI_LEVEL]:
+        return False
+
+    filter_levels = topic_filter.split(TOPIC_SEPARATOR)
+    topic_levels = topic.split(TOPIC_SEPARATOR)
+    for index, level in enumerate(filter_levels):
+        # "a/#" matches "a" too, # is valid only as the last level:
+        if level == WILDCARD_MULTI_LEVEL:
+            return index == len(filter_levels) - 1
+        if index == len(topic_levels):
+            return False
+        if level != WILDCARD_SINGLE_LEVEL and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
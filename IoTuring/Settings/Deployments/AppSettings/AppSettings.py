@@ -1,10 +1,41 @@
+from __future__ import annotations
+
 from IoTuring.Configurator.MenuPreset import MenuPreset
 from IoTuring.Settings.Settings import Settings
 
 
 CONFIG_KEY_UPDATE_INTERVAL = "update_interval"
 CONFIG_KEY_RETRY_INTERVAL = "retry_interval"
-# CONFIG_KEY_SLOW_INTERVAL = "slow_interval"
+CONFIG_KEY_RETRY_MAX_INTERVAL = "retry_max_interval"
+CONFIG_KEY_UPDATE_WORKERS = "update_workers"
+CONFIG_KEY_UPDATE_PHASE = "update_phase"
+CONFIG_KEY_FAST_INTERVAL = "fast_interval"
+CONFIG_KEY_SLOW_INTERVAL = "slow_interval"
+CONFIG_KEY_INIT_TIMEOUT = "init_timeout"
+CONFIG_KEY_UPDATE_DEADLINE = "update_deadline"
+CONFIG_KEY_COMMAND_DEADLINE = "command_deadline"
+CONFIG_KEY_COMMAND_WORKERS = "command_workers"
+
+# Named update intervals, entities can use these instead of a number of seconds:
+UPDATE_TIER_FAST = "fast"
+UPDATE_TIER_NORMAL = "normal"
+UPDATE_TIER_SLOW = "slow"
+
+UPDATE_TIER_KEYS = {
+    UPDATE_TIER_FAST: CONFIG_KEY_FAST_INTERVAL,
+    UPDATE_TIER_NORMAL: CONFIG_KEY_UPDATE_INTERVAL,
+    UPDATE_TIER_SLOW: CONFIG_KEY_SLOW_INTERVAL
+}
+
+UPDATE_PHASE_ALIGNED = "aligned"
+UPDATE_PHASE_STAGGERED = "staggered"
+
+UPDATE_PHASE_CHOICES = [
+    {"name": "Aligned: update all entities together, for a coherent snapshot",
+     "value": UPDATE_PHASE_ALIGNED},
+    {"name": "Staggered: spread the updates across the interval, to flatten the load",
+     "value": UPDATE_PHASE_STAGGERED}
+]
 
 
 class AppSettings(Settings):
@@ -16,17 +47,81 @@ class AppSettings(Settings):
         preset = MenuPreset()
 
         preset.AddEntry(name="Main update interval in seconds",
+                        instruction=f"Interval of the '{UPDATE_TIER_NORMAL}' tier",
                         key=CONFIG_KEY_UPDATE_INTERVAL, mandatory=True,
                         question_type="integer", default=10)
 
+        preset.AddEntry(name="Fast update interval in seconds",
+                        instruction=f"Interval of the '{UPDATE_TIER_FAST}' tier",
+                        key=CONFIG_KEY_FAST_INTERVAL, mandatory=True,
+                        question_type="integer", default=2)
+
+        preset.AddEntry(name="Slow update interval in seconds",
+                        instruction=f"Interval of the '{UPDATE_TIER_SLOW}' tier",
+                        key=CONFIG_KEY_SLOW_INTERVAL, mandatory=True,
+                        question_type="integer", default=600)
+
         preset.AddEntry(name="Connection retry interval in seconds",
-                        instruction="If broker is not available retry after this amount of time passed",
+                        instruction="If broker is not available retry after a random time up to this, doubled at every failed attempt",
                         key=CONFIG_KEY_RETRY_INTERVAL, mandatory=True,
                         question_type="integer", default=1)
 
+        preset.AddEntry(name="Maximum connection retry interval in seconds",
+                        instruction="The retry interval doesn't grow over this",
+                        key=CONFIG_KEY_RETRY_MAX_INTERVAL, mandatory=True,
+                        question_type="integer", default=120)
+
+        preset.AddEntry(name="Number of threads for entity updates",
+                        instruction="Entities are updated by this many threads in parallel",
+                        key=CONFIG_KEY_UPDATE_WORKERS, mandatory=True,
+                        question_type="integer", default=4)
+
+        preset.AddEntry(name="Number of threads for entity commands",
+                        instruction="Commands of different entities run in parallel on this many threads, commands of the same entity one at a time",
+                        key=CONFIG_KEY_COMMAND_WORKERS, mandatory=True,
+                        question_type="integer", default=2)
 
-        # preset.AddEntry(name="Secondary update interval in minutes",
-        #                 key=CONFIG_KEY_SLOW_INTERVAL, mandatory=True,
-        #                 question_type="integer", default=10)
+        preset.AddEntry(name="Entity initialization timeout in seconds",
+                        instruction="Entities that take longer than this to initialize are unloaded",
+                        key=CONFIG_KEY_INIT_TIMEOUT, mandatory=True,
+                        question_type="integer", default=30)
+
+        preset.AddEntry(name="Entity update deadline in seconds",
+                        instruction="Commands run by an entity update are killed after this time, 0 to disable",
+                        key=CONFIG_KEY_UPDATE_DEADLINE, mandatory=True,
+                        question_type="integer", default=30)
+
+        preset.AddEntry(name="Entity command deadline in seconds",
+                        instruction="Commands run by an entity command callback are killed after this time, 0 to disable: callbacks can start long running commands",
+                        key=CONFIG_KEY_COMMAND_DEADLINE, mandatory=True,
+                        question_type="integer", default=0)
+
+        preset.AddEntry(name="Update phase of entities",
+                        key=CONFIG_KEY_UPDATE_PHASE, mandatory=True,
+                        question_type="select", default=UPDATE_PHASE_ALIGNED,
+                        choices=UPDATE_PHASE_CHOICES)
 
         return preset
+
+    @classmethod
+    def GetUpdateInterval(cls, interval: str | int) -> int:
+        """Get the update interval in seconds
+
+        Args:
+            interval (str | int): A tier name (fast, normal, slow) or a number of seconds
+
+        Raises:
+            ValueError: If interval is not a tier or a positive number
+
+        Returns:
+            int: The interval in seconds
+        """
+        interval = str(interval).strip().lower()
+
+        if interval in UPDATE_TIER_KEYS:
+            return int(cls.GetFromSettingsConfigurations(UPDATE_TIER_KEYS[interval]))
+        elif interval.isdigit() and int(interval) > 0:
+            return int(interval)
+        else:
+            raise ValueError(
+                f"Invalid update interval: {interval}. Use {', '.join(UPDATE_TIER_KEYS)} or a number of seconds")
@@ -1,17 +1,19 @@
 from IoTuring.Logger.Logger import Logger
 from IoTuring.Warehouse.Warehouse import Warehouse
-from IoTuring.Entity.ValueFormat import ValueFormatter
-from IoTuring.Entity.EntityData import EntitySensor
+from IoTuring.Entity.EntitySnapshot import SensorSnapshot
 
 class ConsoleWarehouse(Warehouse):
     NAME = "Console"
 
     def Loop(self):
         for entity in self.GetEntities():
-            for entitySensor in entity.GetEntitySensors():
-                if(entitySensor.HasValue()):
-                    self.Log(self.LOG_INFO, entitySensor.GetId() +
-                             ": " + self.FormatValue(entitySensor))
+            for sensorSnapshot in entity.GetSnapshot().GetSensors():
+                if(sensorSnapshot.HasValue()):
+                    self.Log(self.LOG_INFO, sensorSnapshot.GetId() +
+                             ": " + self.FormatValue(sensorSnapshot))
+            if entity.HasUpdate():
+                self.Log(self.LOG_DEBUG, entity.GetEntityId() +
+                         " update stats: " + str(entity.GetUpdateStats()))
 
-    def FormatValue(self, entitySensor: EntitySensor):
-        return ValueFormatter.FormatValue(entitySensor.GetValue(), entitySensor.GetValueFormatterOptions(), True)
\ No newline at end of file
+    def FormatValue(self, sensorSnapshot: SensorSnapshot):
+        return sensorSnapshot.GetFormattedValue(True)
\ No newline at end of file
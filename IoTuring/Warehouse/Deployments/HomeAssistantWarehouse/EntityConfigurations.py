@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import copy
+import os
+import re
+import yaml
+from threading import Lock
+
+from IoTuring.Configurator.ConfiguratorIO import ConfiguratorIO
+from IoTuring.Logger.LogObject import LogObject
+from IoTuring.Logger.Logger import Singleton
+
+# Entity configuration file for HAWH, next to the warehouse and, with the user overrides, in the configuration folder:
+EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME = "entities.yaml"
+
+
+class EntityConfigurations(LogObject, metaclass=Singleton):
+    """ Custom configurations of the entity datas from entities.yaml, loaded once.
+        Keys are entity data names or regular expressions searched in the names. """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.loaded = False
+        # Configurations by exact name, and the compiled patterns in file order:
+        self.configurations: dict[str, dict] = {}
+        self.patterns: list[tuple[re.Pattern, dict]] = []
+        # Configuration found for each name already looked for:
+        self.cache: dict[str, dict] = {}
+
+    def Get(self, entityDataName: str) -> dict:
+        """ Configuration of the entity data: the one of its name, or the first one whose pattern is found in the name.
+            A copy, so the caller can change it """
+        with self.lock:
+            if not self.loaded:
+                self.Load()
+
+            if entityDataName not in self.cache:
+                self.cache[entityDataName] = self.Find(entityDataName)
+            return copy.deepcopy(self.cache[entityDataName])
+
+    def Find(self, entityDataName: str) -> dict:
+        # Try exact match:
+        if entityDataName in self.configurations:
+            return self.configurations[entityDataName]
+        # No exact match, try regex:
+        for pattern, configuration in self.patterns:
+            if pattern.search(entityDataName):
+                return configuration
+        return {}  # if nothing found
+
+    def Load(self) -> None:
+        """ Read the file of the warehouse and merge the one of the user in the configuration folder:
+            its entries extend or replace the default ones, and its patterns are tried first """
+        data = self.ReadFile(os.path.join(os.path.dirname(os.path.abspath(
+            __file__)), EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME))
+
+        userPath = ConfiguratorIO().getFolderPath().joinpath(
+            EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME)
+        if userPath.exists():
+            self.Log(self.LOG_INFO, f"Loading custom entity configurations from {userPath}")
+            userData = self.ReadFile(userPath)
+            merged = {key: {**data.get(key, {}), **configuration}
+                      for key, configuration in userData.items()}
+            data = {**merged, **{key: configuration for key, configuration in data.items()
+                                 if key not in merged}}
+
+        self.configurations = data
+        self.patterns = []
+        for key, configuration in data.items():
+            try:
+                self.patterns.append((re.compile(key), configuration))
+            except re.error as e:
+                self.Log(self.LOG_WARNING,
+                         f"Invalid pattern {key} in {EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME}, used only as name: {e}")
+        self.cache = {}
+        self.loaded = True
+
+    def ReadFile(self, path) -> dict:
+        """ Entries of a configuration file, with string keys """
+        try:
+            with open(path) as yaml_data:
+                data = yaml.safe_load(yaml_data.read()) or {}
+        except (OSError, yaml.YAMLError) as e:
+            self.Log(self.LOG_ERROR, f"Can't read {path}: {e}")
+            return {}
+        return {str(key): configuration or {} for key, configuration in data.items()}
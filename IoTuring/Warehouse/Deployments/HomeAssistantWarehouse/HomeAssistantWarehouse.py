@@ -1,21 +1,25 @@
 from __future__ import annotations
-import os
 import json
-import yaml
-import re
-import time
+import hashlib
+import random
+from threading import Timer
 from typing import Callable
 
 from IoTuring.Configurator.MenuPreset import MenuPreset
+from IoTuring.Configurator.ConfiguratorIO import ConfiguratorIO
+from IoTuring.Entity.Entity import Entity
 from IoTuring.Entity.EntityData import EntityCommand, EntityData, EntitySensor
+from IoTuring.Entity.EntitySnapshot import SensorSnapshot
 from IoTuring.Logger.LogObject import LogObject
 from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
 from IoTuring.Warehouse.Warehouse import Warehouse
 from IoTuring.MyApp.App import App
 from IoTuring.Logger import consts
 from IoTuring.Entity.ValueFormat import ValueFormatter
-
-from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings, CONFIG_KEY_UPDATE_INTERVAL
+from IoTuring.Entity.PublishPolicy import PublishPolicy, PublishFilter, PUBLISH_POLICY_KEYS
+from IoTuring.Entity.CommandExecutor import CONFIG_KEY_COMMAND_DEBOUNCE
+from IoTuring.Warehouse.Deployments.HomeAssistantWarehouse.EntityConfigurations import EntityConfigurations, \
+    EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME
 
 
 INCLUDE_UNITS_IN_SENSORS = False
@@ -25,9 +29,16 @@ INCLUDE_UNITS_IN_EXTRA_ATTRIBUTES = True
 # That stands for: App name, Client name, EntityData Id
 TOPIC_DATA_FORMAT = "{}/{}HomeAssistant/{}"
 TOPIC_DATA_EXTRA_ATTRIBUTES_SUFFIX = "_extraattributes"
+# Topic of the JSON state of an entity, after the entity id:
+TOPIC_DATA_ENTITY_STATE_SUFFIX = "_state"
+# JSON state: keys of the values and of the extra attributes of the sensors, by sensor key
+JSON_STATE_KEY_VALUES = "state"
+JSON_STATE_KEY_EXTRA_ATTRIBUTES = "attributes"
 # That stands for: Entity data type, App name, EntityData Id
 # to send configuration data
 TOPIC_AUTODISCOVERY_FORMAT = "homeassistant/{}/{}/{}/config"
+# That stands for: App name, Client name. Device based discovery, all the entities of the client in one message:
+TOPIC_DEVICE_AUTODISCOVERY_FORMAT = "homeassistant/device/{}_{}/config"
 
 CONFIG_KEY_ADDRESS = "address"
 CONFIG_KEY_PORT = "port"
@@ -36,8 +47,28 @@ CONFIG_KEY_USERNAME = "username"
 CONFIG_KEY_PASSWORD = "password"
 CONFIG_KEY_ADD_NAME_TO_ENTITY = "add_name"
 CONFIG_KEY_USE_TAG_AS_ENTITY_NAME = "use_tag"
-
-CONFIGURATION_SEND_LOOP_SKIP_NUMBER = 10
+CONFIG_KEY_BIRTH_TOPIC = "birth_topic"
+CONFIG_KEY_DEVICE_DISCOVERY = "device_discovery"
+CONFIG_KEY_JSON_STATE = "json_state"
+CONFIG_KEY_WILDCARD_SUBSCRIPTION = "wildcard_subscription"
+CONFIG_KEY_SPOOL = "spool"
+CONFIG_KEY_SPOOL_SIZE = "spool_size"
+CONFIG_KEY_SPOOL_MAX_AGE = "spool_max_age"
+CONFIG_KEY_MQTT_V5 = "mqtt_v5"
+CONFIG_KEY_MESSAGE_EXPIRY = "message_expiry"
+
+# Discovery topics and device components sent by a client, in the configuration folder, to remove the old ones at the next start:
+DISCOVERY_RECORD_FILENAME = "discovery_{}.json"
+
+# Spool size is configured in MB, max age in hours:
+SPOOL_SIZE_UNIT = 1024 * 1024
+SPOOL_MAX_AGE_UNIT = 60 * 60
+
+# Home Assistant publishes "online" here when it starts, then discovery and states are sent again:
+DEFAULT_BIRTH_TOPIC = "homeassistant/status"
+BIRTH_PAYLOAD_ONLINE = "online"
+# The resend starts after a random delay up to this, not to have all the clients publishing together:
+BIRTH_JITTER_SECONDS = 5
 
 
 LWT_TOPIC_SUFFIX = "LWT"
@@ -46,8 +77,6 @@ LWT_PAYLOAD_OFFLINE = "OFFLINE"
 PAYLOAD_ON = consts.STATE_ON
 PAYLOAD_OFF = consts.STATE_OFF
 
-# Entity configuration file for HAWH:
-EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME = "entities.yaml"
 # Set HA entity type, e.g. number, light, switch:
 ENTITY_CONFIG_CUSTOM_TYPE_KEY = "custom_type"
 # Custom topic keys for discovery. Use list for multiple topics:
@@ -83,18 +112,17 @@ class HomeAssistantEntityBase(LogObject):
         # Get data type:
         self.data_type = self.discovery_payload.pop(ENTITY_CONFIG_CUSTOM_TYPE_KEY, "")
 
+        # Publish policy keys, not part of the discovery payload:
+        self.publish_policy_config = {key: self.discovery_payload.pop(key)
+                                      for key in PUBLISH_POLICY_KEYS if key in self.discovery_payload}
+        # Commands debounce window, not part of the discovery payload either:
+        self.command_debounce = self.discovery_payload.pop(CONFIG_KEY_COMMAND_DEBOUNCE, None)
+
         # Set name:
         self.SetDiscoveryPayloadName()
 
         # Set device info:
-        device_info = {}
-        device_info['name'] = self.wh.clientName
-        device_info['model'] = self.wh.clientName
-        device_info['identifiers'] = self.wh.clientName
-        device_info['manufacturer'] = App.getName() + " by " + App.getVendor()
-        device_info['sw_version'] = App.getVersion()
-
-        self.discovery_payload['device'] = device_info
+        self.discovery_payload['device'] = self.wh.MakeDeviceInfo()
         self.discovery_payload['unique_id'] = self.unique_id
 
     def SetDefaultDataType(self, data_type: str) -> None:
@@ -138,35 +166,21 @@ class HomeAssistantEntityBase(LogObject):
             self.discovery_payload[discovery_key] = topic_path
 
 
-    def SendTopicData(self, topic, data) -> None:
-        self.wh.client.SendTopicData(topic, data)
+    def SendTopicData(self, topic, data, retain: bool = False) -> None:
+        self.wh.client.SendTopicData(topic, data, retain)
 
     def SetDiscoveryTopic(self) -> None:
         """ Set the discovery topic attribute"""
         self.discovery_topic = self.wh.NormalizeTopic(TOPIC_AUTODISCOVERY_FORMAT.format(
-            self.data_type, App.getName(), self.unique_id.replace(".", "_")))
+            self.data_type, App.getName(), self.GetComponentId()))
 
-    def GetEntityDataCustomConfigurations(self, entityDataName) -> dict:
-        """ Add custom info to the entity data, reading it from external file and accessing the information using the entity data name """
+    def GetComponentId(self) -> str:
+        """ Id of the entity in its discovery topic, or in the components of the device based discovery """
+        return self.unique_id.replace(".", "_")
 
-        # if resource_file:
-        config_path = os.path.join(os.path.dirname(os.path.abspath(
-            __file__)), EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME)
-        with open(config_path) as yaml_data:
-
-            data = yaml.safe_load(yaml_data.read())
-
-            # Try exact match:
-            try:
-                return data[entityDataName]
-            except KeyError:
-                # No exact match, try regex:
-                for entityData, entityDataConfiguration in data.items():
-                    # entityData may be the correct name, or a regex expression that should return something applied to the real name
-                    if re.search(entityData, entityDataName):
-                        # merge payload and additional configurations
-                        return entityDataConfiguration
-        return {}  # if nothing found
+    def GetEntityDataCustomConfigurations(self, entityDataName) -> dict:
+        """ Add custom info to the entity data, from the external file (loaded once) using the entity data name """
+        return EntityConfigurations().Get(entityDataName)
 
 
 class HomeAssistantEntity(HomeAssistantEntityBase):
@@ -237,52 +251,168 @@ class HomeAssistantSensor(HomeAssistantEntity):
 
         self.entitySensor = entityData
         self.supports_extra_attributes = self.entitySensor.DoesSupportExtraAttributes()
+        # Formatter of the callback values, the ones of the sensor are formatted by their snapshot:
+        self.formatValue = ValueFormatter.GetFormatter(
+            self.entitySensor.GetValueFormatterOptions(), INCLUDE_UNITS_IN_SENSORS)
 
         # Default data type:
         self.SetDefaultDataType("sensor")
 
-        # State topic for all sensors
-        self.AddTopic("state_topic")
+        if self.wh.jsonState:
+            # Values and extra attributes in the JSON state of the entity:
+            self.entityState = self.wh.GetEntityState(self.entity)
+            self.entityState.AddSensor(self)
+            key = json.dumps(self.entitySensor.GetKey())
+
+            self.AddTopic("state_topic", self.entityState.topic)
+            self.discovery_payload["value_template"] = \
+                f"{{{{ value_json[{json.dumps(JSON_STATE_KEY_VALUES)}][{key}] }}}}"
 
-        if self.supports_extra_attributes:
-            self.AddTopic("json_attributes_topic")
+            if self.supports_extra_attributes:
+                self.AddTopic("json_attributes_topic", self.entityState.topic)
+                self.discovery_payload["json_attributes_template"] = \
+                    f"{{{{ value_json[{json.dumps(JSON_STATE_KEY_EXTRA_ATTRIBUTES)}].get({key}, {{}}) | tojson }}}}"
+
+        else:
+            # State topic for all sensors
+            self.AddTopic("state_topic")
 
-        # Make sure expire_after is greater than the loop timeout:
-        loop_timeout = int(AppSettings.GetFromSettingsConfigurations(
-            CONFIG_KEY_UPDATE_INTERVAL))
-        sensor_expire_seconds = 600 if loop_timeout < 600 else int(
-            loop_timeout * 1.5)
+            if self.supports_extra_attributes:
+                self.AddTopic("json_attributes_topic")
+
+        # Make sure expire_after is greater than the update interval of this sensor and the loop timeout:
+        sensor_interval = max(self.entity.GetUpdateTimeout(), self.wh.loopTimeout)
+        sensor_expire_seconds = 600 if sensor_interval < 600 else int(
+            sensor_interval * 1.5)
         self.discovery_payload['expire_after'] = sensor_expire_seconds
 
-    def SendValues(self, callback_value:str|None= None):
-        """ Send values of the sensor to the state topic
+        # Publish policy of the entity, overridden by entities.yaml:
+        try:
+            publish_policy = PublishPolicy.FromDict(
+                self.publish_policy_config, base=self.entity.GetPublishPolicy())
+        except ValueError as e:
+            self.Log(self.LOG_ERROR, f"Invalid publish policy in {EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME}: {e}")
+            publish_policy = self.entity.GetPublishPolicy()
+
+        self.state_filter = PublishFilter(publish_policy)
+        self.extra_attributes_filter = PublishFilter(publish_policy.WithoutDeadband())
+
+    def GetSnapshot(self) -> SensorSnapshot:
+        """ The last committed state of the entity sensor """
+        return self.entity.GetSnapshot().GetSensorByKey(self.entitySensor.GetKey())
+
+    def SendValues(self, sensorSnapshot: SensorSnapshot | None = None, callback_value:str|None= None, force: bool = False):
+        """ Send values of the sensor to the state topic, if the publish policy allows it
+            sensorSnapshot: the state to send, the last committed one if None
             callback_value: overrides value from sensor, for callback
+            force: send even if the value didn't change
         """
+        sensorSnapshot = sensorSnapshot or self.GetSnapshot()
+
+        if self.wh.jsonState:
+            self.entityState.SendValues({self: sensorSnapshot},
+                                        {} if callback_value is None else {self: callback_value}, force)
+            return
 
-        if self.entitySensor.HasValue():
+        if sensorSnapshot.HasValue():
             if callback_value is None:
-                value = self.entitySensor.GetValue()
+                value = sensorSnapshot.GetValue()
+                sensor_value = sensorSnapshot.GetFormattedValue(INCLUDE_UNITS_IN_SENSORS)
             else:
                 value = callback_value
+                sensor_value = self.formatValue(value)
+                force = True
 
-            sensor_value = ValueFormatter.FormatValue(
-                value,
-                self.entitySensor.GetValueFormatterOptions(),
-                INCLUDE_UNITS_IN_SENSORS)
-
-            self.SendTopicData(self.state_topic, sensor_value)
+            if self.state_filter.ShouldPublish(value, sensor_value, force):
+                self.SendTopicData(self.state_topic, sensor_value)
+            else:
+                self.wh.SendLater(sensorSnapshot, self.state_filter)
 
             if callback_value is None:
-                self.SendExtraAttributes()
+                self.SendExtraAttributes(sensorSnapshot, force)
+
+    def SendExtraAttributes(self, sensorSnapshot: SensorSnapshot | None = None, force: bool = False):
+        sensorSnapshot = sensorSnapshot or self.GetSnapshot()
+
+        if self.wh.jsonState:
+            self.entityState.SendValues({self: sensorSnapshot}, force=force)
+            return
 
-    def SendExtraAttributes(self):
         if self.supports_extra_attributes and \
-                self.entitySensor.HasExtraAttributes():
-            formattedExtraAttributes = self.entitySensor.GetFormattedExtraAtributes(
-                INCLUDE_UNITS_IN_EXTRA_ATTRIBUTES)
-            self.SendTopicData(
-                self.json_attributes_topic,
-                json.dumps(formattedExtraAttributes))
+                sensorSnapshot.HasExtraAttributes():
+            formattedExtraAttributes = json.dumps(
+                self.FormatExtraAttributes(sensorSnapshot))
+            if self.extra_attributes_filter.ShouldPublish(formattedExtraAttributes, formattedExtraAttributes, force):
+                self.SendTopicData(
+                    self.json_attributes_topic,
+                    formattedExtraAttributes)
+            else:
+                self.wh.SendLater(sensorSnapshot, self.extra_attributes_filter)
+
+    @staticmethod
+    def FormatExtraAttributes(sensorSnapshot: SensorSnapshot) -> dict:
+        return sensorSnapshot.GetFormattedExtraAtributes(INCLUDE_UNITS_IN_EXTRA_ATTRIBUTES)
+
+
+class HomeAssistantEntityState():
+    """ Values and extra attributes of all the sensors of an entity, published together in a single JSON message """
+
+    def __init__(self, entity: Entity, wh: "HomeAssistantWarehouse") -> None:
+        self.wh = wh
+        self.topic = self.wh.MakeValuesTopic(
+            entity.GetEntityId() + TOPIC_DATA_ENTITY_STATE_SUFFIX)
+        self.sensors: list[HomeAssistantSensor] = []
+
+    def AddSensor(self, hasssensor: HomeAssistantSensor) -> None:
+        self.sensors.append(hasssensor)
+
+    def SendValues(self, sensorSnapshots: dict[HomeAssistantSensor, SensorSnapshot] | None = None,
+                   callbackValues: dict[HomeAssistantSensor, str] | None = None, force: bool = False) -> None:
+        """ Send the state if the publish policy of any of its sensors allows it
+            sensorSnapshots: the states to send, the last committed one for the other sensors
+            callbackValues: override the values of these sensors, for callbacks
+            force: send even if nothing changed
+        """
+        sensorSnapshots = sensorSnapshots or {}
+        callbackValues = callbackValues or {}
+        values, extraAttributes = {}, {}
+        shouldPublish = False
+        # Filters checked with their sensor, to send later the changes they held back:
+        checkedFilters = []
+
+        for hasssensor in self.sensors:
+            sensorSnapshot = sensorSnapshots.get(hasssensor) or hasssensor.GetSnapshot()
+            if not sensorSnapshot.HasValue():
+                continue
+            key = hasssensor.entitySensor.GetKey()
+
+            if hasssensor in callbackValues:
+                value = callbackValues[hasssensor]
+                values[key] = hasssensor.formatValue(value)
+            else:
+                value = sensorSnapshot.GetValue()
+                values[key] = sensorSnapshot.GetFormattedValue(INCLUDE_UNITS_IN_SENSORS)
+            # Every filter is checked, to keep track of what they published:
+            shouldPublish = hasssensor.state_filter.ShouldPublish(
+                value, values[key], force or hasssensor in callbackValues) or shouldPublish
+            checkedFilters.append((sensorSnapshot, hasssensor.state_filter))
+
+            if hasssensor.supports_extra_attributes and sensorSnapshot.HasExtraAttributes():
+                extraAttributes[key] = hasssensor.FormatExtraAttributes(sensorSnapshot)
+                formattedExtraAttributes = json.dumps(extraAttributes[key])
+                shouldPublish = hasssensor.extra_attributes_filter.ShouldPublish(
+                    formattedExtraAttributes, formattedExtraAttributes, force) or shouldPublish
+                checkedFilters.append((sensorSnapshot, hasssensor.extra_attributes_filter))
+
+        if shouldPublish:
+            self.wh.client.SendTopicData(self.topic, json.dumps({
+                JSON_STATE_KEY_VALUES: values,
+                JSON_STATE_KEY_EXTRA_ATTRIBUTES: extraAttributes
+            }))
+        else:
+            # Held back changes are sent with the state, or when their filter allows it:
+            for sensorSnapshot, publishFilter in checkedFilters:
+                self.wh.SendLater(sensorSnapshot, publishFilter)
 
 
 class HomeAssistantCommand(HomeAssistantEntity):
@@ -316,19 +446,30 @@ class HomeAssistantCommand(HomeAssistantEntity):
 
 
     def GenerateCommandCallback(self) -> Callable:
-        """ Generate the callback function """
+        """ Generate the callback function, that runs the command on the command executor """
+        # Debounce window from entities.yaml, or the one of the entity:
+        debounce = None
+        if self.command_debounce is not None:
+            try:
+                debounce = float(self.command_debounce)
+            except ValueError:
+                self.Log(self.LOG_ERROR, f"Invalid command debounce in {EXTERNAL_ENTITY_DATA_CONFIGURATION_FILE_FILENAME}")
+
         def CommandCallback(message):
+            self.entityCommand.SubmitCallback(message, RunCommand, debounce)
+
+        def RunCommand(message):
             status = self.entityCommand.CallCallback(message)
             if status and self.wh.client.IsConnected():
                 if self.connected_sensors:
                     # Only set value if it was already set, to exclude optimistic switches
                     for sensor in self.connected_sensors:
-                        if sensor.entitySensor.HasValue():
+                        if sensor.GetSnapshot().HasValue():
                             sensor.SendValues(callback_value = message.payload.decode('utf-8'))
 
                         # Optimistic switches with extra attributes:
                         elif sensor.supports_extra_attributes:
-                            sensor.SendExtraAttributes()
+                            sensor.SendExtraAttributes(force=True)
 
         return CommandCallback
 
@@ -349,26 +490,36 @@ class LwtSensor(HomeAssistantEntityBase):
 
         self.SetDiscoveryTopic()
 
-    def SendValues(self):
+    def SendValues(self, force: bool = False):
         self.SendTopicData(self.state_topic, LWT_PAYLOAD_ONLINE)
 
 
 class HomeAssistantWarehouse(Warehouse):
     NAME = "HomeAssistant"
+    USE_CHANGE_FEED = True
 
     def Start(self):
         #  I configure my Warehouse with configurations
         self.clientName = self.GetFromConfigurations(CONFIG_KEY_NAME)
-        self.client = MQTTClient(self.GetFromConfigurations(CONFIG_KEY_ADDRESS),
-                                 self.GetFromConfigurations(CONFIG_KEY_PORT),
-                                 self.GetFromConfigurations(CONFIG_KEY_NAME),
-                                 self.GetFromConfigurations(
-                                     CONFIG_KEY_USERNAME),
-                                 self.GetFromConfigurations(CONFIG_KEY_PASSWORD))
-        self.client.LwtSet(self.MakeValuesTopic(
-            LWT_TOPIC_SUFFIX), LWT_PAYLOAD_OFFLINE)
-
-        self.client.AsyncConnect()
+        # Warehouses connected to the same broker share the client:
+        self.client = MQTTClient.GetSharedClient(self.GetFromConfigurations(CONFIG_KEY_ADDRESS),
+                                                 self.GetFromConfigurations(CONFIG_KEY_PORT),
+                                                 self.GetFromConfigurations(CONFIG_KEY_NAME),
+                                                 self.GetFromConfigurations(
+                                                     CONFIG_KEY_USERNAME),
+                                                 self.GetFromConfigurations(
+                                                     CONFIG_KEY_PASSWORD),
+                                                 self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_MQTT_V5),
+                                                 will=(self.MakeValuesTopic(LWT_TOPIC_SUFFIX), LWT_PAYLOAD_OFFLINE))
+        self.client.SetReconnectBackoff(
+            self.retry_interval, self.retry_max_interval)
+        if self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_MQTT_V5):
+            self.client.SetMessageExpiry(
+                float(self.GetFromConfigurations(CONFIG_KEY_MESSAGE_EXPIRY)))
+
+        if self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_SPOOL):
+            self.client.EnableSpool(float(self.GetFromConfigurations(CONFIG_KEY_SPOOL_SIZE)) * SPOOL_SIZE_UNIT,
+                                    float(self.GetFromConfigurations(CONFIG_KEY_SPOOL_MAX_AGE)) * SPOOL_MAX_AGE_UNIT)
 
         self.addNameToEntityName = self.GetTrueOrFalseFromConfigurations(
             CONFIG_KEY_ADD_NAME_TO_ENTITY)
@@ -376,6 +527,14 @@ class HomeAssistantWarehouse(Warehouse):
         self.useTagAsEntityName = self.GetTrueOrFalseFromConfigurations(
             CONFIG_KEY_USE_TAG_AS_ENTITY_NAME)
 
+        self.deviceDiscovery = self.GetTrueOrFalseFromConfigurations(
+            CONFIG_KEY_DEVICE_DISCOVERY)
+
+        # JSON state of each entity, if all its sensors are published together:
+        self.jsonState = self.GetTrueOrFalseFromConfigurations(
+            CONFIG_KEY_JSON_STATE)
+        self.entityStates: dict[Entity, HomeAssistantEntityState] = {}
+
         # Entities store:
         self.homeAssistantEntities = {
             "commands": [],
@@ -383,14 +542,40 @@ class HomeAssistantWarehouse(Warehouse):
             "connected_sensors": []
         }
 
+        # HomeAssistantSensors of each EntitySensor, to send only the changed ones:
+        self.hassSensorsByEntitySensor: dict[EntitySensor, list[HomeAssistantSensor]] = {}
+
         self.CollectEntityData()
 
+        # Discovery payloads serialized once, by topic, with their hashes, and hashes of the ones sent:
+        self.discoveryMessages: dict[str, str] = {}
+        self.discoveryHashes: dict[str, str] = {}
+        self.sentDiscoveryHashes: dict[str, str] = {}
+        # Connection in which all the discovery was last delivered:
+        self.discoveryConnectionCount = 0
+        # Configurations sent by the last run and not configured anymore: topics to empty and,
+        # with device based discovery, components by id with their platform:
+        self.removedDiscoveryTopics: set[str] = set()
+        self.removedComponents: dict[str, str] = {}
+        self.PrepareEntityDataConfigurations()
+        self.discoveryRecordPath = ConfiguratorIO().getFolderPath().joinpath(
+            DISCOVERY_RECORD_FILENAME.format(self.clientName))
+        self.writtenDiscoveryRecord = self.ReadDiscoveryRecord()
+        self.FindRemovedDiscovery(self.writtenDiscoveryRecord)
+
         self.RegisterEntityCommands()
+        self.RegisterBirthMessage()
+        self.client.AddConnectCallback(self.OnConnect)
 
-        self.loopCounter = 0
+        # Connect when the callbacks are ready:
+        self.client.AsyncConnect()
 
         super().Start()  # Then run other inits (start the Loop method for example)
 
+    def Stop(self):
+        # The connection is closed when no warehouse uses it anymore:
+        self.client.Release()
+
     def CollectEntityData(self) -> None:
         """ Collect entities and save them as hass entities """
 
@@ -416,8 +601,22 @@ class HomeAssistantWarehouse(Warehouse):
                 else:
                     raise Exception(f"Unkown EntityData! {entityData}")
 
+        for hasssensor in self.homeAssistantEntities["sensors"] + self.homeAssistantEntities["connected_sensors"]:
+            if isinstance(hasssensor, HomeAssistantSensor):
+                self.hassSensorsByEntitySensor.setdefault(
+                    hasssensor.entitySensor, []).append(hasssensor)
+
+        # What to send for all the values, once each: with JSON states each entity, and the sensors that aren't in one
+        self.valuesSenders = tuple(
+            [hasssensor for hasssensor in self.homeAssistantEntities["sensors"] + self.homeAssistantEntities["connected_sensors"]
+             if not self.jsonState or not isinstance(hasssensor, HomeAssistantSensor)] +
+            list(self.entityStates.values()))
+
     def RegisterEntityCommands(self):
         """ Add EntityCommands to the MQTT client (subscribe to them) """
+        if self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_WILDCARD_SUBSCRIPTION):
+            self.client.AddWildcardSubscription(self.MakeValuesTopic("#"))
+
         for hasscommand in self.homeAssistantEntities["commands"]:
             self.client.AddNewTopicToSubscribeTo(
                 hasscommand.command_topic, hasscommand.command_callback)
@@ -425,29 +624,184 @@ class HomeAssistantWarehouse(Warehouse):
                 self.LOG_DEBUG, f"{hasscommand.id} subscribed to {hasscommand.command_topic}")
 
     def Loop(self):
+        # Data sent while disconnected waits in the client queue, only the last one of each topic.
+
+        # Discovery is sent only if changed, Home Assistant asks it again with its birth message:
+        self.SendEntityDataConfigurations()
+
+        self.SendAllValues()
+
+    def SendAllValues(self) -> None:
+        """ Send all sensor values, also unchanged ones, so they don't expire """
+        for valuesSender in self.valuesSenders:
+            valuesSender.SendValues(force=True)
+
+    def LoopChanges(self, changedSensors):
+        # Send only the values of the changed sensors:
+        changedStates: dict[HomeAssistantEntityState, dict] = {}
+        for sensorSnapshot in changedSensors:
+            for hasssensor in self.hassSensorsByEntitySensor.get(sensorSnapshot.GetEntitySensor(), []):
+                if self.jsonState:
+                    # Once per entity:
+                    changedStates.setdefault(hasssensor.entityState, {})[hasssensor] = sensorSnapshot
+                else:
+                    hasssensor.SendValues(sensorSnapshot)
+
+        for entityState, sensorSnapshots in changedStates.items():
+            entityState.SendValues(sensorSnapshots)
+
+    def GetEntityState(self, entity: Entity) -> HomeAssistantEntityState:
+        """ The JSON state of the entity, shared by its sensors """
+        if entity not in self.entityStates:
+            self.entityStates[entity] = HomeAssistantEntityState(entity, self)
+        return self.entityStates[entity]
+
+    def PrepareEntityDataConfigurations(self) -> None:
+        """ Serialize the discovery payloads and hash them, to send them as they are """
+        self.discoveryMessages = self.MakeDiscoveryMessages()
+        self.discoveryHashes = {topic: hashlib.sha1(payload.encode()).hexdigest()
+                                for topic, payload in self.discoveryMessages.items()}
+
+    def MakeDiscoveryMessages(self) -> dict[str, str]:
+        """ Discovery payloads by topic """
+        hassentities = self.homeAssistantEntities["commands"] + self.homeAssistantEntities["sensors"]
+
+        # Empty retained payloads remove the old configurations:
+        messages = {topic: "" for topic in self.removedDiscoveryTopics}
+
+        if not self.deviceDiscovery:
+            messages.update({hassentity.discovery_topic: json.dumps(hassentity.discovery_payload)
+                             for hassentity in hassentities})
+            return messages
+
+        # A single message with the device once and the entities as its components:
+        components = {component_id: {"platform": platform}
+                      for component_id, platform in self.removedComponents.items()}
+        for hassentity in hassentities:
+            payload = {key: value for key, value in hassentity.discovery_payload.items()
+                       if key != "device"}
+            payload["platform"] = hassentity.data_type
+            components[hassentity.GetComponentId()] = payload
+
+        messages[self.MakeDeviceDiscoveryTopic()] = json.dumps({
+                "device": self.MakeDeviceInfo(),
+                "origin": {
+                    "name": App.getName(),
+                    "sw_version": App.getVersion(),
+                    "support_url": App.getUrlHomepage()
+                },
+                "components": components
+            })
+        return messages
+
+    def MakeDeviceInfo(self) -> dict:
+        """ Home Assistant device of all the entities of this client """
+        return {
+            'name': self.clientName,
+            'model': self.clientName,
+            'identifiers': self.clientName,
+            'manufacturer': App.getName() + " by " + App.getVendor(),
+            'sw_version': App.getVersion()
+        }
 
-        while (not self.client.IsConnected()):
-            time.sleep(self.retry_interval)
-
-        # Mechanism to call the function to send discovery data every CONFIGURATION_SEND_LOOP_SKIP_NUMBER loop
-        if self.loopCounter == 0:
-            self.SendEntityDataConfigurations()
-
-        # Every time I send data, every X also configurations
-        self.loopCounter = (
-            self.loopCounter+1) % CONFIGURATION_SEND_LOOP_SKIP_NUMBER
-
-        # Send sensor values:
-        for hasssensor in self.homeAssistantEntities["sensors"] + self.homeAssistantEntities["connected_sensors"]:
-            hasssensor.SendValues()
-
-    def SendEntityDataConfigurations(self):
-        """ Send discovery """
-        for hassentity in self.homeAssistantEntities["commands"] + self.homeAssistantEntities["sensors"]:
-            topic = hassentity.discovery_topic
-            payload = hassentity.discovery_payload
-
-            self.client.SendTopicData(topic, json.dumps(payload))
+    def MakeDeviceDiscoveryTopic(self) -> str:
+        return self.NormalizeTopic(TOPIC_DEVICE_AUTODISCOVERY_FORMAT.format(App.getName(), self.clientName))
+
+    def SendEntityDataConfigurations(self, force: bool = False):
+        """ Send discovery, retained: only the payloads changed since they were last sent, or all if force """
+        if force or not self.sentDiscoveryHashes:
+            # If disconnected, it's queued for the next connection:
+            self.discoveryConnectionCount = self.client.GetConnectionCount() + \
+                (0 if self.client.IsConnected() else 1)
+
+        for topic, payload in self.discoveryMessages.items():
+            payloadHash = self.discoveryHashes[topic]
+            if force or self.sentDiscoveryHashes.get(topic) != payloadHash:
+                self.client.SendTopicData(topic, payload, retain=True)
+                self.sentDiscoveryHashes[topic] = payloadHash
+
+        # Recorded once delivered, for the next start:
+        if self.client.IsConnected():
+            self.WriteDiscoveryRecord(self.MakeDiscoveryRecord())
+
+    def MakeDiscoveryRecord(self) -> dict:
+        """ Discovery topics sent with a configuration and, with device based discovery, the components of the device """
+        record = {"topics": sorted(topic for topic, payload in self.discoveryMessages.items() if payload),
+                  "components": {}}
+        if self.deviceDiscovery:
+            record["components"] = {hassentity.GetComponentId(): hassentity.data_type for hassentity in
+                                    self.homeAssistantEntities["commands"] + self.homeAssistantEntities["sensors"]}
+        return record
+
+    def ReadDiscoveryRecord(self) -> dict:
+        """ The discovery record written by the last run, empty if there isn't one """
+        if not self.discoveryRecordPath.exists():
+            return {}
+        try:
+            with open(self.discoveryRecordPath) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.Log(self.LOG_WARNING, f"Can't read {self.discoveryRecordPath}: {e}")
+            return {}
+
+    def WriteDiscoveryRecord(self, record: dict) -> None:
+        """ Save the record, if it changed since it was last written """
+        if record == self.writtenDiscoveryRecord:
+            return
+        try:
+            ConfiguratorIO().createFolderPathIfDoesNotExist()
+            with open(self.discoveryRecordPath, "w") as f:
+                json.dump(record, f)
+            self.writtenDiscoveryRecord = record
+        except OSError as e:
+            self.Log(self.LOG_WARNING, f"Can't write {self.discoveryRecordPath}: {e}")
+
+    def FindRemovedDiscovery(self, record: dict) -> None:
+        """ Compare the configurations sent by the last run with the current ones: the old topics get an empty payload,
+            and the old components of the device only their platform, so Home Assistant removes them.
+            Also when switching between device based and per entity discovery """
+        self.removedDiscoveryTopics = set(record.get("topics", [])) - set(self.discoveryMessages)
+        if self.deviceDiscovery:
+            componentIds = self.MakeDiscoveryRecord()["components"]
+            self.removedComponents = {component_id: platform
+                                      for component_id, platform in record.get("components", {}).items()
+                                      if component_id not in componentIds}
+
+        if self.removedDiscoveryTopics or self.removedComponents:
+            self.Log(self.LOG_INFO, "Removing old entity configurations: " +
+                     ", ".join(sorted(self.removedDiscoveryTopics) + sorted(self.removedComponents)))
+            self.PrepareEntityDataConfigurations()
+
+    def OnConnect(self) -> None:
+        """ Send discovery again at every reconnection, the broker may have been restarted without its retained messages.
+            Not if it was already sent in this connection, or while connecting """
+        self.SendEntityDataConfigurations(
+            force=self.discoveryConnectionCount < self.client.GetConnectionCount())
+
+    def RegisterBirthMessage(self) -> None:
+        """ Subscribe to the status of Home Assistant, to send discovery and states when it starts """
+        self.birthTimer = None
+        self.client.AddNewTopicToSubscribeTo(
+            self.GetFromConfigurations(CONFIG_KEY_BIRTH_TOPIC), self.OnBirthMessage)
+
+    def OnBirthMessage(self, message) -> None:
+        """ Home Assistant is online: schedule discovery and states after a random delay, if not scheduled yet.
+            A retained status is ignored, discovery is sent at every connection anyway """
+        if message.retain or message.payload.decode().strip().lower() != BIRTH_PAYLOAD_ONLINE:
+            return
+        if self.birthTimer and self.birthTimer.is_alive():
+            return
+
+        delay = random.uniform(0, BIRTH_JITTER_SECONDS)
+        self.Log(self.LOG_INFO, f"Home Assistant is online, sending discovery in {delay:.1f}s")
+        self.birthTimer = Timer(delay, self.SendBirthBurst)
+        self.birthTimer.daemon = True
+        self.birthTimer.start()
+
+    def SendBirthBurst(self) -> None:
+        """ Send all the discovery configurations and then all the states """
+        self.SendEntityDataConfigurations(force=True)
+        self.SendAllValues()
 
     def MakeValuesTopic(self, topic_suffix: str) -> str:
         """ Prepares a topic, including the app name, the client name and finally a passed id """
@@ -473,4 +827,25 @@ class HomeAssistantWarehouse(Warehouse):
                         CONFIG_KEY_ADD_NAME_TO_ENTITY, default="Y", question_type="yesno")
         preset.AddEntry("Use tag as entity name for multi instance entities",
                         CONFIG_KEY_USE_TAG_AS_ENTITY_NAME, default="N", question_type="yesno")
+        preset.AddEntry("Send all the entities in a single discovery message", CONFIG_KEY_DEVICE_DISCOVERY,
+                        default="N", question_type="yesno",
+                        instruction="Device based discovery, needs Home Assistant 2024.11 or later. Otherwise one message per entity")
+        preset.AddEntry("Send the values of each entity in a single JSON message", CONFIG_KEY_JSON_STATE,
+                        default="N", question_type="yesno",
+                        instruction="Fewer messages for entities with many sensors, Home Assistant picks each value with a template")
+        preset.AddEntry("Home Assistant status topic", CONFIG_KEY_BIRTH_TOPIC, default=DEFAULT_BIRTH_TOPIC,
+                        instruction="Discovery and states are sent again when Home Assistant publishes 'online' here")
+        preset.AddEntry("Subscribe to all the commands with a single wildcard topic", CONFIG_KEY_WILDCARD_SUBSCRIPTION,
+                        default="N", question_type="yesno",
+                        instruction="Fewer subscriptions with many commands, but the client receives back also the sensor values it sends")
+        preset.AddEntry("Store readings on disk while the broker is offline", CONFIG_KEY_SPOOL,
+                        default="N", question_type="yesno")
+        preset.AddEntry("Maximum size of the stored readings, in MB", CONFIG_KEY_SPOOL_SIZE, default=10,
+                        question_type="integer", display_if_key_value={CONFIG_KEY_SPOOL: "Y"})
+        preset.AddEntry("Discard stored readings older than, in hours", CONFIG_KEY_SPOOL_MAX_AGE, default=24,
+                        question_type="integer", display_if_key_value={CONFIG_KEY_SPOOL: "Y"})
+        preset.AddEntry("Use MQTT v5", CONFIG_KEY_MQTT_V5, default="N", question_type="yesno",
+                        instruction="Shorter messages with topic aliases, and the broker keeps the subscriptions on reconnection. The broker must support it")
+        preset.AddEntry("Seconds after which the broker drops values not delivered yet, 0 to keep them", CONFIG_KEY_MESSAGE_EXPIRY,
+                        default=300, question_type="integer", display_if_key_value={CONFIG_KEY_MQTT_V5: "Y"})
         return preset
@@ -1,12 +1,17 @@
+from __future__ import annotations
+
 from IoTuring.Configurator.MenuPreset import MenuPreset
 from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
 from IoTuring.Warehouse.Warehouse import Warehouse
 from IoTuring.MyApp.App import App
-from IoTuring.Entity.ValueFormat import ValueFormatter
+from IoTuring.Entity.Entity import Entity
+from IoTuring.Entity.EntityData import EntitySensor
+from IoTuring.Entity.EntityManager import EntityManager
+from IoTuring.Entity.EntitySnapshot import SensorSnapshot
+from IoTuring.Entity.PublishPolicy import PublishFilter
 
 import inspect  # To get this folder path
 import os  # To get this folder path
-import time
 
 
 
@@ -20,47 +25,137 @@ CONFIG_KEY_NAME = "name"
 CONFIG_KEY_USERNAME = "username"
 CONFIG_KEY_PASSWORD = "password"
 CONFIG_KEY_ADD_UNITS = "add_units"
+CONFIG_KEY_WILDCARD_SUBSCRIPTION = "wildcard_subscription"
+CONFIG_KEY_SPOOL = "spool"
+CONFIG_KEY_SPOOL_SIZE = "spool_size"
+CONFIG_KEY_SPOOL_MAX_AGE = "spool_max_age"
+CONFIG_KEY_MQTT_V5 = "mqtt_v5"
+CONFIG_KEY_MESSAGE_EXPIRY = "message_expiry"
+
+# Spool size is configured in MB, max age in hours:
+SPOOL_SIZE_UNIT = 1024 * 1024
+SPOOL_MAX_AGE_UNIT = 60 * 60
+
+
+class PublishStep():
+    """ What is needed to publish a sensor, prepared once """
+
+    __slots__ = ("key", "topic", "publishFilter")
+
+    def __init__(self, key: str, topic: str, publishFilter: PublishFilter) -> None:
+        self.key = key
+        self.topic = topic
+        self.publishFilter = publishFilter
 
 
 class MQTTWarehouse(Warehouse):
     NAME = "MQTT"
+    USE_CHANGE_FEED = True
 
     def Start(self):
         # I configure my Warehouse with configurations
         self.clientName = self.GetFromConfigurations(CONFIG_KEY_NAME)
-        self.client = MQTTClient(self.GetFromConfigurations(CONFIG_KEY_ADDRESS),
-                                 self.GetFromConfigurations(CONFIG_KEY_PORT),
-                                 self.GetFromConfigurations(CONFIG_KEY_NAME),
-                                 self.GetFromConfigurations(
-                                     CONFIG_KEY_USERNAME),
-                                 self.GetFromConfigurations(CONFIG_KEY_PASSWORD))
+        # Warehouses connected to the same broker share the client:
+        self.client = MQTTClient.GetSharedClient(self.GetFromConfigurations(CONFIG_KEY_ADDRESS),
+                                                 self.GetFromConfigurations(CONFIG_KEY_PORT),
+                                                 self.GetFromConfigurations(CONFIG_KEY_NAME),
+                                                 self.GetFromConfigurations(
+                                                     CONFIG_KEY_USERNAME),
+                                                 self.GetFromConfigurations(
+                                                     CONFIG_KEY_PASSWORD),
+                                                 self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_MQTT_V5))
+        self.client.SetReconnectBackoff(
+            self.retry_interval, self.retry_max_interval)
+        if self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_MQTT_V5):
+            self.client.SetMessageExpiry(
+                float(self.GetFromConfigurations(CONFIG_KEY_MESSAGE_EXPIRY)))
         self.addUnitsToValues = self.GetFromConfigurations(CONFIG_KEY_ADD_UNITS) # is a boolean
+        if self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_SPOOL):
+            self.client.EnableSpool(float(self.GetFromConfigurations(CONFIG_KEY_SPOOL_SIZE)) * SPOOL_SIZE_UNIT,
+                                    float(self.GetFromConfigurations(CONFIG_KEY_SPOOL_MAX_AGE)) * SPOOL_MAX_AGE_UNIT)
         self.client.AsyncConnect()
         self.RegisterEntityCommands()
 
+        # Publish filter of each sensor, with the policy of its entity:
+        self.publishFilters: dict[EntitySensor, PublishFilter] = {}
+        # Sensors of each entity to publish, and the same steps by sensor, rebuilt when the entities change:
+        self.publishPlan: tuple[tuple[Entity, tuple[PublishStep, ...]], ...] = ()
+        self.publishSteps: dict[EntitySensor, PublishStep] = {}
+        self.publishPlanVersion = -1
+
         super().Start()  # Then run other inits (start the loop for example)
 
+    def Stop(self):
+        # The connection is closed when no warehouse uses it anymore:
+        self.client.Release()
+
     def RegisterEntityCommands(self):
         """ Add EntityCommands to the MQTT client (subscribe to them) """
+        if self.GetTrueOrFalseFromConfigurations(CONFIG_KEY_WILDCARD_SUBSCRIPTION):
+            self.client.AddWildcardSubscription(MQTTClient.NormalizeTopic(
+                TOPIC_FORMAT.format(App.getName(), self.clientName, "#")))
+
         for entity in self.GetEntities():
             for entityCommand in entity.GetEntityCommands():
                 self.client.AddNewTopicToSubscribeTo(
-                    self.MakeTopic(entityCommand), entityCommand.CallCallback)
+                    self.MakeTopic(entityCommand), entityCommand.SubmitCallback)
                 self.Log(self.LOG_DEBUG, entityCommand.GetId() +
                          " subscribed to " + self.MakeTopic(entityCommand))
         self.ExportCommandsTopics()
 
     def Loop(self):
-        while(not self.client.IsConnected()):
-            time.sleep(self.retry_interval)
-            
+        # Values sent while disconnected wait in the client queue, only the last one of each topic.
         # Here in Loop I send sensor's data (command callbacks are not managed here)
+        self.UpdatePublishPlan()
+        for entity, publishSteps in self.publishPlan:
+            entitySnapshot = entity.GetSnapshot()
+            for publishStep in publishSteps:
+                self.SendSensorValue(
+                    publishStep, entitySnapshot.GetSensorByKey(publishStep.key), force=True)
+
+    def LoopChanges(self, changedSensors):
+        self.UpdatePublishPlan()
+        for sensorSnapshot in changedSensors:
+            publishStep = self.publishSteps.get(sensorSnapshot.GetEntitySensor())
+            # Not if its entity has been unloaded:
+            if publishStep:
+                self.SendSensorValue(publishStep, sensorSnapshot)
+
+    def SendSensorValue(self, publishStep: PublishStep, sensorSnapshot: SensorSnapshot, force: bool = False):
+        """ Send the formatted value of the sensor, if it has one and the publish policy of its entity allows it """
+        if sensorSnapshot.HasValue():
+            value = sensorSnapshot.GetFormattedValue(self.addUnitsToValues)
+            if publishStep.publishFilter.ShouldPublish(sensorSnapshot.GetValue(), value, force):
+                self.client.SendTopicData(publishStep.topic, value)
+            else:
+                self.SendLater(sensorSnapshot, publishStep.publishFilter)
+
+    def UpdatePublishPlan(self) -> None:
+        """ Prepare topic and publish filter of each sensor, if the entities changed since the last time """
+        version = EntityManager().GetEntitiesVersion()
+        if version == self.publishPlanVersion:
+            return
+
+        publishPlan = []
+        publishSteps = {}
         for entity in self.GetEntities():
-            for entitySensor in entity.GetEntitySensors():
-                if(entitySensor.HasValue()):
-                    value = ValueFormatter.FormatValue(entitySensor.GetValue(), entitySensor.GetValueFormatterOptions(), self.addUnitsToValues)
-                    self.client.SendTopicData(self.MakeTopic(
-                        entitySensor), value)
+            entityPublishSteps = []
+            for sensorSnapshot in entity.GetSnapshot().GetSensors():
+                entitySensor = sensorSnapshot.GetEntitySensor()
+                # Filters are kept, to remember what was published:
+                if entitySensor not in self.publishFilters:
+                    self.publishFilters[entitySensor] = PublishFilter(
+                        entity.GetPublishPolicy())
+
+                publishStep = PublishStep(entitySensor.GetKey(), self.MakeTopic(entitySensor),
+                                          self.publishFilters[entitySensor])
+                entityPublishSteps.append(publishStep)
+                publishSteps[entitySensor] = publishStep
+            publishPlan.append((entity, tuple(entityPublishSteps)))
+
+        self.publishPlan = tuple(publishPlan)
+        self.publishSteps = publishSteps
+        self.publishPlanVersion = version
 
     def MakeTopic(self, entityData):
         return MQTTClient.NormalizeTopic(TOPIC_FORMAT.format(App.getName(), self.clientName, entityData.GetId()))
@@ -85,4 +180,17 @@ class MQTTWarehouse(Warehouse):
         preset.AddEntry("Username", CONFIG_KEY_USERNAME)
         preset.AddEntry("Password", CONFIG_KEY_PASSWORD, question_type="secret")
         preset.AddEntry("Add units to values", CONFIG_KEY_ADD_UNITS, default="Y", question_type="yesno")
+        preset.AddEntry("Subscribe to all the commands with a single wildcard topic", CONFIG_KEY_WILDCARD_SUBSCRIPTION,
+                        default="N", question_type="yesno",
+                        instruction="Fewer subscriptions with many commands, but the client receives back also the sensor values it sends")
+        preset.AddEntry("Store readings on disk while the broker is offline", CONFIG_KEY_SPOOL,
+                        default="N", question_type="yesno")
+        preset.AddEntry("Maximum size of the stored readings, in MB", CONFIG_KEY_SPOOL_SIZE, default=10,
+                        question_type="integer", display_if_key_value={CONFIG_KEY_SPOOL: "Y"})
+        preset.AddEntry("Discard stored readings older than, in hours", CONFIG_KEY_SPOOL_MAX_AGE, default=24,
+                        question_type="integer", display_if_key_value={CONFIG_KEY_SPOOL: "Y"})
+        preset.AddEntry("Use MQTT v5", CONFIG_KEY_MQTT_V5, default="N", question_type="yesno",
+                        instruction="Shorter messages with topic aliases, and the broker keeps the subscriptions on reconnection. The broker must support it")
+        preset.AddEntry("Seconds after which the broker drops values not delivered yet, 0 to keep them", CONFIG_KEY_MESSAGE_EXPIRY,
+                        default=300, question_type="integer", display_if_key_value={CONFIG_KEY_MQTT_V5: "Y"})
         return preset
@@ -1,7 +1,10 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 if TYPE_CHECKING:
+    from IoTuring.Metrics.MetricsRegistry import DurationMetric
     from IoTuring.Entity.Entity import Entity
+    from IoTuring.Entity.EntitySnapshot import SensorSnapshot
+    from IoTuring.Entity.PublishPolicy import PublishFilter
     from IoTuring.Configurator.Configuration import SingleConfiguration
 
 from threading import Thread
@@ -10,12 +13,23 @@ import time
 from IoTuring.Logger.LogObject import LogObject
 from IoTuring.Configurator.ConfiguratorObject import ConfiguratorObject
 from IoTuring.Entity.EntityManager import EntityManager
+from IoTuring.Entity.EntityScheduler import GetNextDueTime
+from IoTuring.Entity.ChangeQueue import ChangeQueue
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_LOOP, METRIC_LOOP_CHANGES
 
-from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings, CONFIG_KEY_UPDATE_INTERVAL, CONFIG_KEY_RETRY_INTERVAL
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings, CONFIG_KEY_UPDATE_INTERVAL, CONFIG_KEY_RETRY_INTERVAL, \
+    CONFIG_KEY_RETRY_MAX_INTERVAL
+
+# Minimum time between 2 full loops of warehouses that use the change feed:
+CHANGE_FEED_LOOP_TIMEOUT = 300
 
 
 class Warehouse(ConfiguratorObject, LogObject):
 
+    # If True, changed sensors are sent to LoopChanges() as soon as they change,
+    # and Loop() is only a periodic full refresh
+    USE_CHANGE_FEED = False
+
     def __init__(self, single_configuration: SingleConfiguration) -> None:
         super().__init__(single_configuration)
 
@@ -23,28 +37,82 @@ class Warehouse(ConfiguratorObject, LogObject):
             AppSettings.GetFromSettingsConfigurations(CONFIG_KEY_UPDATE_INTERVAL))
         self.retry_interval = int(AppSettings
                                   .GetFromSettingsConfigurations(CONFIG_KEY_RETRY_INTERVAL))
+        self.retry_max_interval = int(AppSettings
+                                      .GetFromSettingsConfigurations(CONFIG_KEY_RETRY_MAX_INTERVAL))
+
+        self.changeQueue = None
+        if self.USE_CHANGE_FEED:
+            self.loopTimeout = max(self.loopTimeout, CHANGE_FEED_LOOP_TIMEOUT)
 
     def Start(self) -> None:
         """ Initial configuration and start the thread that will loop the Warehouse.Loop() function"""
+        if self.USE_CHANGE_FEED:
+            self.changeQueue = ChangeQueue()
+            EntityManager().AddChangeQueue(self.changeQueue)
+
         thread = Thread(target=self.LoopThread)
         thread.daemon = True
         thread.start()
 
+    def Stop(self) -> None:
+        """ Called when the app exits: close what the warehouse opened. Nothing to do by default """
+        pass
+
     def SetLoopTimeout(self, timeout) -> None:
         """ Set a timeout between 2 loops """
         self.loopTimeout = timeout
 
     def ShouldCallLoop(self) -> bool:
-        """ Wait the timeout time and then tell it can run the Loop function """
-        time.sleep(self.loopTimeout)
+        """ Wait until the next loop is due and then tell it can run the Loop function.
+            Loops are fixed-rate: the duration of the Loop doesn't delay the next one.
+            With the change feed, changed sensors are passed to LoopChanges() while waiting """
+        next_loop_time = GetNextDueTime(
+            self.loopStartTime, self.loopTimeout, time.monotonic())
+
+        if self.changeQueue:
+            while (time.monotonic() < next_loop_time):
+                changedSensors = self.changeQueue.Get(
+                    timeout=next_loop_time - time.monotonic())
+                if changedSensors:
+                    self.CallTimed(self.loopChangesMetric,
+                                   self.LoopChanges, changedSensors)
+        else:
+            time.sleep(max(0, next_loop_time - time.monotonic()))
+
         return True
 
     def LoopThread(self) -> None:
         """ Entry point of the warehouse thread, will run Loop() periodically """
-        self.Loop()  # First call without sleep before
+        self.loopStartTime = time.monotonic()
+
+        registry = MetricsRegistry()
+        self.loopMetric = registry.GetMetric(
+            registry.MakeName(METRIC_LOOP, self.GetWarehouseId()))
+        self.loopChangesMetric = registry.GetMetric(
+            registry.MakeName(METRIC_LOOP_CHANGES, self.GetWarehouseId()))
+
+        self.CallTimed(self.loopMetric, self.Loop)  # First call without sleep before
         while (True):
             if self.ShouldCallLoop():
-                self.Loop()
+                self.CallTimed(self.loopMetric, self.Loop)
+
+    @staticmethod
+    def CallTimed(metric: DurationMetric, function: Callable, *args) -> None:
+        """ Call the function and record its duration, and if it raised, in the metric """
+        start_time = time.monotonic()
+        error = True
+        try:
+            function(*args)
+            error = False
+        finally:
+            metric.Record(time.monotonic() - start_time, error)
+
+    def SendLater(self, sensorSnapshot: SensorSnapshot, publishFilter: PublishFilter) -> None:
+        """ If the filter held back a change of the sensor, pass the sensor to LoopChanges() again when it can be published,
+            so the last value of a burst is not lost until the next full loop """
+        pendingTime = publishFilter.GetPendingTime()
+        if pendingTime is not None and self.changeQueue:
+            self.changeQueue.PutLater(sensorSnapshot, pendingTime)
 
     def GetEntities(self) -> list[Entity]:
         return EntityManager().GetEntities()
@@ -55,6 +123,11 @@ class Warehouse(ConfiguratorObject, LogObject):
         raise NotImplementedError(
             "Please implement Loop method for this Warehouse")
 
+    def LoopChanges(self, changedSensors: list[SensorSnapshot]) -> None:
+        """ Must be implemented in subclasses with USE_CHANGE_FEED, called with the snapshots of the sensors changed since the last call """
+        raise NotImplementedError(
+            "Please implement LoopChanges method for this Warehouse")
+
     def GetWarehouseName(self) -> str:
         return self.NAME
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import atexit
 import signal
 import sys
 import time
@@ -104,6 +105,8 @@ def loop():
     # Prepare warehouses -  # after entities, so entitites have already told to which EntityCommand I need to subscribe !
     for warehouse in warehouses:
         warehouse.Start()
+        # Close its connections when the app exits:
+        atexit.register(warehouse.Stop)
 
     logger.Log(Logger.LOG_DEBUG, "Main", "Main finished its work ;)")
 
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+
+from IoTuring.ClassManager.consts import KEY_ENTITY
+from IoTuring.Configurator.Configuration import FullConfiguration
+from IoTuring.Configurator.ConfiguratorLoader import ConfiguratorLoader
+from IoTuring.Entity.Deployments.SelfDiagnostics.SelfDiagnostics import SelfDiagnostics
+from IoTuring.Settings.SettingsManager import SettingsManager
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings
+
+
+class TestSelfDiagnostics:
+    def testLoadSavedConfiguration(self):
+        SettingsManager().AddSettings(
+            [AppSettings(AppSettings.GetDefaultConfigurations(), early_init=False)])
+
+        # Saved like the configurator does, then read back:
+        config = FullConfiguration(None)
+        config.AddConfiguration(KEY_ENTITY, SelfDiagnostics.NAME, {})
+        config = FullConfiguration(config.ToDict())
+
+        entities = ConfiguratorLoader(SimpleNamespace(config=config)).LoadEntities()
+        # The blank configuration has AppInfo too:
+        assert [entity.GetEntityId() for entity in entities] == ["Entity.AppInfo", "Entity.SelfDiagnostics"]
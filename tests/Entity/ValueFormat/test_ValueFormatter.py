@@ -0,0 +1,173 @@
+import math
+import os
+import time
+
+import pytest
+
+from IoTuring.Entity.EntitySnapshot import SensorSnapshot
+from IoTuring.Entity.ValueFormat import ValueFormatter, ValueFormatterOptions
+from IoTuring.Entity.ValueFormat.ValueFormatter import BYTE_SIZES, SPACE_BEFORE_UNIT, TYPE_COMPILERS
+
+VALUES_NUMBER = 20000
+WAREHOUSES_NUMBER = 3
+
+# Benchmarks measure wall-clock time, they run only if this is set:
+BENCHMARK_ENV = "IOTURING_BENCHMARK"
+
+
+class OldValueFormatter():
+    """ The formatter before it was compiled: the type of the options is checked at every value.
+        Only the branches of TYPE_NONE and TYPE_BYTE are copied, the ones used here """
+
+    @staticmethod
+    def FormatValue(value, options, includeUnit: bool):
+        return str(OldValueFormatter._ParseValue(value, options, includeUnit))
+
+    @staticmethod
+    def _ParseValue(value, options, includeUnit: bool):
+        if options is None:
+            return value
+        valueType = options.get_value_type()
+
+        # specific type formatting
+        if valueType == ValueFormatterOptions.TYPE_NONE:  # edit needed only if decimals
+            return OldValueFormatter.roundValue(value, options)
+        elif valueType == ValueFormatterOptions.TYPE_BYTE:
+            return OldValueFormatter.ByteFormatter(value, options, includeUnit)
+        else:
+            return str(value)
+
+    @staticmethod
+    def ByteFormatter(value, options, includeUnit: bool):
+        # Get value in bytes
+        asked_size = options.get_adjust_size()
+        decimals = options.get_decimals()
+
+        if asked_size and asked_size in BYTE_SIZES:
+            powOf1024 = BYTE_SIZES.index(asked_size)
+        # If value == 0 math.log failes, so simply send 0:
+        elif float(value) == 0:
+            powOf1024 = 0
+        else:
+            powOf1024 = math.floor(math.log(value, 1024))
+
+        value = value/(math.pow(1024, powOf1024))
+
+        value = OldValueFormatter.roundValue(value, options)
+
+        result = str(value)
+
+        if includeUnit:
+            result = result + SPACE_BEFORE_UNIT + BYTE_SIZES[powOf1024]
+
+        return result
+
+    @staticmethod
+    def roundValue(value, options):
+        if options.get_decimals() != ValueFormatterOptions.DO_NOT_TOUCH_DECIMALS:
+            return round(value, options.get_decimals())
+        return value
+
+
+class FakeSensor:
+    """ What a SensorSnapshot reads from its EntitySensor """
+
+    def __init__(self, value, options) -> None:
+        self.value = value
+        self.options = options
+
+    def HasValue(self):
+        return True
+
+    def HasExtraAttributes(self):
+        return False
+
+    def GetValueFormatterOptions(self):
+        return self.options
+
+
+class TestValueFormatter:
+    def testFormat(self):
+        cases = [
+            (ValueFormatterOptions(), 1.2345, True, "1.2345"),
+            (ValueFormatterOptions(decimals=2), 1.2345, True, "1.23"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_PERCENTAGE, 1), 12.345, True, "12.345 %"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE), 0, True, "0.0 B"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE, 2), 1536, True, "1.5 KB"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE, 0, "MB"), 1536, False, "0.0"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_TIME, 1, "h"), 5400, True, "1.5 h"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_TIME), 90, True, "90 s"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_FREQUENCY, 1, "GHz"), 2400000000, True, "2.4 GHz"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_TEMPERATURE, 0), 41.6, True, "42.0 °C"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_BIT_PER_SECOND, 0, "Mbps"), 54000000, True, "54.0 Mbps"),
+            (ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE_PER_SECOND, 1, "KBps"), 2500, False, "2.5"),
+        ]
+        for options, value, includeUnit, expected in cases:
+            assert ValueFormatter.FormatValue(value, options, includeUnit) == expected
+        assert ValueFormatter.FormatValue("text", None, True) == "text"
+
+    def testCompiledOnce(self):
+        options = ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE, 1)
+        formatter = ValueFormatter.GetFormatter(options, True)
+        assert ValueFormatter.GetFormatter(options, True) is formatter
+        assert ValueFormatter.GetFormatter(options, False) is not formatter
+
+        # Changed options are compiled again:
+        options.set_adjust_size("KB")
+        assert ValueFormatter.FormatValue(1048576, options, True) == "1024.0 KB"
+
+    def testFormattedOncePerSnapshot(self, monkeypatch):
+        options = ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE, 2, "MB")
+        compiled, calls = [], []
+
+        def CompileFormatter(options, includeUnit):
+            compiled.append(includeUnit)
+            formatter = TYPE_COMPILERS[options.get_value_type()](options, includeUnit)
+
+            def CountingFormatter(value):
+                calls.append((value, includeUnit))
+                return formatter(value)
+            return CountingFormatter
+
+        monkeypatch.setattr(ValueFormatter, "CompileFormatter", staticmethod(CompileFormatter))
+
+        snapshots = [SensorSnapshot(FakeSensor(value, options), 1, 0) for value in [1048576, 2097152]]
+        for _ in range(WAREHOUSES_NUMBER):
+            for snapshot in snapshots:
+                assert snapshot.GetFormattedValue(True).endswith(" MB")
+                snapshot.GetFormattedValue(False)
+
+        # Compiled once for each includeUnit, called once for each snapshot and includeUnit:
+        assert compiled == [True, False]
+        assert sorted(calls) == [(1048576, False), (1048576, True), (2097152, False), (2097152, True)]
+
+    @pytest.mark.skipif(not os.environ.get(BENCHMARK_ENV), reason=f"set {BENCHMARK_ENV} to run benchmarks")
+    def testBenchmark(self):
+        options = ValueFormatterOptions(ValueFormatterOptions.TYPE_BYTE, 2, "MB")
+        values = range(1, VALUES_NUMBER + 1)
+        assert OldValueFormatter.FormatValue(1536, options, True) == ValueFormatter.FormatValue(1536, options, True)
+
+        # Each warehouse with the old formatter, checking the options at every value:
+        start = time.perf_counter()
+        for _ in range(WAREHOUSES_NUMBER):
+            for value in values:
+                OldValueFormatter.FormatValue(value, options, True)
+        dispatched = time.perf_counter() - start
+
+        # Each warehouse with the compiled formatter:
+        start = time.perf_counter()
+        for _ in range(WAREHOUSES_NUMBER):
+            for value in values:
+                ValueFormatter.FormatValue(value, options, True)
+        compiled = time.perf_counter() - start
+
+        # Formatted by the first warehouse reading the snapshot, the other ones find it done:
+        snapshots = [SensorSnapshot(FakeSensor(value, options), 1, 0) for value in values]
+        start = time.perf_counter()
+        for _ in range(WAREHOUSES_NUMBER):
+            for snapshot in snapshots:
+                snapshot.GetFormattedValue(True)
+        cached = time.perf_counter() - start
+
+        assert compiled < dispatched
+        assert cached < compiled
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from IoTuring.Entity.CommandExecutor import CommandExecutor
+from IoTuring.Metrics.MetricsRegistry import MetricsRegistry, METRIC_COMMAND_WAIT
+
+
+class FakeCommand:
+    def __init__(self, entity, id) -> None:
+        self.entity = entity
+        self.id = id
+
+    def GetEntity(self):
+        return self.entity
+
+    def GetId(self):
+        return self.id
+
+
+def MakeExecutor(workers):
+    # A new executor for each test, not the shared one:
+    executor = CommandExecutor.__new__(CommandExecutor)
+    executor.__init__()
+    executor.SetWorkers(workers)
+    return executor
+
+
+def WaitFor(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+class TestCommandExecutor:
+    def testSameEntityInOrder(self):
+        executor = MakeExecutor(4)
+        command = FakeCommand(object(), "Entity.A.command")
+        running, results = [], []
+
+        def Callback(value):
+            running.append(value)
+            # Never two callbacks of the same entity together:
+            assert len(running) == 1
+            time.sleep(0.01)
+            results.append(value)
+            running.remove(value)
+
+        for value in range(10):
+            assert executor.Submit(command, Callback, value)
+
+        WaitFor(lambda: len(results) == 10)
+        assert results == list(range(10))
+        assert MetricsRegistry().GetMetric(MetricsRegistry.MakeName(
+            METRIC_COMMAND_WAIT, "Entity.A.command")).count >= 10
+
+    def testEntitiesInParallel(self):
+        executor = MakeExecutor(2)
+        slow = FakeCommand(object(), "Entity.Slow.command")
+        fast = FakeCommand(object(), "Entity.Fast.command")
+        release = threading.Event()
+        results = []
+
+        executor.Submit(slow, lambda: release.wait(5) and results.append("slow"))
+        executor.Submit(fast, lambda: results.append("fast"))
+
+        # A stuck command doesn't block the commands of other entities:
+        WaitFor(lambda: results == ["fast"])
+        release.set()
+        WaitFor(lambda: results == ["fast", "slow"])
+
+    def testBounded(self):
+        executor = MakeExecutor(1)
+        executor.maxPending = 2
+        command = FakeCommand(object(), "Entity.A.command")
+        release = threading.Event()
+
+        executor.Submit(command, release.wait, 5)
+        WaitFor(lambda: executor.GetStats()["running"] == 1)
+        assert executor.Submit(command, lambda: None)
+        assert executor.Submit(command, lambda: None)
+        assert not executor.Submit(command, lambda: None)
+        assert executor.GetStats() == {"pending": 2, "running": 1, "rejected": 1, "superseded": 0}
+
+        release.set()
+        WaitFor(lambda: executor.GetStats()["pending"] == 0)
+
+    def testDebounce(self):
+        executor = MakeExecutor(1)
+        command = FakeCommand(object(), "Entity.A.command")
+        results = []
+
+        for value in range(10):
+            executor.SubmitDebounced(command, 0.2, results.append, value)
+
+        WaitFor(lambda: results)
+        # Only the last payload of the window runs:
+        time.sleep(0.1)
+        assert results == [9]
+        assert executor.GetStats()["superseded"] == 9
+
+        # A new window starts with the next command:
+        executor.SubmitDebounced(command, 0.05, results.append, 10)
+        WaitFor(lambda: results == [9, 10])
@@ -0,0 +1,31 @@
+from IoTuring.Entity.CommandExecutor import CONFIG_KEY_COMMAND_DEBOUNCE
+from IoTuring.Entity.Entity import Entity
+from IoTuring.Entity.PublishPolicy import CONFIG_KEY_PUBLISH_DEADBAND, CONFIG_KEY_PUBLISH_MIN_INTERVAL
+
+
+class TextEntity(Entity):
+    NAME = "Text"
+
+
+class NumericEntity(Entity):
+    NAME = "Numeric"
+    NUMERIC_SENSORS = True
+
+
+class CommandEntity(Entity):
+    NAME = "Command"
+    HAS_COMMANDS = True
+
+
+class TestConfigurationPreset:
+    def testDeadbandOnlyForNumbers(self):
+        text = TextEntity.GetConfigurationPreset()
+        numeric = NumericEntity.GetConfigurationPreset()
+
+        assert text.GetPresetByKey(CONFIG_KEY_PUBLISH_DEADBAND) is None
+        assert text.GetPresetByKey(CONFIG_KEY_PUBLISH_MIN_INTERVAL) is not None
+        assert numeric.GetPresetByKey(CONFIG_KEY_PUBLISH_DEADBAND) is not None
+
+    def testDebounceOnlyWithCommands(self):
+        assert TextEntity.GetConfigurationPreset().GetPresetByKey(CONFIG_KEY_COMMAND_DEBOUNCE) is None
+        assert CommandEntity.GetConfigurationPreset().GetPresetByKey(CONFIG_KEY_COMMAND_DEBOUNCE) is not None
@@ -0,0 +1,138 @@
+import time
+import tracemalloc
+
+import pytest
+
+from IoTuring.ClassManager.consts import KEY_ENTITY
+from IoTuring.Configurator.Configuration import SingleConfiguration, CONFIG_CLASS
+from IoTuring.Entity.Entity import Entity
+from IoTuring.Entity.EntityManager import EntityManager
+from IoTuring.Entity.ChangeQueue import ChangeQueue
+from IoTuring.Entity.EntityData import EntitySensor
+from IoTuring.Exceptions.Exceptions import UnknownEntityKeyException
+from IoTuring.Settings.SettingsManager import SettingsManager
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings
+
+SENSORS_NUMBER = 2000
+EXTRA_ATTRIBUTES_NUMBER = 5
+
+
+class BenchEntity(Entity):
+    NAME = "Bench"
+
+    def Initialize(self):
+        for i in range(SENSORS_NUMBER):
+            self.RegisterEntitySensor(EntitySensor(
+                self, f"sensor_{i}", supportsExtraAttributes=True))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def appSettings():
+    SettingsManager().AddSettings(
+        [AppSettings(AppSettings.GetDefaultConfigurations(), early_init=False)])
+
+
+def MakeEntity() -> BenchEntity:
+    entity = BenchEntity(SingleConfiguration(
+        CONFIG_CLASS[KEY_ENTITY], {"type": BenchEntity.NAME}))
+    assert entity.CallInitialize()
+    return entity
+
+
+def Update(entity: Entity, value) -> None:
+    for i in range(SENSORS_NUMBER):
+        key = f"sensor_{i}"
+        entity.SetEntitySensorValue(key, value)
+        for a in range(EXTRA_ATTRIBUTES_NUMBER):
+            entity.SetEntitySensorExtraAttribute(key, f"attr_{a}", value)
+
+
+class TestEntityData:
+    def testLookup(self):
+        entity = MakeEntity()
+        Update(entity, 1)
+        Update(entity, 2)
+
+        sensor = entity.GetEntitySensorByKey(f"sensor_{SENSORS_NUMBER - 1}")
+        assert sensor.GetValue() == 2
+        assert [a.GetValue() for a in sensor.GetExtraAttributes()] == \
+            [2] * EXTRA_ATTRIBUTES_NUMBER
+        assert len(list(entity.GetEntitySensors())) == SENSORS_NUMBER
+
+        with pytest.raises(UnknownEntityKeyException):
+            entity.GetEntitySensorByKey("missing")
+
+        with pytest.raises(AttributeError):
+            sensor.unknownAttribute = 1  # type: ignore
+
+    def testBenchmark(self):
+        tracemalloc.start()
+        entity = MakeEntity()
+        Update(entity, 1)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Lookups must not depend on the position of the sensor:
+        def LookupTime(key):
+            start = time.perf_counter()
+            for _ in range(2000):
+                entity.GetEntitySensorByKey(key)
+            return time.perf_counter() - start
+
+        first = min(LookupTime("sensor_0") for _ in range(3))
+        last = min(LookupTime(f"sensor_{SENSORS_NUMBER - 1}")
+                   for _ in range(3))
+
+        assert last < first * 5
+        assert memory / SENSORS_NUMBER < 4096
+
+
+class TestEntitySnapshot:
+    def testCommit(self):
+        entity = MakeEntity()
+        first = entity.GetSnapshot()
+        assert len(first.GetSensors()) == SENSORS_NUMBER
+        assert not first.GetSensorByKey("sensor_0").HasValue()
+
+        changeQueue = ChangeQueue()
+        EntityManager().AddChangeQueue(changeQueue)
+
+        entity.SetEntitySensorValue("sensor_0", 1)
+        entity.SetEntitySensorExtraAttribute("sensor_0", "attr", 2)
+        entity.SetEntitySensorValue("sensor_0", 3)
+
+        # Not visible before the commit:
+        assert entity.GetSnapshot() is first
+        entity.CommitSnapshot()
+
+        second = entity.GetSnapshot()
+        assert second.GetVersion() == first.GetVersion() + 1
+        changed = second.GetSensorByKey("sensor_0")
+        assert changed.GetValue() == 3
+        assert changed.GetFormattedExtraAtributes(False) == {"attr": "2"}
+
+        # Unchanged sensors are shared with the previous snapshot:
+        assert second.GetSensorByKey("sensor_1") is first.GetSensorByKey("sensor_1")
+
+        # The old snapshot doesn't change:
+        assert not first.GetSensorByKey("sensor_0").HasValue()
+
+        # One change for the sensor, with the last state:
+        assert changeQueue.Get(timeout=0) == [changed]
+
+        with pytest.raises(AttributeError):
+            changed.value = 4  # type: ignore
+
+    def testFormattedOnce(self):
+        entity = MakeEntity()
+        entity.SetEntitySensorValue("sensor_0", 1536)
+        entity.SetEntitySensorExtraAttribute("sensor_0", "attr", 2)
+        entity.CommitSnapshot()
+        sensorSnapshot = entity.GetSnapshot().GetSensorByKey("sensor_0")
+
+        assert sensorSnapshot.GetFormattedValue(True) == "1536"
+        # Kept for the next warehouses:
+        assert sensorSnapshot.GetFormattedValue(True) is sensorSnapshot.GetFormattedValue(True)
+        extraAttributes = sensorSnapshot.GetFormattedExtraAtributes(True)
+        extraAttributes["attr"] = "changed"
+        assert sensorSnapshot.GetFormattedExtraAtributes(True) == {"attr": "2"}
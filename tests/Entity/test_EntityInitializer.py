@@ -0,0 +1,37 @@
+import time
+
+from IoTuring.Entity.EntityInitializer import EntityInitializer
+
+
+class FakeEntity:
+    def __init__(self, duration, success=True) -> None:
+        self.duration = duration
+        self.success = success
+
+    def CallInitialize(self):
+        time.sleep(self.duration)
+        return self.success
+
+
+class TestEntityInitializer:
+    def testParallelInitialization(self):
+        entities = [FakeEntity(0.2) for _ in range(4)] + \
+            [FakeEntity(0, success=False)]
+
+        start = time.monotonic()
+        initializer = EntityInitializer(entities, workers=4)
+        results = [initializer.WaitEntity(e, timeout=5) for e in entities]
+
+        assert results == [True, True, True, True, False]
+        assert time.monotonic() - start < 0.6
+
+    def testTimeout(self):
+        stuck = FakeEntity(10)
+        entities = [stuck, FakeEntity(0.1), FakeEntity(0.1)]
+
+        # A single worker: the stuck entity must not block the others
+        initializer = EntityInitializer(entities, workers=1)
+
+        assert initializer.WaitEntity(stuck, timeout=0.2) is None
+        assert initializer.WaitEntity(entities[1], timeout=1) is True
+        assert initializer.WaitEntity(entities[2], timeout=1) is True
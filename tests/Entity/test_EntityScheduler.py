@@ -0,0 +1,91 @@
+import time
+
+from IoTuring.Entity.EntityScheduler import EntityScheduler, GetNextDueTime
+from IoTuring.Entity.UpdateWatchdog import UpdateStats
+
+
+class FakeEntity:
+    def __init__(self, timeout, duration=0) -> None:
+        self.updateTimeout = timeout
+        self.duration = duration
+        self.updates = 0
+        self.skip = False
+        self.stats = UpdateStats()
+
+    def ShouldUpdate(self):
+        return not self.skip
+
+    def CallUpdate(self):
+        self.updates += 1
+        time.sleep(self.duration)
+
+    def GetUpdateStats(self):
+        return self.stats
+
+    def GetUpdateDeadline(self):
+        return 0
+
+    def GetEntityId(self):
+        return "Entity.Fake"
+
+
+class TestEntityScheduler:
+    def testNextDueTime(self):
+        # Fixed rate: next tick on the grid, not interval after now
+        assert GetNextDueTime(100, 10, 103) == 110
+        assert GetNextDueTime(100, 10, 110) == 120
+        # Missed ticks are skipped:
+        assert GetNextDueTime(100, 10, 135.5) == 140
+        # Phase shifted grid:
+        assert GetNextDueTime(102.5, 10, 103) == 112.5
+
+    def testPeriodicUpdates(self):
+        scheduler = EntityScheduler(workers=2)
+        fast = FakeEntity(0.02)
+        slow = FakeEntity(10)
+        scheduler.Schedule(fast)
+        scheduler.Schedule(slow)
+        scheduler.Start()
+
+        time.sleep(0.3)
+        # First update runs immediately, then every timeout:
+        assert fast.updates >= 5
+        assert slow.updates == 1
+        assert scheduler.GetQueueLag()["waiting"] == 0
+
+    def testFirstUpdateShifted(self):
+        scheduler = EntityScheduler(workers=2)
+        first = FakeEntity(0.4)
+        second = FakeEntity(0.4)
+        scheduler.Schedule(first, 0)
+        scheduler.Schedule(second, 0.5)
+        scheduler.Start()
+
+        time.sleep(0.1)
+        # Staggered from the first update, not only from the second one:
+        assert first.updates == 1
+        assert second.updates == 0
+
+        time.sleep(0.2)
+        assert second.updates == 1
+
+    def testShouldUpdateSkips(self):
+        scheduler = EntityScheduler(workers=1)
+        entity = FakeEntity(0.02)
+        entity.skip = True
+        scheduler.Schedule(entity)
+        scheduler.Start()
+
+        time.sleep(0.1)
+        assert entity.updates == 0
+
+    def testOverruns(self):
+        scheduler = EntityScheduler(workers=2)
+        entity = FakeEntity(0.05, duration=0.12)
+        scheduler.Schedule(entity)
+        scheduler.Start()
+
+        time.sleep(0.3)
+        # Never updated twice at the same time, skipped ticks are counted:
+        assert entity.updates <= 3
+        assert entity.stats.overruns >= 2
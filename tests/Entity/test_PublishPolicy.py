@@ -0,0 +1,89 @@
+import time
+
+from IoTuring.Entity.ChangeQueue import ChangeQueue
+from IoTuring.Entity.PublishPolicy import PublishPolicy, PublishFilter
+
+
+class FakeSnapshot:
+    def __init__(self, entitySensor, value) -> None:
+        self.entitySensor = entitySensor
+        self.value = value
+
+    def GetEntitySensor(self):
+        return self.entitySensor
+
+
+class TestPublishFilter:
+    def testDefaultPublishesChanges(self):
+        publishFilter = PublishFilter(PublishPolicy())
+        assert publishFilter.ShouldPublish(10, "10")
+        assert not publishFilter.ShouldPublish(10, "10")
+        assert publishFilter.ShouldPublish(10.1, "10.1")
+        assert publishFilter.ShouldPublish("on", "on")
+        assert publishFilter.ShouldPublish(None, "on", force=True)
+
+    def testDeadbandHysteresis(self):
+        publishFilter = PublishFilter(PublishPolicy(deadband=0.5))
+        assert publishFilter.ShouldPublish(10.0, "10.0")
+        # Jitter around the last published value:
+        assert not publishFilter.ShouldPublish(10.3, "10.3")
+        assert not publishFilter.ShouldPublish(9.6, "9.6")
+        assert not publishFilter.ShouldPublish(10.4, "10.4")
+        assert publishFilter.ShouldPublish(10.6, "10.6")
+        assert not publishFilter.ShouldPublish(10.2, "10.2")
+
+    def testRelativeDeadband(self):
+        publishFilter = PublishFilter(PublishPolicy(relative_deadband=0.1))
+        assert publishFilter.ShouldPublish(1000, "1000")
+        assert not publishFilter.ShouldPublish(1090, "1090")
+        assert publishFilter.ShouldPublish(1110, "1110")
+
+    def testIntervals(self):
+        publishFilter = PublishFilter(
+            PublishPolicy(min_interval=0.1, max_silence=0.2))
+        assert publishFilter.ShouldPublish(1, "1")
+        assert not publishFilter.ShouldPublish(2, "2")
+        time.sleep(0.1)
+        assert publishFilter.ShouldPublish(2, "2")
+        assert not publishFilter.ShouldPublish(2, "2")
+        time.sleep(0.2)
+        # Heartbeat:
+        assert publishFilter.ShouldPublish(2, "2")
+
+    def testBurstLastValue(self):
+        publishFilter = PublishFilter(PublishPolicy(min_interval=0.2))
+        changeQueue = ChangeQueue()
+        published = []
+
+        # Like the warehouses, with Warehouse.SendLater:
+        def Send(sensorSnapshot):
+            if publishFilter.ShouldPublish(sensorSnapshot.value, sensorSnapshot.value):
+                published.append(sensorSnapshot.value)
+            elif publishFilter.GetPendingTime() is not None:
+                changeQueue.PutLater(sensorSnapshot, publishFilter.GetPendingTime())
+
+        entitySensor = object()
+        for value in ["on", "off", "on", "off"]:
+            Send(FakeSnapshot(entitySensor, value))
+        assert published == ["on"]
+
+        # The last value of the burst comes back when min_interval ends:
+        assert changeQueue.Get(timeout=0) == []
+        start = time.monotonic()
+        for sensorSnapshot in changeQueue.Get(timeout=5):
+            Send(sensorSnapshot)
+        assert published == ["on", "off"]
+        assert time.monotonic() - start < 1
+
+        # Nothing held back if the burst ends on the published value:
+        Send(FakeSnapshot(entitySensor, "on"))
+        Send(FakeSnapshot(entitySensor, "off"))
+        assert publishFilter.GetPendingTime() is None
+
+    def testFromDict(self):
+        base = PublishPolicy(deadband=1, max_silence=60)
+        policy = PublishPolicy.FromDict(
+            {"publish_deadband": "0.5", "publish_min_interval": "", "other": 3}, base=base)
+        assert policy.deadband == 0.5
+        assert policy.min_interval == 0
+        assert policy.max_silence == 60
@@ -0,0 +1,29 @@
+import subprocess
+import time
+
+import pytest
+
+from IoTuring.Entity.UpdateWatchdog import Deadline, GetRemainingTime
+from IoTuring.MyApp.SystemConsts import OperatingSystemDetection as OsD
+
+
+class TestUpdateWatchdog:
+    def testDeadline(self):
+        assert GetRemainingTime() is None
+        with Deadline(10):
+            assert 9 < GetRemainingTime() <= 10
+            with Deadline(0):
+                # No deadline, the outer one still applies
+                assert GetRemainingTime() is not None
+        assert GetRemainingTime() is None
+
+    @pytest.mark.skipif(OsD.IsWindows(), reason="Uses a POSIX shell")
+    def testCommandKilled(self):
+        start = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired):
+            # The child of the shell holds the output pipe, it must be killed too:
+            OsD.RunCommand("sleep 5 | cat", shell=True, timeout=0.2)
+        assert time.monotonic() - start < 2
+
+        p = OsD.RunCommand("echo ok", timeout=2)
+        assert p.returncode == 0 and p.stdout == "ok\n"
@@ -0,0 +1,34 @@
+from IoTuring.Metrics.MetricsRegistry import DurationMetric, MetricsRegistry, SAMPLES_NUMBER
+
+
+class TestMetricsRegistry:
+    def testDurationMetric(self):
+        metric = DurationMetric()
+        for ms in range(1, 101):
+            metric.Record(ms / 1000, error=(ms % 10 == 0))
+
+        stats = metric.ToDict()
+        assert stats["count"] == 100
+        assert stats["errors"] == 10
+        assert stats["last"] == 100
+        assert stats["max"] == 100
+        assert 49 <= stats["p50"] <= 51
+        assert 94 <= stats["p95"] <= 96
+
+    def testPercentilesOnLastSamples(self):
+        metric = DurationMetric()
+        metric.Record(10)
+        for _ in range(SAMPLES_NUMBER):
+            metric.Record(0.001)
+
+        # The old slow sample is out of the window, but still the maximum:
+        assert metric.GetPercentile(100) == 1
+        assert metric.max == 10000
+
+    def testRegistry(self):
+        registry = MetricsRegistry()
+        name = registry.MakeName("test", "Entity.Fake")
+        assert registry.GetMetric(name) is registry.GetMetric(name)
+
+        registry.Record(name, 0.5)
+        assert list(registry.GetMetrics("test.")) == [name]
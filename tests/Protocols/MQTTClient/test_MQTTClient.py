@@ -0,0 +1,155 @@
+from types import SimpleNamespace
+
+from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
+from IoTuring.Protocols.MQTTClient.Spool import Spool
+from IoTuring.Protocols.MQTTClient.TopicAliases import TopicAliases
+from IoTuring.Protocols.MQTTClient.ReconnectBackoff import ReconnectBackoff
+
+
+class FakePahoClient:
+    def __init__(self):
+        self.disconnected = False
+        self.wills = []
+        self.published = []
+
+    def disconnect(self):
+        self.disconnected = True
+
+    def will_set(self, topic, payload, retain=False):
+        self.wills.append((topic, payload))
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+        return SimpleNamespace(wait_for_publish=lambda timeout: None)
+
+    def loop_stop(self):
+        pass
+
+
+class TestSharedClient:
+    def testSameBroker(self):
+        first = MQTTClient.GetSharedClient("broker.test", 1883, "first")
+        second = MQTTClient.GetSharedClient("broker.test", "1883", "second")
+        other = MQTTClient.GetSharedClient("broker.test", 1883, "other", "user", "pass")
+
+        assert first is second and first.name == "first"
+        assert other is not first
+
+        first.client = FakePahoClient()
+        first.Release()
+        assert not first.client.disconnected
+        second.Release()
+        assert first.client.disconnected
+        assert MQTTClient.GetSharedClient("broker.test", 1883, "new") is not first
+
+        ReleaseAll()
+
+    def testWills(self):
+        first = MQTTClient.GetSharedClient("broker.test", 1883, "first", will=("first/LWT", "OFFLINE"))
+        # Without a will, or with the same one, the connection is shared:
+        assert MQTTClient.GetSharedClient("broker.test", 1883, "mqtt") is first
+        assert MQTTClient.GetSharedClient("broker.test", 1883, "again", will=("first/LWT", "OFFLINE")) is first
+        # A different will needs its own connection:
+        second = MQTTClient.GetSharedClient("broker.test", 1883, "second", will=("second/LWT", "OFFLINE"))
+        assert second is not first and second.lwt == ("second/LWT", "OFFLINE")
+
+        # The will is sent by the last warehouse releasing the client, as a clean disconnection doesn't send it:
+        first.client = FakePahoClient()
+        first.connected = True
+        for _ in range(2):
+            first.Release()
+        assert not first.client.published
+        first.Release()
+        assert first.client.published == [("first/LWT", "OFFLINE")]
+        assert first.client.disconnected
+
+        ReleaseAll()
+
+    def testReleaseClosesSpool(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("IOTURING_CONFIG_DIR", str(tmp_path))
+        client = MQTTClient.GetSharedClient("broker.test", 1883, "spooled")
+        client.EnableSpool(4096, 0)
+        client.SendTopicData("test/value", "offline")
+
+        client.client = FakePahoClient()
+        client.Release()
+        assert client.spool is None
+
+        # Readings not sent are kept for the next start:
+        spool = Spool(tmp_path / "spool_spooled.bin", 4096, 0)
+        assert spool.Peek().topic == "test/value"
+        spool.Close()
+
+        ReleaseAll()
+
+
+def ReleaseAll():
+    for clients in list(MQTTClient.sharedClients.values()):
+        for client in list(clients):
+            client.client = FakePahoClient()
+            while client.users:
+                client.Release()
+    assert not MQTTClient.sharedClients
+
+
+class FakePublishClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, retain=False, properties=None):
+        self.published.append((topic, getattr(properties, "TopicAlias", None),
+                               getattr(properties, "MessageExpiryInterval", None)))
+        return SimpleNamespace(rc=0)
+
+
+class TestMQTTv5:
+    def testTopicAliases(self):
+        aliases = TopicAliases()
+        assert aliases.Get("a/state") == ("a/state", None)
+
+        aliases.Reset(1)
+        assert aliases.Get("a/state") == ("a/state", None)
+        assert aliases.Get("b/state") == ("b/state", None)
+        # Published again: the alias is assigned, then used alone
+        assert aliases.Get("a/state") == ("a/state", 1)
+        assert aliases.Get("a/state") == ("", 1)
+        # No more aliases allowed by the broker:
+        assert aliases.Get("b/state") == ("b/state", None)
+        assert aliases.GetStats() == {"aliases": 1, "aliased": 1, "bytes_saved": 1}
+
+        # A new connection starts without aliases:
+        aliases.Reset(1)
+        assert aliases.Get("a/state") == ("a/state", None)
+
+    def testPublish(self):
+        client = MQTTClient("localhost", name="v5test", mqtt_v5=True)
+        client.client = FakePublishClient()
+        client.SetMessageExpiry(60)
+        client.topicAliases.Reset(10)
+
+        for _ in range(3):
+            client.Publish("IoTuring/pc/Entity/Time/now", "value", False)
+        client.Publish("homeassistant/sensor/pc/config", "{}", True)
+
+        assert client.client.published == [
+            ("IoTuring/pc/Entity/Time/now", None, 60),
+            ("IoTuring/pc/Entity/Time/now", 1, 60),
+            ("", 1, 60),
+            # Retained messages are kept as they are:
+            ("homeassistant/sensor/pc/config", None, None)]
+
+
+class TestReconnectBackoff:
+    def testFullJitter(self):
+        backoff = ReconnectBackoff(1, 10)
+        limits = [1, 2, 4, 8, 10, 10]
+        for limit in limits:
+            assert 0 <= backoff.NextDelay() <= limit
+        assert backoff.attempt == 4
+
+        backoff.Reset()
+        assert backoff.attempt == 0
+        # Random, but not all the same:
+        delays = [ReconnectBackoff(10, 10).NextDelay() for _ in range(20)]
+        assert all(0 <= delay <= 10 for delay in delays)
+        assert len(set(delays)) > 1
@@ -0,0 +1,30 @@
+from IoTuring.Protocols.MQTTClient.OutboundQueue import OutboundQueue, OutboundMessage
+
+
+class TestOutboundQueue:
+    def testLastValueWins(self):
+        queue = OutboundQueue(max_size=10)
+        for value in range(5):
+            queue.Put(OutboundMessage("a", value, False))
+            queue.Put(OutboundMessage("b", value, False))
+
+        messages = queue.GetAll(timeout=0)
+        assert [(m.topic, m.payload) for m in messages] == [("a", 4), ("b", 4)]
+        assert queue.GetStats() == {"depth": 0, "coalesced": 8, "dropped": 0}
+
+    def testBounded(self):
+        queue = OutboundQueue(max_size=2)
+        for topic in ["a", "b", "c"]:
+            queue.Put(OutboundMessage(topic, 1, False))
+
+        assert [m.topic for m in queue.GetAll(timeout=0)] == ["b", "c"]
+        assert queue.dropped == 1
+
+    def testPutBack(self):
+        queue = OutboundQueue(max_size=10)
+        unsent = [OutboundMessage("a", 1, False), OutboundMessage("b", 1, False)]
+        queue.Put(OutboundMessage("b", 2, False))
+        queue.PutBack(unsent)
+
+        # Unsent first, but not older than the queued value of the same topic:
+        assert [(m.topic, m.payload) for m in queue.GetAll(timeout=0)] == [("a", 1), ("b", 2)]
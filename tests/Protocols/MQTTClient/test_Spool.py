@@ -0,0 +1,185 @@
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from IoTuring.Protocols.MQTTClient.Spool import Spool, HEADER_SIZE, FLUSH_RECORDS, FLUSH_INTERVAL
+from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
+
+
+def ReadAll(spool):
+    records = []
+    while (record := spool.Peek()) is not None:
+        records.append((record.topic, bytes(record.payload), record.retain))
+        spool.Pop(record)
+    return records
+
+
+class TestSpool:
+    def testOrder(self, tmp_path):
+        spool = Spool(tmp_path / "spool.bin", 4096, 0)
+        for value in range(3):
+            spool.Append("a", str(value))
+            spool.Append("b", value, retain=True)
+
+        assert ReadAll(spool) == [("a", b"0", False), ("b", b"0", True), ("a", b"1", False),
+                                  ("b", b"1", True), ("a", b"2", False), ("b", b"2", True)]
+        assert spool.IsEmpty() and spool.readOffset == HEADER_SIZE
+
+    def testPersistence(self, tmp_path):
+        spool = Spool(tmp_path / "spool.bin", 4096, 0)
+        for value in range(3):
+            spool.Append("a", value)
+        spool.Pop(spool.Peek())
+        spool.Close()
+
+        spool = Spool(tmp_path / "spool.bin", 4096, 0)
+        assert ReadAll(spool) == [("a", b"1", False), ("a", b"2", False)]
+
+    def testMaxAge(self, tmp_path):
+        spool = Spool(tmp_path / "spool.bin", 4096, 60)
+        spool.Append("a", "old", timestamp=time.time() - 120)
+        spool.Append("a", "new")
+
+        assert ReadAll(spool) == [("a", b"new", False)]
+        assert spool.GetStats()["expired"] == 1
+
+    def testFull(self, tmp_path):
+        spool = Spool(tmp_path / "spool.bin", HEADER_SIZE + 3 * 30, 0)
+        results = [spool.Append("topic", "0123456789") for _ in range(4)]
+        assert results == [True, True, True, False]
+        assert spool.GetStats()["dropped"] == 1
+
+        # Read records are compacted away to make space, also between a Peek and its Pop:
+        record = spool.Peek()
+        spool.Pop(record)
+        assert spool.Append("topic", "abcdefghij")
+        record = spool.Peek()
+        assert spool.Append("topic", "abcdefghij") is False
+        spool.Pop(record)
+        assert spool.Append("topic", "klmnopqrst")
+        assert [payload for _, payload, _ in ReadAll(spool)] == \
+            [b"0123456789", b"abcdefghij", b"klmnopqrst"]
+
+
+    def testFlush(self, tmp_path):
+        spool = Spool(tmp_path / "spool.bin", 65536, 0)
+        for value in range(FLUSH_RECORDS - 1):
+            spool.Append("a", value)
+        assert spool.unflushed == FLUSH_RECORDS - 1
+        spool.Append("a", "last")
+        assert spool.unflushed == 0
+
+        # Also written after some time, with few records:
+        spool.Append("a", "slow")
+        assert spool.unflushed == 1
+        spool.lastFlush -= FLUSH_INTERVAL
+        spool.Append("a", "slow")
+        assert spool.unflushed == 0
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    """ Minimal MQTT 3.1.1 broker: accepts connections and subscriptions, records QoS 0 publishes """
+
+    def handle(self):
+        self.server.connections.append(self.request)
+        try:
+            while True:
+                packet_type = self.Read(1)[0] >> 4
+                length, multiplier = 0, 1
+                while True:
+                    byte = self.Read(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self.Read(length)
+
+                if packet_type == 1:  # CONNECT
+                    self.request.sendall(b"\x20\x02\x00\x00")
+                elif packet_type == 3:  # PUBLISH
+                    topic_length = struct.unpack("!H", body[:2])[0]
+                    self.server.messages.append(
+                        (body[2:2 + topic_length].decode(), body[2 + topic_length:]))
+                elif packet_type == 8:  # SUBSCRIBE
+                    self.request.sendall(b"\x90\x03" + body[:2] + b"\x00")
+                elif packet_type == 12:  # PINGREQ
+                    self.request.sendall(b"\xd0\x00")
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            pass
+
+    def Read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError()
+            data += chunk
+        return data
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port, messages):
+        super().__init__(("127.0.0.1", port), BrokerHandler)
+        self.messages = messages
+        self.connections = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def Stop(self):
+        self.shutdown()
+        self.server_close()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Already closed by the client
+                pass
+
+
+def WaitFor(condition, timeout=10):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.05)
+
+
+class TestSpoolReplay:
+    def testReplayAfterOutage(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("IOTURING_CONFIG_DIR", str(tmp_path))
+        messages = []
+        broker = Broker(0, messages)
+        port = broker.server_address[1]
+
+        client = MQTTClient("127.0.0.1", port, name="spooltest")
+        client.SetReconnectBackoff(0.5, 1)
+        client.EnableSpool(4096, 0)
+        client.AsyncConnect()
+        WaitFor(client.IsConnected)
+
+        client.SendTopicData("test/value", "before")
+        WaitFor(lambda: messages)
+
+        broker.Stop()
+        WaitFor(lambda: not client.IsConnected())
+        for value in range(5):
+            client.SendTopicData("test/value", str(value))
+        assert (tmp_path / "spool_spooltest.bin").exists()
+
+        broker = Broker(port, messages)
+        WaitFor(lambda: len(messages) == 6)
+        # Values sent after the spool is empty are queued as usual:
+        client.SendTopicData("test/value", "after")
+        WaitFor(lambda: len(messages) == 7)
+
+        client.client.disconnect()
+        client.client.loop_stop()
+        broker.Stop()
+
+        assert [payload.decode() for _, payload in messages] == \
+            ["before", "0", "1", "2", "3", "4", "after"]
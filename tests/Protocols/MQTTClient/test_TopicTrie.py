@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+from IoTuring.Protocols.MQTTClient.TopicTrie import TopicTrie, TopicMatches
+from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
+
+
+class TestTopicTrie:
+    def testMatch(self):
+        trie = TopicTrie()
+        for topic_filter in ["a/b/c", "a/+/c", "a/#", "+/b/+", "#", "a/b"]:
+            trie.Add(topic_filter, topic_filter)
+
+        assert sorted(trie.Match("a/b/c")) == sorted(["a/b/c", "a/+/c", "a/#", "+/b/+", "#"])
+        assert sorted(trie.Match("a")) == sorted(["a/#", "#"])
+        assert sorted(trie.Match("a/b")) == sorted(["a/#", "#", "a/b"])
+        assert trie.Match("b/c") == ["#"]
+        # Wildcards don't match system topics:
+        assert trie.Match("$SYS/b/c") == []
+
+    def testRemove(self):
+        trie = TopicTrie()
+        first, second = object(), object()
+        trie.Add("a/b", first)
+        trie.Add("a/b", second)
+        trie.Add("a/+", first)
+
+        assert trie.Remove("a/b", first) == [first]
+        assert trie.Match("a/b") == [second, first]
+        assert trie.Remove("a/b") == [second]
+        assert trie.Remove("a/c") == []
+        assert len(trie) == 1
+        assert "b" not in trie.root.children["a"].children
+
+    def testTopicMatches(self):
+        assert TopicMatches("IoTuring/pc/#", "IoTuring/pc/Entity/Power/lock")
+        assert TopicMatches("+/pc/+", "IoTuring/pc/x")
+        assert not TopicMatches("+/pc/+", "IoTuring/pc/x/y")
+        assert not TopicMatches("IoTuring/pc", "IoTuring/pc/x")
+        assert TopicMatches("IoTuring/pc/#", "IoTuring/pc")
+        assert not TopicMatches("IoTuring/pc/x", "IoTuring/pc")
+        # System topics are not matched by wildcards in the first level:
+        assert not TopicMatches("#", "$SYS/uptime")
+        assert not TopicMatches("+/uptime", "$SYS/uptime")
+        assert TopicMatches("$SYS/#", "$SYS/uptime")
+
+        # The same results as the trie:
+        filters = ["#", "+", "a/#", "a/+", "+/b", "a/b", "a/+/#", "$SYS/#", "+/+/c"]
+        topics = ["a", "a/b", "a/b/c", "x/b", "$SYS/a", "a//b", ""]
+        for topic_filter in filters:
+            trie = TopicTrie()
+            trie.Add(topic_filter, True)
+            for topic in topics:
+                assert TopicMatches(topic_filter, topic) == bool(trie.Match(topic)), (topic_filter, topic)
+
+
+class FakePahoClient:
+    def __init__(self):
+        self.subscribed = []
+        self.unsubscribed = []
+
+    def subscribe(self, topics):
+        self.subscribed.append(topics)
+
+    def unsubscribe(self, topic):
+        self.unsubscribed.append(topic)
+
+
+class TestSubscriptions:
+    def MakeClient(self):
+        client = MQTTClient("localhost", name="test")
+        client.client = FakePahoClient()
+        return client
+
+    def testBatchedResubscription(self):
+        client = self.MakeClient()
+        received = []
+        for topic in ["a/1", "a/2", "b/1"]:
+            client.AddNewTopicToSubscribeTo(topic, received.append)
+
+        client.connected = True
+        client.SubscribeToAllTopics()
+        assert client.client.subscribed == [[("a/1", 0), ("a/2", 0), ("b/1", 0)]]
+
+        client.Event_OnMessageReceive(None, None, SimpleNamespace(topic="a/2", payload=b"x"))
+        assert [message.topic for message in received] == ["a/2"]
+
+    def testWildcardSubscription(self):
+        client = self.MakeClient()
+        client.connected = True
+        received = []
+        client.AddNewTopicToSubscribeTo("a/1", received.append)
+        client.AddWildcardSubscription("a/#")
+        client.AddNewTopicToSubscribeTo("a/2", received.append)
+        client.AddNewTopicToSubscribeTo("b/1", received.append)
+
+        assert client.client.subscribed == [[("a/1", 0)], [("a/#", 0)], [("b/1", 0)]]
+        assert client.client.unsubscribed == ["a/1"]
+
+        # Messages of the wildcard without a callback are ignored:
+        for topic in ["a/1", "a/2", "a/3"]:
+            client.Event_OnMessageReceive(None, None, SimpleNamespace(topic=topic, payload=b"x"))
+        assert [message.topic for message in received] == ["a/1", "a/2"]
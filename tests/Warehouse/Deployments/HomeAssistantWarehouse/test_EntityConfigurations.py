@@ -0,0 +1,35 @@
+from IoTuring.Warehouse.Deployments.HomeAssistantWarehouse.EntityConfigurations import EntityConfigurations
+
+
+def MakeConfigurations():
+    # A new instance for each test, not the shared one:
+    configurations = EntityConfigurations.__new__(EntityConfigurations)
+    configurations.__init__()
+    return configurations
+
+
+class TestEntityConfigurations:
+    def testDefaults(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("IOTURING_CONFIG_DIR", str(tmp_path))
+        configurations = MakeConfigurations()
+
+        assert configurations.Get("Connectivity")["custom_type"] == "binary_sensor"
+        # Found by pattern:
+        assert configurations.Get("SelfDiagnostics - IoTuring.update_ms.Time")["unit_of_measurement"] == "ms"
+        assert configurations.Get("Not configured") == {}
+
+        # Callers get a copy they can change:
+        configurations.Get("Connectivity").pop("custom_type")
+        assert "custom_type" in configurations.Get("Connectivity")
+
+    def testUserFile(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("IOTURING_CONFIG_DIR", str(tmp_path))
+        (tmp_path / "entities.yaml").write_text(
+            "Connectivity:\n  icon: mdi:lan\n"
+            "SelfDiagnostics - .*:\n  icon: mdi:robot\n")
+        configurations = MakeConfigurations()
+
+        assert configurations.Get("Connectivity") == {
+            "custom_type": "binary_sensor", "device_class": "connectivity", "icon": "mdi:lan"}
+        # User patterns are tried first:
+        assert configurations.Get("SelfDiagnostics - IoTuring.update_ms.Time") == {"icon": "mdi:robot"}
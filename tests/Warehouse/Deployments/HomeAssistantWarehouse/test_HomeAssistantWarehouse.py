@@ -0,0 +1,286 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from IoTuring.ClassManager.consts import KEY_ENTITY, KEY_WAREHOUSE
+from IoTuring.Configurator.Configuration import SingleConfiguration, CONFIG_CLASS
+from IoTuring.Entity.Entity import Entity
+from IoTuring.Entity.EntityData import EntitySensor
+from IoTuring.MyApp.App import App
+from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
+from IoTuring.Settings.SettingsManager import SettingsManager
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings
+from IoTuring.Warehouse.Warehouse import Warehouse
+from IoTuring.Warehouse.Deployments.HomeAssistantWarehouse import HomeAssistantWarehouse as HomeAssistantModule
+from IoTuring.Warehouse.Deployments.HomeAssistantWarehouse.HomeAssistantWarehouse import HomeAssistantWarehouse
+
+SENSOR_TOPIC = "homeassistant/sensor/IoTuring/pc_Entity_Fake_{}/config"
+DEVICE_TOPIC = "homeassistant/device/IoTuring_pc/config"
+CONNECTIVITY_TOPIC = "homeassistant/binary_sensor/IoTuring/pc_connectivity/config"
+VALUES_TOPIC = "IoTuring/pcHomeAssistant/{}"
+
+
+class FakeEntity(Entity):
+    NAME = "Fake"
+
+    def __init__(self, keys, extraAttributes=False) -> None:
+        self.keys = keys
+        self.extraAttributes = extraAttributes
+        super().__init__(SingleConfiguration(
+            CONFIG_CLASS[KEY_ENTITY], {"type": self.NAME}))
+
+    def Initialize(self):
+        for key in self.keys:
+            self.RegisterEntitySensor(EntitySensor(
+                self, key, supportsExtraAttributes=self.extraAttributes))
+
+
+class FakeClient:
+    """ Records what is published, always connected """
+
+    def __init__(self) -> None:
+        self.sent = []
+        self.subscriptions = {}
+
+    def SendTopicData(self, topic, data, retain=False):
+        self.sent.append((topic, data, retain))
+
+    def AddNewTopicToSubscribeTo(self, topic, callback):
+        self.subscriptions[topic] = callback
+
+    def IsConnected(self):
+        return True
+
+    def GetConnectionCount(self):
+        return 1
+
+    def __getattr__(self, name):
+        # Connection settings and callbacks are not used:
+        return lambda *args, **kwargs: None
+
+    def PopSent(self) -> dict:
+        """ Payloads published since the last call, by topic """
+        sent = {topic: data for topic, data, retain in self.sent}
+        self.sent = []
+        return sent
+
+
+class FakeTimer:
+    """ Started timers wait until the test runs them """
+
+    def __init__(self, delay, function) -> None:
+        self.delay = delay
+        self.function = function
+        self.alive = False
+        self.daemon = False
+
+    def start(self):
+        self.alive = True
+        FakeTimer.started.append(self)
+
+    def is_alive(self):
+        return self.alive
+
+    def run(self):
+        self.alive = False
+        self.function()
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("IOTURING_CONFIG_DIR", str(tmp_path))
+    SettingsManager().AddSettings(
+        [AppSettings(AppSettings.GetDefaultConfigurations(), early_init=False)])
+    # No connection and no loop thread:
+    monkeypatch.setattr(MQTTClient, "GetSharedClient",
+                        staticmethod(lambda *args, **kwargs: FakeClient()))
+    monkeypatch.setattr(Warehouse, "Start", lambda self: None)
+
+
+def MakeWarehouse(monkeypatch, entities, **configurations) -> HomeAssistantWarehouse:
+    for entity in entities:
+        assert entity.CallInitialize()
+    monkeypatch.setattr(HomeAssistantWarehouse, "GetEntities", lambda self: entities)
+
+    warehouse = HomeAssistantWarehouse(SingleConfiguration(CONFIG_CLASS[KEY_WAREHOUSE], {
+        "type": HomeAssistantWarehouse.NAME, "address": "localhost", "name": "pc", **configurations}))
+    warehouse.Start()
+    return warehouse
+
+
+class TestDiscovery:
+    def testSentOnceRetained(self, monkeypatch):
+        warehouse = MakeWarehouse(monkeypatch, [FakeEntity(["a", "b"])])
+        warehouse.SendEntityDataConfigurations()
+
+        sent = warehouse.client.sent
+        assert {topic for topic, _, _ in sent} == {
+            SENSOR_TOPIC.format("a"), SENSOR_TOPIC.format("b"),
+            "homeassistant/binary_sensor/IoTuring/pc_connectivity/config"}
+        assert all(retain for _, _, retain in sent)
+        payload = json.loads(warehouse.client.PopSent()[SENSOR_TOPIC.format("a")])
+        assert payload["unique_id"] == "pc.Entity.Fake.a"
+        assert payload["state_topic"] == "IoTuring/pcHomeAssistant/Entity/Fake/a"
+
+        # Unchanged payloads are not sent again, unless forced:
+        warehouse.SendEntityDataConfigurations()
+        assert warehouse.client.PopSent() == {}
+        warehouse.SendEntityDataConfigurations(force=True)
+        assert len(warehouse.client.PopSent()) == 3
+
+    def testDevicePayload(self, monkeypatch):
+        warehouse = MakeWarehouse(monkeypatch, [FakeEntity(["a"])], device_discovery="Y")
+        warehouse.SendEntityDataConfigurations()
+
+        # A single retained message, with the device once:
+        assert [(topic, retain) for topic, _, retain in warehouse.client.sent] == [(DEVICE_TOPIC, True)]
+        assert json.loads(warehouse.client.PopSent()[DEVICE_TOPIC]) == {
+            "device": {
+                "name": "pc",
+                "model": "pc",
+                "identifiers": "pc",
+                "manufacturer": f"{App.getName()} by {App.getVendor()}",
+                "sw_version": App.getVersion()
+            },
+            "origin": {
+                "name": App.getName(),
+                "sw_version": App.getVersion(),
+                "support_url": App.getUrlHomepage()
+            },
+            "components": {
+                "pc_connectivity": {
+                    "device_class": "connectivity",
+                    "name": "pc Connectivity",
+                    "unique_id": "pc.connectivity",
+                    "state_topic": VALUES_TOPIC.format("LWT"),
+                    "payload_on": "ONLINE",
+                    "payload_off": "OFFLINE",
+                    "platform": "binary_sensor"
+                },
+                "pc_Entity_Fake_a": {
+                    "name": "pc Fake",
+                    "unique_id": "pc.Entity.Fake.a",
+                    "availability_topic": VALUES_TOPIC.format("LWT"),
+                    "payload_available": "ONLINE",
+                    "payload_not_available": "OFFLINE",
+                    "state_topic": VALUES_TOPIC.format("Entity/Fake/a"),
+                    "expire_after": 600,
+                    "platform": "sensor"
+                }
+            }
+        }
+
+    def testRemovedEntityData(self, monkeypatch):
+        first = MakeWarehouse(monkeypatch, [FakeEntity(["a", "b"])])
+        first.SendEntityDataConfigurations()
+
+        # Next start without b: its configuration is emptied, nothing is subscribed for it
+        second = MakeWarehouse(monkeypatch, [FakeEntity(["a"])])
+        second.SendEntityDataConfigurations()
+        sent = second.client.PopSent()
+        assert sent[SENSOR_TOPIC.format("b")] == ""
+        assert json.loads(sent[SENSOR_TOPIC.format("a")])["unique_id"] == "pc.Entity.Fake.a"
+        assert not [topic for topic in second.client.subscriptions if topic.startswith("homeassistant/+")]
+
+        third = MakeWarehouse(monkeypatch, [FakeEntity(["a"])])
+        third.SendEntityDataConfigurations()
+        assert SENSOR_TOPIC.format("b") not in third.client.PopSent()
+
+    def testRemovedComponent(self, monkeypatch):
+        first = MakeWarehouse(monkeypatch, [FakeEntity(["a", "b"])])
+        first.SendEntityDataConfigurations()
+
+        # Per entity configurations are emptied when switching to device based discovery:
+        second = MakeWarehouse(monkeypatch, [FakeEntity(["a", "b"])], device_discovery="Y")
+        second.SendEntityDataConfigurations()
+        sent = second.client.PopSent()
+        assert sent[SENSOR_TOPIC.format("a")] == sent[SENSOR_TOPIC.format("b")] == ""
+        assert set(json.loads(sent[DEVICE_TOPIC])["components"]) == {
+            "pc_Entity_Fake_a", "pc_Entity_Fake_b", "pc_connectivity"}
+
+        # Removed components are sent with their platform only:
+        third = MakeWarehouse(monkeypatch, [FakeEntity(["a"])], device_discovery="Y")
+        third.SendEntityDataConfigurations()
+        sent = third.client.PopSent()
+        assert list(sent) == [DEVICE_TOPIC]
+        components = json.loads(sent[DEVICE_TOPIC])["components"]
+        assert components["pc_Entity_Fake_b"] == {"platform": "sensor"}
+        assert components["pc_Entity_Fake_a"]["platform"] == "sensor"
+
+
+class TestBirthMessage:
+    def testResendBurst(self, monkeypatch):
+        FakeTimer.started = []
+        monkeypatch.setattr(HomeAssistantModule, "Timer", FakeTimer)
+        entity = FakeEntity(["a", "b"])
+        warehouse = MakeWarehouse(monkeypatch, [entity])
+        entity.SetEntitySensorValue("a", 1)
+        entity.SetEntitySensorValue("b", "on")
+        entity.CommitSnapshot()
+        warehouse.SendEntityDataConfigurations()
+        warehouse.client.PopSent()
+
+        # Retained or offline status is ignored:
+        warehouse.OnBirthMessage(SimpleNamespace(retain=True, payload=b"online"))
+        warehouse.OnBirthMessage(SimpleNamespace(retain=False, payload=b"offline"))
+        assert FakeTimer.started == []
+
+        # A burst of birth messages schedules a single resend, after a random delay:
+        for _ in range(3):
+            warehouse.OnBirthMessage(SimpleNamespace(retain=False, payload=b"online"))
+        assert len(FakeTimer.started) == 1
+        assert 0 <= FakeTimer.started[0].delay <= HomeAssistantModule.BIRTH_JITTER_SECONDS
+        assert warehouse.client.PopSent() == {}
+
+        # Discovery first, retained, then all the values:
+        FakeTimer.started[0].run()
+        sent = warehouse.client.sent
+        assert [(topic, retain) for topic, _, retain in sent[:3]] == [
+            (CONNECTIVITY_TOPIC, True), (SENSOR_TOPIC.format("a"), True), (SENSOR_TOPIC.format("b"), True)]
+        assert len(sent) == 6
+        assert {topic: data for topic, data, retain in sent[3:] if not retain} == {
+            VALUES_TOPIC.format("LWT"): "ONLINE",
+            VALUES_TOPIC.format("Entity/Fake/a"): "1",
+            VALUES_TOPIC.format("Entity/Fake/b"): "on"}
+
+        # Scheduled again at the next birth:
+        warehouse.OnBirthMessage(SimpleNamespace(retain=False, payload=b"online"))
+        assert len(FakeTimer.started) == 2
+
+
+class TestJsonState:
+    def testTemplates(self, monkeypatch):
+        warehouse = MakeWarehouse(monkeypatch, [FakeEntity(["a"], extraAttributes=True)], json_state="Y")
+        warehouse.SendEntityDataConfigurations()
+
+        payload = json.loads(warehouse.client.PopSent()[SENSOR_TOPIC.format("a")])
+        assert payload["state_topic"] == payload["json_attributes_topic"] == VALUES_TOPIC.format("Entity/Fake_state")
+        assert payload["value_template"] == '{{ value_json["state"]["a"] }}'
+        assert payload["json_attributes_template"] == '{{ value_json["attributes"].get("a", {}) | tojson }}'
+
+    def testOneMessagePerEntity(self, monkeypatch):
+        entity = FakeEntity(["a", "b"], extraAttributes=True)
+        warehouse = MakeWarehouse(monkeypatch, [entity], json_state="Y")
+        entity.SetEntitySensorValue("a", 1)
+        entity.SetEntitySensorExtraAttribute("a", "Free", 5)
+        entity.SetEntitySensorValue("b", 2)
+        entity.CommitSnapshot()
+
+        warehouse.SendAllValues()
+        assert warehouse.client.PopSent() == {
+            VALUES_TOPIC.format("LWT"): "ONLINE",
+            VALUES_TOPIC.format("Entity/Fake_state"): json.dumps(
+                {"state": {"a": "1", "b": "2"}, "attributes": {"a": {"Free": "5"}}})}
+
+        # A changed sensor sends the whole state of its entity:
+        entity.SetEntitySensorValue("b", 3)
+        entity.CommitSnapshot()
+        warehouse.LoopChanges([entity.GetSnapshot().GetSensorByKey("b")])
+        assert warehouse.client.PopSent() == {
+            VALUES_TOPIC.format("Entity/Fake_state"): json.dumps(
+                {"state": {"a": "1", "b": "3"}, "attributes": {"a": {"Free": "5"}}})}
+
+        # Unchanged, nothing is sent:
+        warehouse.LoopChanges([entity.GetSnapshot().GetSensorByKey("b")])
+        assert warehouse.client.PopSent() == {}
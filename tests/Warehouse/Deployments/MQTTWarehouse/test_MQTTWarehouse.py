@@ -0,0 +1,100 @@
+import pytest
+
+from IoTuring.ClassManager.consts import KEY_ENTITY, KEY_WAREHOUSE
+from IoTuring.Configurator.Configuration import SingleConfiguration, CONFIG_CLASS
+from IoTuring.Entity.Entity import Entity
+from IoTuring.Entity.EntityData import EntitySensor
+from IoTuring.Entity.EntityManager import EntityManager
+from IoTuring.Protocols.MQTTClient.MQTTClient import MQTTClient
+from IoTuring.Settings.SettingsManager import SettingsManager
+from IoTuring.Settings.Deployments.AppSettings.AppSettings import AppSettings
+from IoTuring.Warehouse.Warehouse import Warehouse
+from IoTuring.Warehouse.Deployments.MQTTWarehouse.MQTTWarehouse import MQTTWarehouse
+
+VALUES_TOPIC = "IoTuring/pc/Entity/Fake/{}"
+
+
+class FakeEntity(Entity):
+    NAME = "Fake"
+
+    def __init__(self, key, value) -> None:
+        self.key = key
+        self.value = value
+        super().__init__(SingleConfiguration(
+            CONFIG_CLASS[KEY_ENTITY], {"type": self.NAME}))
+
+    def Initialize(self):
+        self.RegisterEntitySensor(EntitySensor(self, self.key))
+        self.SetEntitySensorValue(self.key, self.value)
+        self.CommitSnapshot()
+
+    def GetSensorSnapshot(self):
+        return self.GetSnapshot().GetSensorByKey(self.key)
+
+
+class FakeClient:
+    """ Records what is published """
+
+    def __init__(self) -> None:
+        self.sent = {}
+
+    def SendTopicData(self, topic, data, retain=False):
+        self.sent[topic] = data
+
+    def __getattr__(self, name):
+        # Connection settings and subscriptions are not used:
+        return lambda *args, **kwargs: None
+
+    def PopSent(self) -> dict:
+        """ Payloads published since the last call, by topic """
+        sent, self.sent = self.sent, {}
+        return sent
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    SettingsManager().AddSettings(
+        [AppSettings(AppSettings.GetDefaultConfigurations(), early_init=False)])
+    # No connection, no loop thread and no commands file:
+    monkeypatch.setattr(MQTTClient, "GetSharedClient",
+                        staticmethod(lambda *args, **kwargs: FakeClient()))
+    monkeypatch.setattr(Warehouse, "Start", lambda self: None)
+    monkeypatch.setattr(MQTTWarehouse, "ExportCommandsTopics", lambda self: None)
+    monkeypatch.setattr(EntityManager(), "activeEntities", [])
+
+
+def AddEntity(key, value) -> FakeEntity:
+    entity = FakeEntity(key, value)
+    assert entity.CallInitialize()
+    EntityManager().AddActiveEntity(entity)
+    return entity
+
+
+def MakeWarehouse() -> MQTTWarehouse:
+    warehouse = MQTTWarehouse(SingleConfiguration(CONFIG_CLASS[KEY_WAREHOUSE], {
+        "type": MQTTWarehouse.NAME, "address": "localhost", "name": "pc"}))
+    warehouse.Start()
+    return warehouse
+
+
+class TestPublishPlan:
+    def testRebuiltWhenEntitiesChange(self):
+        first = AddEntity("a", 1)
+        warehouse = MakeWarehouse()
+
+        warehouse.Loop()
+        assert warehouse.client.PopSent() == {VALUES_TOPIC.format("a"): "1"}
+        warehouse.LoopChanges([first.GetSensorSnapshot()])
+        assert warehouse.client.PopSent() == {}
+
+        # A new entity is published, the filters of the others are kept:
+        second = AddEntity("b", 2)
+        warehouse.LoopChanges([first.GetSensorSnapshot(), second.GetSensorSnapshot()])
+        assert warehouse.client.PopSent() == {VALUES_TOPIC.format("b"): "2"}
+
+        # An unloaded entity isn't published anymore:
+        EntityManager().UnloadEntity(first)
+        warehouse.LoopChanges([first.GetSensorSnapshot()])
+        assert warehouse.client.PopSent() == {}
+        warehouse.Loop()
+        assert warehouse.client.PopSent() == {VALUES_TOPIC.format("b"): "2"}